@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Decode-step benchmark for the TrackStore Kinesis consumer.
+
+Compares the per-record path (json.loads + Pydantic LocationRecord) with the
+batch path in app.decoding on batches of synthetic Kinesis records, without
+touching DynamoDB, and reports the memory each result holds per fix.
+
+Usage:
+    python bench/decode.py --records 10000 --repeat 5
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from run import TRACKSTORE_DIR, synthetic_fleet
+
+sys.path.insert(0, TRACKSTORE_DIR)
+from app import telemetry_codec  # noqa: E402
+from app.decoding import JSON_BACKEND, decode_records  # noqa: E402
+from app.models import LocationRecord  # noqa: E402
+
+
+def legacy_decode(records: List[Dict[str, Any]]) -> List[LocationRecord]:
+    """The consumer's original decode step, one record at a time"""
+    locations = []
+    for record in records:
+        data = json.loads(record['Data'])
+        locations.append(LocationRecord(
+            busId=data.get('busId'),
+            lat=data.get('lat'),
+            lon=data.get('lon'),
+            ts=data.get('ts'),
+            speed=data.get('speed'),
+            heading=data.get('heading'),
+            accuracy=data.get('accuracy'),
+            processed_at=data.get('processed_at'),
+            region=data.get('region'),
+            quality_score=data.get('quality_score')
+        ))
+    return locations
+
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def retained_bytes(fn: Callable[[], Any]) -> int:
+    """Bytes still allocated by the result of fn() once it returns"""
+    tracemalloc.start()
+    try:
+        result = fn()  # noqa: F841 - kept alive while measuring
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TrackStore record decoding")
+    parser.add_argument("--records", type=int, default=10000, help="Records per batch")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path; the best is reported")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+
+    buses = max(args.records // 20, 1)
+    messages = synthetic_fleet(buses, -(-args.records // buses), 5.0, args.seed)[:args.records]
+    now = int(time.time() * 1000)
+    for m in messages:
+        m.update(processed_at=now, region="other", quality_score="high")
+
+    json_records = [{"Data": json.dumps(m).encode()} for m in messages]
+    binary_records = [{"Data": telemetry_codec.encode([m])} for m in messages]
+
+    paths = [
+        ("json.loads + LocationRecord", lambda: legacy_decode(json_records)),
+        (f"decode_records, JSON ({JSON_BACKEND})", lambda: decode_records(json_records)),
+        ("decode_records, binary", lambda: decode_records(binary_records)),
+    ]
+    rows = [(name, best_of(fn, args.repeat), retained_bytes(fn)) for name, fn in paths]
+    baseline = rows[0][1]
+    print(f"{'path':<36}{'ms':>10}{'rec/s':>12}{'speedup':>9}{'B/fix':>8}")
+    for name, seconds, retained in rows:
+        print(f"{name:<36}{seconds * 1000:>10.1f}{args.records / seconds:>12.0f}{baseline / seconds:>8.1f}x"
+              f"{retained / args.records:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""
+In-memory stand-ins for the AWS clients used by TrackStore and the Lambdas.
+
+Each fake mimics the slice of the boto3 API the services actually call and
+runs every operation through a FaultInjector, so benchmarks can add per-call
+latency and throttling without touching the network.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+
+class FaultInjector:
+    """Adds latency and random throttling to fake AWS calls and times them."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 throttle_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, List[float]] = defaultdict(list)
+        self.throttles: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def call(self, operation: str, throttle_code: str = "ThrottlingException"):
+        start = time.perf_counter()
+        with self._lock:
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            throttled = self._rng.random() < self.throttle_rate
+        if delay > 0:
+            time.sleep(delay / 1000)
+        try:
+            if throttled:
+                with self._lock:
+                    self.throttles[operation] += 1
+                raise ClientError(
+                    {"Error": {"Code": throttle_code, "Message": "Rate exceeded (injected)"}},
+                    operation
+                )
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.calls[operation].append(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttles.clear()
+
+
+# ---------------------------------------------------------------------------
+# DynamoDB
+# ---------------------------------------------------------------------------
+
+_PATH_TOKEN = re.compile(r"[^.]+")
+
+
+def _split_top_level(expr: str, sep: str = ",") -> List[str]:
+    parts, depth, current = [], 0, []
+    for ch in expr:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == sep and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _split_keyword(expr: str, keyword: str) -> List[str]:
+    """Split on a keyword such as ' OR ' outside parentheses."""
+    parts, depth, start, i = [], 0, 0, 0
+    while i < len(expr):
+        if expr[i] == "(":
+            depth += 1
+        elif expr[i] == ")":
+            depth -= 1
+        elif depth == 0 and expr.upper().startswith(keyword, i):
+            parts.append(expr[start:i])
+            i += len(keyword)
+            start = i
+            continue
+        i += 1
+    parts.append(expr[start:])
+    return [p.strip() for p in parts]
+
+
+def _wrapped(expr: str) -> bool:
+    """True if the whole expression is enclosed in one pair of parentheses."""
+    if not (expr.startswith("(") and expr.endswith(")")):
+        return False
+    depth = 0
+    for i, ch in enumerate(expr):
+        depth += ch == "("
+        depth -= ch == ")"
+        if depth == 0 and i < len(expr) - 1:
+            return False
+    return True
+
+
+class _FakeEvents:
+    """Accepts botocore event handlers (such as metrics hooks) and never emits."""
+
+    def register(self, event_name: str, handler, *args, **kwargs):
+        pass
+
+
+class _FakeMeta:
+    def __init__(self, client: Any = None):
+        self.events = _FakeEvents()
+        self.client = client
+
+
+class FakeTable:
+    """Dict-backed DynamoDB table supporting the Table resource calls we use."""
+
+    def __init__(self, name: str, hash_key: str, range_key: Optional[str],
+                 faults: FaultInjector):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.faults = faults
+        self.items: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.table_status = "ACTIVE"
+
+    def _key(self, item: Dict[str, Any]) -> Tuple[Any, ...]:
+        if self.range_key:
+            return (item[self.hash_key], item[self.range_key])
+        return (item[self.hash_key],)
+
+    def put_item(self, Item: Dict[str, Any], ConditionExpression: Optional[str] = None,
+                 ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                 ExpressionAttributeValues: Optional[Dict[str, Any]] = None, **kwargs):
+        with self.faults.call(f"{self.name}.PutItem", "ProvisionedThroughputExceededException"):
+            with self._lock:
+                current = self.items.get(self._key(Item))
+                self._check_condition(current or {}, ConditionExpression,
+                                      ExpressionAttributeNames or {}, ExpressionAttributeValues or {},
+                                      "PutItem")
+                self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def get_item(self, Key: Dict[str, Any], **kwargs):
+        with self.faults.call(f"{self.name}.GetItem", "ProvisionedThroughputExceededException"):
+            with self._lock:
+                item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def scan(self, **kwargs):
+        with self.faults.call(f"{self.name}.Scan", "ProvisionedThroughputExceededException"):
+            with self._lock:
+                items = [dict(i) for i in self.items.values()]
+        return {"Items": items, "Count": len(items)}
+
+    def delete_item(self, Key: Dict[str, Any], **kwargs):
+        with self.faults.call(f"{self.name}.DeleteItem", "ProvisionedThroughputExceededException"):
+            with self._lock:
+                self.items.pop(self._key(Key), None)
+        return {}
+
+    def update_item(self, Key: Dict[str, Any], UpdateExpression: str,
+                    ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                    ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+                    ConditionExpression: Optional[str] = None,
+                    **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.faults.call(f"{self.name}.UpdateItem", "ProvisionedThroughputExceededException"):
+            with self._lock:
+                current = self.items.get(self._key(Key), {})
+                self._check_condition(current, ConditionExpression, names, values, "UpdateItem")
+                item = self.items.setdefault(self._key(Key), dict(Key))
+                self._apply_set(item, UpdateExpression, names, values)
+        return {}
+
+    def _check_condition(self, item, expression: Optional[str], names, values, operation: str):
+        """Evaluate OR/AND-joined attribute_(not_)exists and comparison conditions."""
+        if expression and not self._condition(item, " ".join(expression.split()), names, values):
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException",
+                           "Message": "The conditional request failed"}},
+                operation
+            )
+
+    def _condition(self, item, expr: str, names, values) -> bool:
+        expr = expr.strip()
+        while _wrapped(expr):
+            expr = expr[1:-1].strip()
+        for joiner, combine in ((" OR ", any), (" AND ", all)):
+            parts = _split_keyword(expr, joiner)
+            if len(parts) > 1:
+                return combine(self._condition(item, part, names, values) for part in parts)
+        match = re.fullmatch(r"attribute_(not_)?exists\((.+)\)", expr)
+        if match:
+            exists = self._get_path(item, self._resolve_path(match.group(2), names)) is not None
+            return exists != bool(match.group(1))
+        match = re.fullmatch(r"(.+?)\s*(<>|<=|>=|<|>|=)\s*(.+)", expr)
+        if not match:
+            raise NotImplementedError(f"FakeTable cannot evaluate condition: {expr}")
+        left = self._operand(match.group(1), item, names, values)
+        right = self._operand(match.group(3), item, names, values)
+        if left is None or right is None:
+            return False
+        return {
+            "<": left < right, "<=": left <= right, ">": left > right,
+            ">=": left >= right, "=": left == right, "<>": left != right,
+        }[match.group(2)]
+
+    def _resolve_path(self, path: str, names: Dict[str, str]) -> List[str]:
+        return [names.get(tok, tok) for tok in _PATH_TOKEN.findall(path.strip())]
+
+    def _get_path(self, item: Dict[str, Any], path: List[str]):
+        node = item
+        for part in path:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _operand(self, expr: str, item, names, values):
+        expr = expr.strip()
+        if "+" in expr and not expr.startswith("if_not_exists"):
+            left, right = expr.rsplit("+", 1)
+            return self._operand(left, item, names, values) + self._operand(right, item, names, values)
+        match = re.fullmatch(r"if_not_exists\((.+?),(.+?)\)\s*(?:\+\s*(.+))?", expr)
+        if match:
+            current = self._get_path(item, self._resolve_path(match.group(1), names))
+            base = current if current is not None else self._operand(match.group(2), item, names, values)
+            if match.group(3):
+                return base + self._operand(match.group(3), item, names, values)
+            return base
+        if expr.startswith(":"):
+            return values[expr]
+        return self._get_path(item, self._resolve_path(expr, names))
+
+    def _apply_set(self, item, expression: str, names, values):
+        body = " ".join(expression.split())
+        if not body.upper().startswith("SET "):
+            raise NotImplementedError(f"FakeTable only supports SET updates: {expression}")
+        for clause in _split_top_level(body[4:]):
+            lhs, rhs = clause.split("=", 1)
+            path = self._resolve_path(lhs, names)
+            value = self._operand(rhs, item, names, values)
+            node = item
+            for part in path[:-1]:
+                node = node.setdefault(part, {})
+            node[path[-1]] = value
+
+    @contextmanager
+    def batch_writer(self, overwrite_by_pkeys=None):
+        writer = _FakeBatchWriter(self)
+        try:
+            yield writer
+        finally:
+            writer.flush()
+
+
+class _FakeBatchWriter:
+    """Buffers puts into 25-item BatchWriteItem calls, retrying throttled batches."""
+
+    def __init__(self, table: FakeTable):
+        self.table = table
+        self._buffer: List[Dict[str, Any]] = []
+
+    def put_item(self, Item: Dict[str, Any]):
+        self._buffer.append(Item)
+        if len(self._buffer) >= 25:
+            self.flush()
+
+    def flush(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer[:25], self._buffer[25:]
+            while True:
+                try:
+                    with self.table.faults.call(f"{self.table.name}.BatchWriteItem",
+                                                "ProvisionedThroughputExceededException"):
+                        with self.table._lock:
+                            for item in batch:
+                                self.table.items[self.table._key(item)] = dict(item)
+                    break
+                except ClientError:
+                    # boto3's batch_writer resubmits unprocessed items
+                    continue
+
+
+class FakeDynamoResource:
+    """Stand-in for boto3.resource('dynamodb')."""
+
+    KEY_SCHEMAS = {
+        "locations": ("deviceId", "timestamp"),
+        "devices": ("deviceId", None),
+        "stations": ("stationId", None),
+        "connections": ("connectionId", None),
+        "routes": ("routeId", None),
+        "travel-times": ("routeId", "segment"),
+        "geofences": ("id", None),
+        "sent-alerts": ("alertId", None),
+    }
+
+    def __init__(self, faults: FaultInjector):
+        self.faults = faults
+        self.tables: Dict[str, FakeTable] = {}
+        self.meta = _FakeMeta(client=self)
+
+    def Table(self, name: str) -> FakeTable:
+        if name not in self.tables:
+            hash_key, range_key = ("id", None)
+            for marker, schema in self.KEY_SCHEMAS.items():
+                if marker in name:
+                    hash_key, range_key = schema
+                    break
+            self.tables[name] = FakeTable(name, hash_key, range_key, self.faults)
+        return self.tables[name]
+
+
+# ---------------------------------------------------------------------------
+# Kinesis
+# ---------------------------------------------------------------------------
+
+class FakeKinesisClient:
+    """Sharded in-memory Kinesis stream supporting put and polling reads."""
+
+    def __init__(self, stream_name: str, shard_count: int, faults: FaultInjector):
+        self.stream_name = stream_name
+        self.faults = faults
+        self.meta = _FakeMeta()
+        self.shard_ids = [f"shardId-{i:012d}" for i in range(shard_count)]
+        self.shards: Dict[str, List[Dict[str, Any]]] = {sid: [] for sid in self.shard_ids}
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def _shard_for(self, partition_key: str) -> str:
+        digest = int(hashlib.md5(partition_key.encode()).hexdigest(), 16)
+        return self.shard_ids[digest % len(self.shard_ids)]
+
+    def _append(self, data, partition_key: str) -> Dict[str, str]:
+        if isinstance(data, str):
+            data = data.encode()
+        shard_id = self._shard_for(partition_key)
+        with self._lock:
+            self._sequence += 1
+            sequence = f"{self._sequence:056d}"
+            self.shards[shard_id].append({
+                "SequenceNumber": sequence,
+                "ApproximateArrivalTimestamp": datetime.now(timezone.utc),
+                "Data": data,
+                "PartitionKey": partition_key,
+            })
+        return {"ShardId": shard_id, "SequenceNumber": sequence}
+
+    def put_record(self, StreamName: str, Data, PartitionKey: str, **kwargs):
+        with self.faults.call("Kinesis.PutRecord", "ProvisionedThroughputExceededException"):
+            return self._append(Data, PartitionKey)
+
+    def put_records(self, StreamName: str, Records: List[Dict[str, Any]], **kwargs):
+        with self.faults.call("Kinesis.PutRecords", "ProvisionedThroughputExceededException"):
+            results = [self._append(r["Data"], r["PartitionKey"]) for r in Records]
+        return {"FailedRecordCount": 0, "Records": results}
+
+    def describe_stream(self, StreamName: str, **kwargs):
+        with self.faults.call("Kinesis.DescribeStream", "LimitExceededException"):
+            return {"StreamDescription": {
+                "StreamName": StreamName,
+                "StreamStatus": "ACTIVE",
+                "Shards": [{"ShardId": sid} for sid in self.shard_ids],
+            }}
+
+    def get_shard_iterator(self, StreamName: str, ShardId: str, ShardIteratorType: str, **kwargs):
+        with self.faults.call("Kinesis.GetShardIterator", "LimitExceededException"):
+            position = len(self.shards[ShardId]) if ShardIteratorType == "LATEST" else 0
+            return {"ShardIterator": f"{ShardId}:{position}"}
+
+    def get_records(self, ShardIterator: str, Limit: int = 10000, **kwargs):
+        with self.faults.call("Kinesis.GetRecords", "ProvisionedThroughputExceededException"):
+            shard_id, position = ShardIterator.rsplit(":", 1)
+            position = int(position)
+            with self._lock:
+                shard = self.shards[shard_id]
+                records = shard[position:position + Limit]
+                behind = shard[-1]["ApproximateArrivalTimestamp"] if len(shard) > position + len(records) else None
+            millis_behind = 0
+            if behind is not None:
+                millis_behind = int((behind - records[-1]["ApproximateArrivalTimestamp"]).total_seconds() * 1000)
+            return {
+                "Records": records,
+                "NextShardIterator": f"{shard_id}:{position + len(records)}",
+                "MillisBehindLatest": millis_behind,
+            }
+
+    def all_records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [r for sid in self.shard_ids for r in self.shards[sid]]
+
+
+# ---------------------------------------------------------------------------
+# Alert delivery
+# ---------------------------------------------------------------------------
+
+class FakeEventBridgeClient:
+    def __init__(self, faults: FaultInjector):
+        self.faults = faults
+        self.events: List[Dict[str, Any]] = []
+
+    def put_events(self, Entries: List[Dict[str, Any]], **kwargs):
+        with self.faults.call("EventBridge.PutEvents", "ThrottlingException"):
+            self.events.extend(Entries)
+        return {"FailedEntryCount": 0, "Entries": [{"EventId": str(len(self.events))}]}
+
+
+class _GoneException(Exception):
+    pass
+
+
+class FakeWebSocketClient:
+    class exceptions:
+        GoneException = _GoneException
+
+    def __init__(self, faults: FaultInjector):
+        self.faults = faults
+        self.messages: List[Tuple[str, bytes]] = []
+
+    def post_to_connection(self, Data: bytes, ConnectionId: str, **kwargs):
+        with self.faults.call("ApiGateway.PostToConnection", "LimitExceededException"):
+            self.messages.append((ConnectionId, Data))
+        return {}
+
+
+class FakeAWS:
+    """Bundle of fakes plus boto3.client/resource factories that hand them out."""
+
+    def __init__(self, stream_name: str, shard_count: int = 4, faults: Optional[FaultInjector] = None):
+        self.faults = faults or FaultInjector()
+        self.dynamodb = FakeDynamoResource(self.faults)
+        self.kinesis = FakeKinesisClient(stream_name, shard_count, self.faults)
+        self.events = FakeEventBridgeClient(self.faults)
+        self.websocket = FakeWebSocketClient(self.faults)
+
+    def client(self, service_name: str, *args, **kwargs):
+        return {
+            "kinesis": self.kinesis,
+            "events": self.events,
+            "apigatewaymanagementapi": self.websocket,
+        }[service_name]
+
+    def resource(self, service_name: str, *args, **kwargs):
+        if service_name != "dynamodb":
+            raise ValueError(f"No fake resource for {service_name}")
+        return self.dynamodb
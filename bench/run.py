@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark for the GPS pipeline.
+
+Replays a synthetic fleet through
+
+    ingestion handler -> Kinesis -> KinesisConsumer/DynamoStore
+                                 -> geofence alerts handler
+
+with every AWS dependency replaced by the in-memory fakes in fakes.py, and
+reports records/sec, per-call p50/p99 latency and allocations per stage.
+
+Usage:
+    python bench/run.py --buses 200 --fixes 50 --latency-ms 2 --throttle-rate 0.01
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+from unittest import mock
+
+import boto3
+
+from fakes import FakeAWS, FaultInjector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACKSTORE_DIR = os.path.join(ROOT, "services", "trackstore")
+INGESTION_SRC = os.path.join(ROOT, "services", "ingestion-lambda", "src")
+ALERTS_SRC = os.path.join(ROOT, "services", "geofence-alerts", "src")
+DEVICE_SIM_DIR = os.path.join(ROOT, "device-sim")
+
+STREAM_NAME = "bench-gps-stream"
+DEVICE_TABLE = "bench-devices"
+LOCATION_TABLE = "bench-locations"
+STATIONS_TABLE = "bench-stations"
+ROUTES_TABLE = "bench-routes"
+TRAVEL_TIMES_TABLE = "bench-travel-times"
+GEOFENCE_TABLE = "bench-geofences"
+SENT_ALERTS_TABLE = "bench-sent-alerts"
+CONNECTIONS_TABLE = "bench-connections"
+
+# University of Waterloo campus, matching the simulator's sample route
+CAMPUS_CENTER = (43.4705, -80.5420)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class StageResult:
+    """Timing and allocation figures for one pipeline stage."""
+
+    def __init__(self, name: str, records: int, elapsed: float, call_times: List[float],
+                 alloc_peak: int, alloc_total: int):
+        self.name = name
+        self.records = records
+        self.elapsed = elapsed
+        self.call_times = call_times
+        self.alloc_peak = alloc_peak
+        self.alloc_total = alloc_total
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.name,
+            "records": self.records,
+            "records_per_sec": round(self.records / self.elapsed, 1) if self.elapsed else 0.0,
+            "calls": len(self.call_times),
+            "p50_ms": round(percentile(self.call_times, 50) * 1000, 3),
+            "p99_ms": round(percentile(self.call_times, 99) * 1000, 3),
+            "alloc_peak_kb": round(self.alloc_peak / 1024, 1),
+            "alloc_per_record_bytes": round(self.alloc_total / self.records, 1) if self.records else 0.0,
+        }
+
+
+def measure(name: str, records: int, calls: List[Callable[[], Any]], track_allocs: bool = False) -> StageResult:
+    """
+    Run `calls` in order, timing each one.
+
+    With `track_allocs`, tracemalloc records peak and net allocations for the
+    stage. Tracing slows Python down considerably, so throughput numbers from
+    such a run should not be compared with untraced ones.
+    """
+    call_times = []
+    if track_allocs:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for call in calls:
+        t0 = time.perf_counter()
+        call()
+        call_times.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    peak = allocated = 0
+    if track_allocs:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated = sum(max(0, s.size_diff) for s in after.compare_to(before, "filename"))
+    return StageResult(name, records, elapsed, call_times, peak, allocated)
+
+
+def synthetic_fleet(buses: int, fixes: int, interval_s: float, seed: int) -> List[Dict[str, Any]]:
+    """Random-walk fixes around campus for `buses` vehicles, in publish order."""
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    start_ms = now_ms - int(fixes * interval_s * 1000)
+    positions = [
+        [CAMPUS_CENTER[0] + rng.uniform(-0.005, 0.005), CAMPUS_CENTER[1] + rng.uniform(-0.005, 0.005)]
+        for _ in range(buses)
+    ]
+    messages = []
+    for step in range(fixes):
+        for bus in range(buses):
+            pos = positions[bus]
+            pos[0] += rng.uniform(-0.0002, 0.0002)
+            pos[1] += rng.uniform(-0.0002, 0.0002)
+            messages.append({
+                "busId": f"bus-{bus:05d}",
+                "lat": round(pos[0], 6),
+                "lon": round(pos[1], 6),
+                "ts": start_ms + int((step * interval_s + bus * interval_s / buses) * 1000),
+                "speed": round(rng.uniform(0, 50), 1),
+                "heading": rng.randint(0, 359),
+                "accuracy": round(rng.uniform(3, 20), 1),
+            })
+    return messages
+
+
+def load_recording(path: str) -> List[Dict[str, Any]]:
+    """Load simulator NDJSON output, shifted so the last fix is timestamped now."""
+    with open(path) as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    if messages:
+        shift = int(time.time() * 1000) - max(m["ts"] for m in messages)
+        for m in messages:
+            m["ts"] += shift
+    return messages
+
+
+def load_lambda(module_name: str, src_dir: str, fake: FakeAWS, env: Dict[str, str]):
+    """Import a Lambda's index.py with boto3 patched to return fakes."""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(src_dir, "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, src_dir)
+    try:
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(boto3, "client", fake.client), \
+                mock.patch.object(boto3, "resource", fake.resource):
+            spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(src_dir)
+    return module
+
+
+def seed_stations(fake: FakeAWS, count: int, seed: int):
+    rng = random.Random(seed)
+    stations = fake.dynamodb.Table(STATIONS_TABLE)
+    for i in range(count):
+        stations.items[(f"station-{i:04d}",)] = {
+            "stationId": f"station-{i:04d}",
+            "name": f"Station {i}",
+            "latitude": str(CAMPUS_CENTER[0] + rng.uniform(-0.01, 0.01)),
+            "longitude": str(CAMPUS_CENTER[1] + rng.uniform(-0.01, 0.01)),
+        }
+    connections = fake.dynamodb.Table(CONNECTIONS_TABLE)
+    for i in range(5):
+        connections.items[(f"conn-{i}",)] = {"connectionId": f"conn-{i}"}
+
+
+def seed_routes(fake: FakeAWS, count: int, seed: int, stop_spacing_m: float = 400.0):
+    """
+    Seed the simulator's fleet routes (same count and seed as `offline.py
+    generate`), with a stop every `stop_spacing_m` metres along each.
+    """
+    sys.path.insert(0, DEVICE_SIM_DIR)
+    try:
+        from fleet import create_fleet_routes
+    finally:
+        sys.path.remove(DEVICE_SIM_DIR)
+
+    stations = fake.dynamodb.Table(STATIONS_TABLE)
+    routes = fake.dynamodb.Table(ROUTES_TABLE)
+    for r, points in enumerate(create_fleet_routes(count, seed)):
+        route_id = f"route-{r:02d}"
+        stop_ids = []
+        travelled, next_stop = 0.0, stop_spacing_m / 2
+        for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+            dy = (lat2 - lat1) * 111_320.0
+            dx = (lon2 - lon1) * 111_320.0 * math.cos(math.radians(lat1))
+            length = math.hypot(dx, dy)
+            while length and next_stop <= travelled + length:
+                t = (next_stop - travelled) / length
+                station_id = f"{route_id}-stop-{len(stop_ids):03d}"
+                stations.items[(station_id,)] = {
+                    "stationId": station_id,
+                    "name": f"Route {r} stop {len(stop_ids)}",
+                    "latitude": str(round(lat1 + t * (lat2 - lat1), 6)),
+                    "longitude": str(round(lon1 + t * (lon2 - lon1), 6)),
+                }
+                stop_ids.append(station_id)
+                next_stop += stop_spacing_m
+            travelled += length
+        routes.items[(route_id,)] = {
+            "routeId": route_id,
+            "points": [{"lat": str(lat), "lon": str(lon)} for lat, lon in points],
+            "stops": stop_ids,
+            "loop": True,
+        }
+
+
+def seed_zones(fake: FakeAWS, count: int, seed: int):
+    """Random star-shaped polygon geofences of 30-300 m across the city, in the geofence service's format"""
+    rng = random.Random(seed)
+    geofences = fake.dynamodb.Table(GEOFENCE_TABLE)
+    for i in range(count):
+        c_lat = CAMPUS_CENTER[0] + rng.uniform(-0.05, 0.05)
+        c_lon = CAMPUS_CENTER[1] + rng.uniform(-0.07, 0.07)
+        size_m = rng.uniform(30, 300)
+        vertices = rng.randint(4, 12)
+        points = []
+        for k in range(vertices):
+            angle = 2 * math.pi * k / vertices
+            r = size_m * rng.uniform(0.5, 1.0) / 111_320.0
+            points.append({
+                "lat": str(round(c_lat + r * math.sin(angle), 6)),
+                "lng": str(round(c_lon + r * math.cos(angle) / math.cos(math.radians(c_lat)), 6)),
+            })
+        geofences.items[(f"zone-{i:04d}",)] = {
+            "id": f"zone-{i:04d}",
+            "name": f"Zone {i}",
+            "type": "polygon",
+            "coordinates": {"points": points},
+            "isActive": True,
+            "metadata": {"category": "depot"},
+        }
+
+
+def fix_count(records: List[Dict[str, Any]]) -> int:
+    """Fixes carried by Kinesis records, counting every fix in an aggregated record"""
+    codec = sys.modules["telemetry_codec"]
+    return sum(len(codec.decode(r["Data"])) for r in records)
+
+
+def run_ingestion(fake: FakeAWS, messages: List[Dict[str, Any]], encoding: str, pack: int,
+                  track_allocs: bool) -> StageResult:
+    ingestion = load_lambda("bench_ingestion_index", INGESTION_SRC, fake, {
+        "KINESIS_STREAM_NAME": STREAM_NAME,
+        "KINESIS_ENCODING": encoding,
+    })
+    codec = sys.modules["telemetry_codec"]
+    packs = [messages[i:i + pack] for i in range(0, len(messages), pack)]
+    if encoding == "binary":
+        # Shape of the IoT rule event: SELECT encode(*, 'base64') AS data
+        events = [{"data": base64.b64encode(codec.encode(p)).decode()} for p in packs]
+    elif pack > 1:
+        events = [{"fixes": p} for p in packs]
+    else:
+        events = messages
+    return measure("ingestion_handler", len(messages),
+                   [lambda e=e: ingestion.handler(e, None) for e in events], track_allocs)
+
+
+def run_consumer(fake: FakeAWS, batch_size: int, duplicates: float, seed: int,
+                 track_allocs: bool) -> Tuple[List[StageResult], Dict[str, int]]:
+    sys.path.insert(0, TRACKSTORE_DIR)
+    try:
+        from app.dynamo_store import DynamoStore
+        from app.kinesis_consumer import KinesisConsumer
+    finally:
+        sys.path.remove(TRACKSTORE_DIR)
+
+    with mock.patch.object(boto3, "client", fake.client), \
+            mock.patch.object(boto3, "resource", fake.resource):
+        store = DynamoStore(DEVICE_TABLE, LOCATION_TABLE)
+        consumer = KinesisConsumer(STREAM_NAME, "us-east-1", store, batch_size=batch_size)
+
+    # Replay every shard from the start in get_records-sized batches
+    batches = []
+    for shard_id in fake.kinesis.shard_ids:
+        shard = fake.kinesis.shards[shard_id]
+        batches.extend(shard[i:i + batch_size] for i in range(0, len(shard), batch_size))
+
+    # At-least-once delivery: read a random share of the records a second time
+    if duplicates > 0:
+        records = [r for b in batches for r in b]
+        again = random.Random(seed).sample(records, int(len(records) * duplicates))
+        batches.extend(again[i:i + batch_size] for i in range(0, len(again), batch_size))
+
+    total = fix_count([r for b in batches for r in b])
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    fake.faults.reset()
+    try:
+        consume = measure("kinesis_consumer", total,
+                          [lambda b=b: loop.run_until_complete(consumer._process_records(b)) for b in batches],
+                          track_allocs)
+    finally:
+        loop.close()
+
+    stages = [consume]
+    for operation in (f"{LOCATION_TABLE}.BatchWriteItem", f"{DEVICE_TABLE}.UpdateItem"):
+        times = list(fake.faults.calls.get(operation, []))
+        stages.append(StageResult(f"dynamo:{operation.split('.', 1)[1]}", len(times), sum(times), times, 0, 0))
+    return stages, {
+        "duplicates_dropped": consumer.duplicates_dropped,
+        "outliers_rejected": consumer.outliers_rejected,
+        "fixes_suppressed": consumer.fixes_suppressed,
+    }
+
+
+def run_alerts(fake: FakeAWS, batch_size: int, routes: int, zones: int,
+               track_allocs: bool) -> Tuple[StageResult, int]:
+    env = {
+        "WEBSOCKET_ENDPOINT": "https://bench.invalid",
+        "DEVICE_TABLE_NAME": DEVICE_TABLE,
+        "STATIONS_TABLE_NAME": STATIONS_TABLE,
+        "CONNECTIONS_TABLE_NAME": CONNECTIONS_TABLE,
+        "SENT_ALERTS_TABLE_NAME": SENT_ALERTS_TABLE,
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+    if routes:
+        env["ROUTES_TABLE_NAME"] = ROUTES_TABLE
+        env["TRAVEL_TIMES_TABLE_NAME"] = TRAVEL_TIMES_TABLE
+    if zones:
+        env["GEOFENCE_TABLE_NAME"] = GEOFENCE_TABLE
+    alerts = load_lambda("bench_alerts_index", ALERTS_SRC, fake, env)
+    redelivered = 0
+
+    def deliver(batch: List[Dict[str, Any]]):
+        # As an event source mapping with ReportBatchItemFailures: redeliver
+        # from the first failed record until the batch goes through
+        nonlocal redelivered
+        while batch:
+            response = alerts.handler({"Records": [
+                {
+                    "eventID": f"{r['PartitionKey']}:{r['SequenceNumber']}",
+                    "kinesis": {
+                        "data": base64.b64encode(r["Data"]).decode(),
+                        "sequenceNumber": r["SequenceNumber"],
+                        "partitionKey": r["PartitionKey"],
+                        "approximateArrivalTimestamp": r["ApproximateArrivalTimestamp"].timestamp(),
+                    },
+                }
+                for r in batch
+            ]}, None)
+            failed = {f["itemIdentifier"] for f in response.get("batchItemFailures", [])}
+            if not failed:
+                return
+            batch = batch[next(i for i, r in enumerate(batch) if r["SequenceNumber"] in failed):]
+            redelivered += len(batch)
+
+    # Lambda polls each shard separately, so a batch never mixes shards
+    batches = []
+    for shard_id in fake.kinesis.shard_ids:
+        shard = fake.kinesis.shards[shard_id]
+        batches.extend(shard[i:i + batch_size] for i in range(0, len(shard), batch_size))
+    stage = measure("alerts_handler", fix_count(fake.kinesis.all_records()),
+                    [lambda b=b: deliver(b) for b in batches], track_allocs)
+    return stage, redelivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GPS pipeline against in-memory AWS fakes.")
+    parser.add_argument("--input", default=None, help="Replay simulator NDJSON output instead of a synthetic fleet")
+    parser.add_argument("--buses", type=int, default=200, help="Number of simulated buses")
+    parser.add_argument("--fixes", type=int, default=20, help="Fixes per bus")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between fixes per bus")
+    parser.add_argument("--shards", type=int, default=4, help="Fake Kinesis shard count")
+    parser.add_argument("--stations", type=int, default=50, help="Stations seeded for the alerts handler")
+    parser.add_argument("--routes", type=int, default=0,
+                        help="Seed this many simulator routes for map-matched alerts (match --routes/--seed of the recording)")
+    parser.add_argument("--zones", type=int, default=0, help="Polygon geofences seeded for the alerts handler")
+    parser.add_argument("--batch-size", type=int, default=100, help="Kinesis records per consumer/alerts batch")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Injected latency per AWS call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency per AWS call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of AWS calls that throttle")
+    parser.add_argument("--encoding", choices=["json", "binary"], default="json",
+                        help="Device payload and Kinesis record format")
+    parser.add_argument("--pack", type=int, default=1, help="Fixes per device message (as the simulator's --pack)")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="Fraction of Kinesis records the consumer reads twice")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--allocs", action="store_true", help="Track allocations with tracemalloc (slows every stage)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    # Injected throttles are logged per record by the services; keep the report readable
+    logging.disable(logging.CRITICAL)
+
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.throttle_rate, args.seed)
+    fake = FakeAWS(STREAM_NAME, args.shards, faults)
+    seed_stations(fake, args.stations, args.seed)
+    if args.routes:
+        seed_routes(fake, args.routes, args.seed)
+    if args.zones:
+        seed_zones(fake, args.zones, args.seed)
+    if args.input:
+        messages = load_recording(args.input)
+    else:
+        messages = synthetic_fleet(args.buses, args.fixes, args.interval, args.seed)
+
+    results = [run_ingestion(fake, messages, args.encoding, args.pack, args.allocs)]
+    consumer_stages, filtered = run_consumer(fake, args.batch_size, args.duplicates, args.seed, args.allocs)
+    results.extend(consumer_stages)
+    fake.faults.reset()
+    alerts_stage, redelivered = run_alerts(fake, args.batch_size, args.routes, args.zones, args.allocs)
+    results.append(alerts_stage)
+
+    rows = [r.as_dict() for r in results]
+    if args.json:
+        print(json.dumps({"results": rows, "throttles": dict(faults.throttles), "alerts_redelivered": redelivered,
+                          **filtered}, indent=2))
+        return
+
+    header = f"{'stage':<24}{'records':>9}{'rec/s':>11}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>10}{'B/rec':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['stage']:<24}{row['records']:>9}{row['records_per_sec']:>11}{row['calls']:>8}"
+              f"{row['p50_ms']:>10}{row['p99_ms']:>10}{row['alloc_peak_kb']:>10}{row['alloc_per_record_bytes']:>9}")
+    if any(filtered.values()):
+        print(f"\nDuplicate fixes dropped: {filtered['duplicates_dropped']}, "
+              f"outliers flagged: {filtered['outliers_rejected']}, "
+              f"stationary fixes suppressed: {filtered['fixes_suppressed']}")
+    if faults.throttles:
+        print(f"\nInjected throttles: {dict(faults.throttles)}")
+    if redelivered:
+        print(f"Kinesis records redelivered to the alerts handler: {redelivered}")
+
+
+if __name__ == "__main__":
+    main()
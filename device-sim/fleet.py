@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Fleet mode for the GPS Device Simulator
+Runs thousands of virtual buses over several routes from a single process
+(or a few processes sharded across cores) for ingestion load testing
+"""
+
+import asyncio
+import math
+import multiprocessing
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import click
+import numpy as np
+from dotenv import load_dotenv
+
+from route_geometry import RouteNetwork
+from simulator import AWSIoTClient, PublishStats, create_sample_route
+from sinks import open_sink
+
+# Load environment variables
+load_dotenv()
+
+Route = List[Tuple[float, float]]
+
+
+def create_fleet_routes(count: int, seed: int = 0) -> List[Route]:
+    """
+    Derive `count` distinct loop routes from the sample campus route.
+
+    Each variant is the sample loop rotated, scaled and shifted around its
+    centroid, with every other route driven in the opposite direction, which
+    keeps the traffic inside the Waterloo area while spreading it out.
+    """
+    base = create_sample_route()
+    rng = random.Random(seed)
+    c_lat = sum(p[0] for p in base) / len(base)
+    c_lon = sum(p[1] for p in base) / len(base)
+    lon_scale = math.cos(math.radians(c_lat))
+
+    routes = [base]
+    for i in range(1, count):
+        angle = rng.uniform(0, 2 * math.pi)
+        scale = rng.uniform(1.0, 6.0)
+        shift_lat = rng.uniform(-0.03, 0.03)
+        shift_lon = rng.uniform(-0.04, 0.04)
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+
+        route = []
+        for lat, lon in base:
+            # Rotate in a locally-flat frame so the loop keeps its shape
+            y = (lat - c_lat) * scale
+            x = (lon - c_lon) * lon_scale * scale
+            route.append((
+                round(c_lat + shift_lat + x * sin_a + y * cos_a, 6),
+                round(c_lon + shift_lon + (x * cos_a - y * sin_a) / lon_scale, 6),
+            ))
+        if i % 2:
+            route.reverse()
+        routes.append(route)
+    return routes
+
+
+class FleetState:
+    """
+    Positions and driving behaviour for every bus in the fleet, as NumPy arrays.
+
+    Each bus has its own speed profile (cruise speed, traffic variability, stop
+    probability and dwell time) and a distance travelled along its route, so
+    advancing any subset of the fleet is a few element-wise array operations
+    plus one RouteNetwork lookup.
+    """
+
+    def __init__(self, device_ids: List[str], routes: List[Route], route_idx: np.ndarray,
+                 rng: np.random.Generator):
+        n = len(device_ids)
+        self.device_ids = device_ids
+        self.network = RouteNetwork(routes)
+        self.route_idx = np.asarray(route_idx, dtype=np.int64)
+        self.rng = rng
+
+        self.cruise_kmh = rng.uniform(20.0, 45.0, n)
+        self.variability = rng.uniform(0.1, 0.4, n)
+        self.stop_probability = rng.uniform(0.05, 0.2, n)
+        self.dwell_seconds = rng.uniform(10.0, 40.0, n)
+
+        # Start buses spread out along their route rather than bunched at the depot
+        self.distance = rng.uniform(0.0, 1.0, n) * self.network.lengths[self.route_idx]
+        self.dwell_remaining = np.zeros(n)
+        self.last_update = np.full(n, np.nan)
+
+    def __len__(self) -> int:
+        return len(self.device_ids)
+
+    def advance(self, idx: np.ndarray, now: Union[float, np.ndarray]) -> Tuple[np.ndarray, ...]:
+        """
+        Move buses `idx` to time `now` (seconds, scalar or one per bus);
+        returns (lat, lon, heading, speed_kmh)
+        """
+        last = self.last_update[idx]
+        elapsed = np.where(np.isnan(last), 0.0, now - last)
+        self.last_update[idx] = now
+
+        dwell = np.minimum(self.dwell_remaining[idx], elapsed)
+        dwell_remaining = self.dwell_remaining[idx] - dwell
+        moving = elapsed - dwell
+
+        variability = self.variability[idx]
+        variation = self.rng.uniform(-1.0, 1.0, len(idx)) * variability
+        speed = np.maximum(5.0, self.cruise_kmh[idx] * (1 + variation))
+        self.distance[idx] += moving * speed / 3.6
+
+        stops = (moving > 0) & (self.rng.random(len(idx)) < self.stop_probability[idx])
+        dwell_remaining = np.where(stops, self.dwell_seconds[idx], dwell_remaining)
+        self.dwell_remaining[idx] = dwell_remaining
+
+        lat, lon, heading = self.network.positions(self.route_idx[idx], self.distance[idx])
+        return lat, lon, heading, np.where(dwell_remaining > 0, 0.0, speed)
+
+    def telemetry(self, idx: np.ndarray, now: Union[float, np.ndarray],
+                  ts_ms: Union[int, np.ndarray]) -> List[Dict]:
+        """Advance buses `idx` and build one telemetry message per bus"""
+        lat, lon, heading, speed = self.advance(idx, now)
+        n = len(idx)
+        # Same noise model as GPSDeviceSimulator.get_telemetry
+        lat = np.round(lat + self.rng.uniform(-0.00001, 0.00001, n), 6).tolist()
+        lon = np.round(lon + self.rng.uniform(-0.00001, 0.00001, n), 6).tolist()
+        speed = np.round(np.where(speed > 0, speed + self.rng.uniform(-2, 2, n), 0.0), 1).tolist()
+        heading = heading.astype(np.int64).tolist()
+        accuracy = np.round(self.rng.uniform(5, 15, n), 1).tolist()
+        ts = np.broadcast_to(ts_ms, (n,)).tolist()
+
+        device_ids = self.device_ids
+        return [
+            {
+                "busId": device_ids[i],
+                "lat": lat[k],
+                "lon": lon[k],
+                "ts": ts[k],
+                "speed": speed[k],
+                "heading": heading[k],
+                "accuracy": accuracy[k],
+            }
+            for k, i in enumerate(idx.tolist())
+        ]
+
+
+class FleetSimulator:
+    """
+    Publishes telemetry for a fleet of buses on a single asyncio scheduler.
+
+    Every bus publishes once per `interval` seconds; the fleet's start times are
+    staggered evenly across the interval so the aggregate rate is a steady
+    len(fleet) / interval messages per second instead of a burst every tick.
+    Each pass of the scheduler advances all buses that are due at once.
+    """
+
+    def __init__(self, state: FleetState, interval: float,
+                 publish: Callable[[str, Dict], None], topic_prefix: str = "transport/dev",
+                 stats: Optional[PublishStats] = None):
+        self.state = state
+        self.interval = interval
+        self.publish = publish
+        self.topic_prefix = topic_prefix
+        self.stats = stats
+        self.published = 0
+        self.max_lag = 0.0
+
+    @property
+    def target_rate(self) -> float:
+        return len(self.state) / self.interval
+
+    async def run(self, duration: Optional[float] = None, report_every: float = 10.0):
+        start = time.monotonic()
+        stagger = self.interval / max(len(self.state), 1)
+        next_due = start + np.arange(len(self.state)) * stagger
+        next_report = start + report_every
+        reported = 0
+        prefix = self.topic_prefix
+
+        while len(next_due):
+            now = time.monotonic()
+            if duration is not None and now - start >= duration:
+                break
+
+            if now >= next_report:
+                rate = (self.published - reported) / report_every
+                click.echo(f"[fleet] {self.published} published, {rate:.0f} msg/s "
+                           f"(target {self.target_rate:.0f}), max lag {self.max_lag * 1000:.0f} ms")
+                if self.stats:
+                    click.echo(f"[fleet] {self.stats.summary()}")
+                reported = self.published
+                self.max_lag = 0.0
+                next_report += report_every
+
+            due = np.flatnonzero(next_due <= now)
+            if not len(due):
+                await asyncio.sleep(min(float(next_due.min()), next_report) - now)
+                continue
+
+            # Publish everything that is due, then yield to the loop
+            for message in self.state.telemetry(due, now, int(time.time() * 1000)):
+                self.publish(f"{prefix}/{message['busId']}/location", message)
+            self.published += len(due)
+            self.max_lag = max(self.max_lag, float(now - next_due[due].min()))
+            next_due[due] += self.interval
+            await asyncio.sleep(0)
+
+
+def build_fleet(bus_count: int, route_count: int, seed: int, id_offset: int = 0,
+                id_prefix: str = "bus") -> FleetState:
+    """Create `bus_count` buses spread round-robin over `route_count` routes"""
+    routes = create_fleet_routes(route_count, seed)
+    device_ids = [f"{id_prefix}-{id_offset + i:05d}" for i in range(bus_count)]
+    route_idx = (id_offset + np.arange(bus_count)) % len(routes)
+    return FleetState(device_ids, routes, route_idx, np.random.default_rng(seed + id_offset))
+
+
+def run_shard(shard: int, shard_buses: int, id_offset: int, options: Dict):
+    """Run one fleet shard with its own MQTT connection and event loop"""
+    state = build_fleet(shard_buses, options['routes'], options['seed'], id_offset, options['id_prefix'])
+    client_id = f"{options['client_id']}-{shard}"
+    if options['output']:
+        output = options['output']
+        if options['processes'] > 1 and output != '-' and not output.startswith('mqtt://'):
+            output = f"{output}.{shard}"
+        iot_client = open_sink(output, client_id)
+    else:
+        iot_client = AWSIoTClient(options['endpoint'], options['cert'], options['key'], options['ca'], client_id,
+                                  options['max_in_flight'], options['pack'], options['encoding'],
+                                  options['topic_prefix'], options['max_pack_delay'])
+    fleet = FleetSimulator(state, options['interval'], iot_client.publish, options['topic_prefix'],
+                           stats=getattr(iot_client, 'stats', None))
+
+    try:
+        iot_client.connect()
+        asyncio.run(fleet.run(duration=options['duration']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        iot_client.disconnect()
+        click.echo(f"[shard {shard}] published {fleet.published} messages")
+        if fleet.stats:
+            click.echo(f"[shard {shard}] {fleet.stats.summary()}")
+
+
+@click.command()
+@click.option('--buses', default=1000, help='Number of simulated buses')
+@click.option('--routes', default=10, help='Number of distinct routes')
+@click.option('--target-rate', default=None, type=float, help='Aggregate messages/sec (overrides --interval)')
+@click.option('--interval', envvar='PUBLISH_INTERVAL', default=5.0, help='Publish interval per bus in seconds')
+@click.option('--duration', default=None, type=float, help='Stop after this many seconds')
+@click.option('--processes', default=1, help='Shard the fleet across this many processes')
+@click.option('--seed', default=0, help='Random seed for routes and speed profiles')
+@click.option('--id-prefix', default='bus', help='Device ID prefix')
+@click.option('--client-id', default='fleet-sim', help='MQTT client ID prefix')
+@click.option('--max-in-flight', default=1000, help='Maximum unacknowledged publishes per connection')
+@click.option('--pack', default=1, help='Fixes packed into each MQTT message')
+@click.option('--max-pack-delay', default=1.0, help='Seconds before a partially filled pack is sent anyway')
+@click.option('--topic-prefix', envvar='TOPIC_PREFIX', default='transport/dev', help='MQTT topic prefix')
+@click.option('--encoding', type=click.Choice(['json', 'binary']), default='json', help='Payload encoding')
+@click.option('--output', default=None, help='Publish to an NDJSON file, "-" or mqtt://host[:port] instead of AWS IoT')
+@click.option('--endpoint', envvar='IOT_ENDPOINT', default=None, help='AWS IoT endpoint')
+@click.option('--cert', envvar='IOT_CERT_PATH', default='certs/device.pem.crt', help='Device certificate path')
+@click.option('--key', envvar='IOT_KEY_PATH', default='certs/private.pem.key', help='Private key path')
+@click.option('--ca', envvar='IOT_CA_PATH', default='certs/Amazon-root-CA-1.pem', help='Root CA path')
+def main(buses, routes, target_rate, interval, duration, processes, seed, id_prefix, client_id,
+         max_in_flight, pack, max_pack_delay, topic_prefix, encoding, output, endpoint, cert, key, ca):
+    """Run a multi-bus fleet simulation"""
+    if not output and not endpoint:
+        raise click.UsageError("Either --endpoint (or IOT_ENDPOINT) or --output is required")
+    if target_rate:
+        interval = buses / target_rate
+
+    click.echo(f"Simulating {buses} buses on {routes} routes across {processes} process(es)")
+    click.echo(f"Per-bus interval: {interval:.2f}s, aggregate rate: {buses / interval:.0f} msg/s")
+
+    options = {
+        'routes': routes, 'seed': seed, 'id_prefix': id_prefix, 'client_id': client_id,
+        'interval': interval, 'duration': duration, 'processes': processes, 'output': output,
+        'max_in_flight': max_in_flight, 'pack': pack, 'max_pack_delay': max_pack_delay,
+        'topic_prefix': topic_prefix, 'encoding': encoding,
+        'endpoint': endpoint, 'cert': cert, 'key': key, 'ca': ca,
+    }
+
+    if processes <= 1:
+        run_shard(0, buses, 0, options)
+        return
+
+    per_shard, extra = divmod(buses, processes)
+    workers, offset = [], 0
+    for shard in range(processes):
+        count = per_shard + (1 if shard < extra else 0)
+        worker = multiprocessing.Process(target=run_shard, args=(shard, count, offset, options))
+        worker.start()
+        workers.append(worker)
+        offset += count
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        click.echo("\nStopping fleet...")
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Offline generation and replay for the GPS Device Simulator
+Produces deterministic telemetry (same seed, same output) without AWS IoT,
+and replays recorded NDJSON files at a multiple of real time
+"""
+
+import json
+import time
+from typing import Dict, Iterator
+
+import click
+import numpy as np
+
+from fleet import FleetState, build_fleet
+from sinks import open_sink
+
+# Default first-fix time, fixed so output depends only on the arguments
+DEFAULT_START_TS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+
+
+def generate_telemetry(state: FleetState, interval: float, duration: float,
+                       start_ms: int, tick: float = 1.0) -> Iterator[Dict]:
+    """
+    Yield telemetry for `duration` seconds of simulated time, in timestamp order.
+
+    Runs on a virtual clock rather than wall time, so output depends only on
+    the fleet's seed and these arguments. Publish times are staggered across
+    the interval exactly as in real-time fleet mode.
+    """
+    stagger = interval / max(len(state), 1)
+    next_due = np.arange(len(state)) * stagger
+    t = 0.0
+    while t < duration:
+        t = min(t + tick, duration)
+        # A bus can come due more than once per tick when interval < tick
+        while True:
+            due = np.flatnonzero(next_due < t)
+            if not len(due):
+                break
+            due = due[np.argsort(next_due[due], kind="stable")]
+            due_at = next_due[due]
+            ts_ms = start_ms + np.round(due_at * 1000).astype(np.int64)
+            yield from state.telemetry(due, due_at, ts_ms)
+            next_due[due] += interval
+
+
+def read_ndjson(path: str) -> Iterator[Dict]:
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+@click.group()
+def cli():
+    """Generate or replay simulator telemetry without AWS IoT"""
+
+
+@cli.command()
+@click.option('--buses', default=10, help='Number of simulated buses')
+@click.option('--routes', default=3, help='Number of distinct routes')
+@click.option('--interval', default=5.0, help='Publish interval per bus in seconds')
+@click.option('--duration', default=3600.0, help='Simulated seconds to generate')
+@click.option('--seed', default=0, help='Random seed; identical seeds produce identical output')
+@click.option('--start-ts', default=DEFAULT_START_TS, type=int,
+              help='Timestamp (ms) of the first fix (default: 2024-01-01T00:00:00Z, so output is reproducible; '
+                   'replay --rebase shifts it to now)')
+@click.option('--id-prefix', default='bus', help='Device ID prefix')
+@click.option('--output', default='-', help='NDJSON file, "-" for stdout, or mqtt://host[:port]')
+def generate(buses, routes, interval, duration, seed, start_ts, id_prefix, output):
+    """Generate deterministic telemetry as fast as possible"""
+    state = build_fleet(buses, routes, seed, id_prefix=id_prefix)
+    sink = open_sink(output)
+    sink.connect()
+    count = 0
+    try:
+        for message in generate_telemetry(state, interval, duration, start_ts):
+            sink.publish(f"transport/dev/{message['busId']}/location", message)
+            count += 1
+    finally:
+        sink.disconnect()
+    click.echo(f"Generated {count} messages for {buses} buses", err=True)
+
+
+@cli.command()
+@click.option('--input', 'input_path', required=True, help='Recorded NDJSON file')
+@click.option('--speed', default=1.0, help='Replay speed multiple (0 = as fast as possible)')
+@click.option('--rebase/--no-rebase', default=True, help='Shift timestamps so the replay starts now')
+@click.option('--output', default='-', help='NDJSON file, "-" for stdout, or mqtt://host[:port]')
+def replay(input_path, speed, rebase, output):
+    """Replay a recorded NDJSON file, preserving the original message spacing"""
+    sink = open_sink(output)
+    sink.connect()
+    count = 0
+    wall_start = time.monotonic()
+    now_ms = int(time.time() * 1000)
+    first_ts = None
+    try:
+        for message in read_ndjson(input_path):
+            if first_ts is None:
+                first_ts = message['ts']
+            offset_ms = message['ts'] - first_ts
+
+            if speed > 0:
+                wait = offset_ms / 1000 / speed - (time.monotonic() - wall_start)
+                if wait > 0:
+                    time.sleep(wait)
+            if rebase:
+                # Keep timestamps in step with the wall clock at the replay speed
+                message['ts'] = now_ms + (int(offset_ms / speed) if speed > 0 else offset_ms)
+
+            sink.publish(f"transport/dev/{message['busId']}/location", message)
+            count += 1
+    except KeyboardInterrupt:
+        click.echo("\nStopping replay...", err=True)
+    finally:
+        sink.disconnect()
+    click.echo(f"Replayed {count} messages", err=True)
+
+
+if __name__ == "__main__":
+    cli()
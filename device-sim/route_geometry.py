@@ -0,0 +1,95 @@
+"""
+Precomputed route geometry for the GPS Device Simulator
+Turns waypoint lists into cumulative-distance arrays so a position along a
+route is a binary search plus a linear interpolation, for one bus or many
+"""
+
+from bisect import bisect_right
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+
+Route = Sequence[Tuple[float, float]]
+
+
+def _segments(points: Route) -> Tuple[np.ndarray, ...]:
+    """Segment start coordinates, deltas, lengths (m) and bearings (deg) for a closed loop."""
+    pts = np.asarray(points, dtype=np.float64)
+    nxt = np.roll(pts, -1, axis=0)  # last waypoint wraps back to the first
+
+    lat1_rad, lon1_rad = np.radians(pts[:, 0]), np.radians(pts[:, 1])
+    lat2_rad, lon2_rad = np.radians(nxt[:, 0]), np.radians(nxt[:, 1])
+    dlat, dlon = lat2_rad - lat1_rad, lon2_rad - lon1_rad
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2) ** 2
+    lengths = 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    x = np.sin(dlon) * np.cos(lat2_rad)
+    y = np.cos(lat1_rad) * np.sin(lat2_rad) - np.sin(lat1_rad) * np.cos(lat2_rad) * np.cos(dlon)
+    bearings = np.degrees(np.arctan2(x, y)) % 360
+
+    return pts[:, 0], pts[:, 1], nxt[:, 0] - pts[:, 0], nxt[:, 1] - pts[:, 1], lengths, bearings
+
+
+class RouteGeometry:
+    """A single looping route, for scalar lookups by distance travelled"""
+
+    def __init__(self, points: Route):
+        self.points = list(points)
+        self.lat, self.lon, self.dlat, self.dlon, self.lengths, self.bearings = _segments(points)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.lengths)[:-1]))
+        self.length = float(self.lengths.sum())
+        # Plain lists keep the scalar path free of NumPy call overhead
+        self._cumulative = self.cumulative.tolist()
+        self._lengths = self.lengths.tolist()
+
+    def segment_at(self, distance: float) -> int:
+        """Index of the segment containing `distance` metres along the loop"""
+        distance %= self.length
+        return bisect_right(self._cumulative, distance) - 1
+
+    def position_at(self, distance: float) -> Tuple[float, float]:
+        """(lat, lon) at `distance` metres along the loop"""
+        distance %= self.length
+        seg = bisect_right(self._cumulative, distance) - 1
+        seg_len = self._lengths[seg]
+        frac = (distance - self._cumulative[seg]) / seg_len if seg_len > 0 else 0.0
+        return (float(self.lat[seg] + self.dlat[seg] * frac),
+                float(self.lon[seg] + self.dlon[seg] * frac))
+
+
+class RouteNetwork:
+    """
+    Several routes flattened into one set of segment arrays.
+
+    Every route's segments sit back to back on a single global distance axis,
+    so positions for any mix of buses and routes come from one searchsorted
+    over all segments followed by element-wise interpolation.
+    """
+
+    def __init__(self, routes: List[Route]):
+        self.routes = [RouteGeometry(r) for r in routes]
+        self.lengths = np.array([r.length for r in self.routes])
+        self.offsets = np.concatenate(([0.0], np.cumsum(self.lengths)[:-1]))
+
+        self.seg_start = np.concatenate([off + r.cumulative for off, r in zip(self.offsets, self.routes)])
+        self.seg_length = np.concatenate([r.lengths for r in self.routes])
+        self.seg_lat = np.concatenate([r.lat for r in self.routes])
+        self.seg_lon = np.concatenate([r.lon for r in self.routes])
+        self.seg_dlat = np.concatenate([r.dlat for r in self.routes])
+        self.seg_dlon = np.concatenate([r.dlon for r in self.routes])
+        self.seg_bearing = np.concatenate([r.bearings for r in self.routes])
+        # Zero-length segments (closing waypoints) interpolate to their start point
+        self._inv_length = np.divide(1.0, self.seg_length, out=np.zeros_like(self.seg_length),
+                                     where=self.seg_length > 0)
+
+    def positions(self, route_idx: np.ndarray, distance: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized (lat, lon, heading) for buses at `distance` metres along `route_idx`"""
+        along = self.offsets[route_idx] + np.mod(distance, self.lengths[route_idx])
+        seg = np.searchsorted(self.seg_start, along, side="right") - 1
+        frac = (along - self.seg_start[seg]) * self._inv_length[seg]
+        lat = self.seg_lat[seg] + self.seg_dlat[seg] * frac
+        lon = self.seg_lon[seg] + self.seg_dlon[seg] * frac
+        return lat, lon, self.seg_bearing[seg]
@@ -9,8 +9,10 @@ import time
 import uuid
 import random
 import math
+import threading
+from bisect import bisect_left
 from datetime import datetime
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
 import click
 import boto3
 from awscrt import io, mqtt
@@ -18,6 +20,9 @@ from awsiot import mqtt_connection_builder
 from dotenv import load_dotenv
 import os
 
+import telemetry_codec
+from route_geometry import RouteGeometry
+
 # Load environment variables
 load_dotenv()
 
@@ -38,46 +43,20 @@ class GPSDeviceSimulator:
                  speed_kmh: float = 30.0):
         self.device_id = device_id
         self.route_points = route_points
+        self.route = RouteGeometry(route_points)
         self.speed_kmh = speed_kmh
+        self.distance_along = 0.0  # metres travelled along the looping route
         self.current_position_index = 0
         self.current_position = route_points[0]
         
     def calculate_next_position(self, time_delta_seconds: float) -> Tuple[float, float]:
         """Calculate next position based on speed and time, updating self.current_position."""
         speed_ms = (self.speed_kmh * 1000) / 3600  # km/h → m/s
-        remaining_time = time_delta_seconds
-
-        # Keep moving until we've used up the time slice
-        while remaining_time > 0:
-            # Next waypoint index (wrap around)
-            next_idx = (self.current_position_index + 1) % len(self.route_points)
-            start = self.current_position
-            end = self.route_points[next_idx]
-
-            # Distance for this segment using haversine
-            segment_dist = haversine(start, end)  # in meters
-
-            # How far we *could* go in the remaining time
-            travel_dist = speed_ms * remaining_time
-
-            if travel_dist >= segment_dist:
-                # We can reach (or pass) the next waypoint
-                self.current_position = end
-                self.current_position_index = next_idx
-                # Subtract the time spent getting to that waypoint
-                remaining_time -= segment_dist / speed_ms
-                # loop again in case we have leftover time to continue onward
-            else:
-                # We stop somewhere *between* start and end
-                lat_diff = end[0] - start[0]
-                lon_diff = end[1] - start[1]
-                frac = travel_dist / segment_dist
-                new_lat = start[0] + lat_diff * frac
-                new_lon = start[1] + lon_diff * frac
-                self.current_position = (new_lat, new_lon)
-                # All time used up
-                remaining_time = 0
+        self.distance_along = (self.distance_along + speed_ms * time_delta_seconds) % self.route.length
 
+        # Binary search over precomputed cumulative segment distances
+        self.current_position_index = self.route.segment_at(self.distance_along)
+        self.current_position = self.route.position_at(self.distance_along)
         return self.current_position
     
     def get_telemetry(self) -> Dict:
@@ -96,17 +75,100 @@ class GPSDeviceSimulator:
             "accuracy": round(random.uniform(5, 15), 1)
         }
 
+class PublishStats:
+    """Thread-safe publish/ack counters with an ack latency histogram"""
+    
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.published = 0
+        self.fixes = 0
+        self.acked = 0
+        self.failed = 0
+        self.histogram = [0] * (len(self.BUCKETS_MS) + 1)
+        self._window_start = time.monotonic()
+        self._window_acks = 0
+        
+    @property
+    def in_flight(self) -> int:
+        return self.published - self.acked - self.failed
+        
+    def record_publish(self, fixes: int = 1):
+        with self._lock:
+            self.published += 1
+            self.fixes += fixes
+            
+    def record_ack(self, latency_seconds: float, ok: bool):
+        bucket = bisect_left(self.BUCKETS_MS, latency_seconds * 1000)
+        with self._lock:
+            if ok:
+                self.acked += 1
+                self._window_acks += 1
+            else:
+                self.failed += 1
+            self.histogram[bucket] += 1
+            
+    def percentile_ms(self, pct: float) -> float:
+        """Upper bound of the histogram bucket holding the given percentile"""
+        with self._lock:
+            total = sum(self.histogram)
+            if not total:
+                return 0.0
+            target = total * pct / 100
+            running = 0
+            for i, count in enumerate(self.histogram):
+                running += count
+                if running >= target:
+                    return float(self.BUCKETS_MS[i]) if i < len(self.BUCKETS_MS) else float('inf')
+        return float('inf')
+    
+    def summary(self) -> str:
+        """One-line summary; the acks/s rate covers the time since the last call"""
+        with self._lock:
+            now = time.monotonic()
+            rate = self._window_acks / max(now - self._window_start, 1e-9)
+            self._window_start, self._window_acks = now, 0
+        return (f"published={self.published} fixes={self.fixes} acked={self.acked} "
+                f"failed={self.failed} in_flight={self.in_flight} acks/s={rate:.0f} "
+                f"ack_p50={self.percentile_ms(50):g}ms ack_p99={self.percentile_ms(99):g}ms")
+
 class AWSIoTClient:
-    """Handles AWS IoT Core MQTT connection"""
+    """
+    Handles AWS IoT Core MQTT connection
+    
+    Publishes are QoS 1 with at most `max_in_flight` messages awaiting PUBACK;
+    publish() blocks once the window is full, which throttles the caller to
+    the rate the broker acknowledges. With `pack_size` > 1, fixes are buffered
+    and sent as {"fixes": [...]} messages of up to `pack_size` fixes each; a
+    background thread sends a partial pack once its first fix has waited
+    `max_pack_delay` seconds, and disconnect() sends whatever is left.
+    With encoding="binary", messages are telemetry_codec frames instead of JSON.
+    """
     
     def __init__(self, endpoint: str, cert_path: str, key_path: str, 
-                 ca_path: str, client_id: str):
+                 ca_path: str, client_id: str, max_in_flight: int = 100,
+                 pack_size: int = 1, encoding: str = "json", topic_prefix: str = "transport/dev",
+                 max_pack_delay: float = 5.0):
         self.endpoint = endpoint
         self.cert_path = cert_path
         self.key_path = key_path
         self.ca_path = ca_path
         self.client_id = client_id
         self.mqtt_connection = None
+        self.max_in_flight = max_in_flight
+        self.pack_size = pack_size
+        self.encoding = encoding
+        self.topic_prefix = topic_prefix
+        self.max_pack_delay = max_pack_delay
+        self.stats = PublishStats()
+        self._window = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.RLock()  # guards the pending pack against the flush thread
+        self._pending: List[Dict] = []
+        self._pending_topic = None
+        self._pending_since = 0.0
+        self._stop_flushing = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
         
     def connect(self):
         """Establish MQTT connection to AWS IoT Core"""
@@ -130,18 +192,85 @@ class AWSIoTClient:
         connect_future.result()
         print("Connected!")
         
+        if self.pack_size > 1:
+            self._stop_flushing.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.client_id}-flush", daemon=True)
+            self._flusher.start()
+        
     def publish(self, topic: str, payload: Dict):
-        """Publish message to MQTT topic"""
-        message_json = json.dumps(payload)
-        self.mqtt_connection.publish(
-            topic=topic,
-            payload=message_json,
-            qos=mqtt.QoS.AT_LEAST_ONCE
-        )
+        """Publish message to MQTT topic, packing fixes if enabled"""
+        if self.pack_size <= 1:
+            self._send(topic, [payload] if self.encoding == "binary" else payload, 1)
+            return
+        
+        with self._lock:
+            # Fixes for different devices share one message on the client's own topic
+            if not self._pending:
+                self._pending_topic = topic
+                self._pending_since = time.monotonic()
+            elif topic != self._pending_topic:
+                self._pending_topic = f"{self.topic_prefix}/{self.client_id}/location"
+            self._pending.append(payload)
+            if len(self._pending) >= self.pack_size:
+                self.flush()
+            
+    def flush(self):
+        """Send any partially filled packed message"""
+        with self._lock:
+            if self._pending:
+                fixes, self._pending = self._pending, []
+                payload = fixes if self.encoding == "binary" else {"fixes": fixes}
+                self._send(self._pending_topic, payload, len(fixes))
+    
+    def _flush_loop(self):
+        """Send packs whose first fix has waited `max_pack_delay` without the pack filling up"""
+        while not self._stop_flushing.wait(self.max_pack_delay / 4):
+            with self._lock:
+                if self._pending and time.monotonic() - self._pending_since >= self.max_pack_delay:
+                    self.flush()
+            
+    def wait_for_acks(self, timeout: float = 10.0) -> bool:
+        """Block until every in-flight publish is acknowledged or `timeout` passes"""
+        deadline = time.monotonic() + timeout
+        while self.stats.in_flight > 0:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+        
+    def _send(self, topic: str, payload, fixes: int):
+        if self.encoding == "binary":
+            message = telemetry_codec.encode(payload)
+        else:
+            message = json.dumps(payload, separators=(',', ':'))
+        self._window.acquire()
+        sent_at = time.monotonic()
+        try:
+            future, _ = self.mqtt_connection.publish(
+                topic=topic,
+                payload=message,
+                qos=mqtt.QoS.AT_LEAST_ONCE
+            )
+        except Exception:
+            self._window.release()
+            raise
+        self.stats.record_publish(fixes)
+        future.add_done_callback(lambda f: self._on_complete(f, sent_at))
+        
+    def _on_complete(self, future, sent_at: float):
+        self.stats.record_ack(time.monotonic() - sent_at, future.exception() is None)
+        self._window.release()
         
     def disconnect(self):
         """Disconnect from AWS IoT Core"""
         if self.mqtt_connection:
+            self._stop_flushing.set()
+            if self._flusher is not None:
+                self._flusher.join()
+                self._flusher = None
+            self.flush()
+            if not self.wait_for_acks():
+                print(f"Disconnecting with {self.stats.in_flight} unacknowledged messages")
             disconnect_future = self.mqtt_connection.disconnect()
             disconnect_future.result()
             print("Disconnected!")
@@ -179,7 +308,15 @@ def create_sample_route() -> List[Tuple[float, float]]:
 @click.option('--ca', envvar='IOT_CA_PATH', default='certs/Amazon-root-CA-1.pem', help='Root CA path')
 @click.option('--interval', envvar='PUBLISH_INTERVAL', default=5, help='Publish interval in seconds')
 @click.option('--speed', envvar='BUS_SPEED_KMH', default=30.0, help='Bus speed in km/h')
-def main(device_id, endpoint, cert, key, ca, interval, speed):
+@click.option('--max-in-flight', default=100, help='Maximum unacknowledged publishes')
+@click.option('--pack', default=1, help='Fixes packed into each MQTT message')
+@click.option('--max-pack-delay', default=5.0, help='Seconds before a partially filled pack is sent anyway')
+@click.option('--topic-prefix', envvar='TOPIC_PREFIX', default='transport/dev', help='MQTT topic prefix')
+@click.option('--stats-interval', default=60.0, help='Seconds between publish stats lines')
+@click.option('--quiet', is_flag=True, help='Do not echo each published message')
+@click.option('--encoding', type=click.Choice(['json', 'binary']), default='json', help='Payload encoding')
+def main(device_id, endpoint, cert, key, ca, interval, speed, max_in_flight, pack, max_pack_delay, topic_prefix,
+         stats_interval, quiet, encoding):
     """Run GPS device simulator"""
     
     # Generate device ID if not provided
@@ -196,8 +333,10 @@ def main(device_id, endpoint, cert, key, ca, interval, speed):
     simulator = GPSDeviceSimulator(device_id, route, speed)
     
     # Create IoT client
-    topic = f"transport/dev/{device_id}/location"
-    iot_client = AWSIoTClient(endpoint, cert, key, ca, device_id)
+    topic = f"{topic_prefix}/{device_id}/location"
+    iot_client = AWSIoTClient(endpoint, cert, key, ca, device_id, max_in_flight, pack, encoding,
+                              topic_prefix, max_pack_delay)
+    next_stats = time.monotonic() + stats_interval
     
     try:
         # Connect to AWS IoT
@@ -218,7 +357,11 @@ def main(device_id, endpoint, cert, key, ca, interval, speed):
             iot_client.publish(topic, telemetry)
             
             # Display what was sent
-            click.echo(f"Published: {json.dumps(telemetry, indent=2)}")
+            if not quiet:
+                click.echo(f"Published: {json.dumps(telemetry)}")
+            if time.monotonic() >= next_stats:
+                click.echo(f"[stats] {iot_client.stats.summary()}")
+                next_stats += stats_interval
             
             # Wait for next interval
             time.sleep(interval)
@@ -227,6 +370,7 @@ def main(device_id, endpoint, cert, key, ca, interval, speed):
         click.echo("\nStopping simulator...")
     finally:
         iot_client.disconnect()
+        click.echo(f"[stats] {iot_client.stats.summary()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Offline telemetry sinks for the GPS Device Simulator
+Drop-in replacements for AWSIoTClient that write to NDJSON files, stdout or
+a local MQTT broker, so the simulator can run without AWS credentials
+"""
+
+import json
+import sys
+from typing import Dict, Optional, TextIO
+from urllib.parse import urlparse
+
+import paho.mqtt.client as paho
+
+
+class NDJSONSink:
+    """Writes one telemetry message per line to a file or stdout"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[TextIO] = None
+
+    def connect(self):
+        self._file = sys.stdout if self.path == "-" else open(self.path, "w", buffering=1 << 20)
+
+    def publish(self, topic: str, payload: Dict):
+        # Topic is derivable from busId, so only the payload is recorded
+        self._file.write(json.dumps(payload, separators=(",", ":")))
+        self._file.write("\n")
+
+    def disconnect(self):
+        if self._file is not None:
+            self._file.flush()
+            if self._file is not sys.stdout:
+                self._file.close()
+            self._file = None
+
+
+class LocalMQTTSink:
+    """Publishes to a plain (non-TLS) MQTT broker such as a local Mosquitto"""
+
+    def __init__(self, host: str, port: int = 1883, client_id: str = "gps-sim-offline"):
+        self.host = host
+        self.port = port
+        self.client = paho.Client(client_id=client_id, clean_session=True)
+
+    def connect(self):
+        self.client.connect(self.host, self.port, keepalive=30)
+        self.client.loop_start()
+
+    def publish(self, topic: str, payload: Dict):
+        self.client.publish(topic, json.dumps(payload, separators=(",", ":")), qos=1)
+
+    def disconnect(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def open_sink(spec: str, client_id: str = "gps-sim-offline"):
+    """
+    Build a sink from an output spec:
+    - "-" for stdout
+    - "mqtt://host[:port]" for a local broker
+    - anything else is an NDJSON file path
+    """
+    if spec.startswith("mqtt://"):
+        url = urlparse(spec)
+        return LocalMQTTSink(url.hostname or "localhost", url.port or 1883, client_id)
+    return NDJSONSink(spec)
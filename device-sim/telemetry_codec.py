@@ -0,0 +1,200 @@
+"""
+Compact binary encoding for GPS telemetry
+
+A frame carries one or more fixes and starts with a version byte, so readers
+can tell it apart from JSON (which starts with '{', '[' or whitespace) and
+accept either. Version 1 layout, little-endian:
+
+    header   B version, H fix count, H device count
+    devices  per device: B length, UTF-8 device ID
+    fixes    H device index, B flags, i lat * 1e7, i lon * 1e7,
+             ts as q epoch ms for the first fix and i delta from the
+             previous fix after that, then the optional fields named by
+             flags in bit order:
+               0 speed         H km/h * 10
+               1 heading       H degrees
+               2 accuracy      H metres * 10
+               3 processed_at  i ms after ts
+               4 region        B index into REGIONS
+               5 quality_score B index into QUALITY_SCORES
+
+A typical fix is ~25 bytes against ~150-250 bytes of JSON.
+
+This module is copied verbatim into each component that reads or writes
+telemetry (device-sim, ingestion-lambda, geofence-alerts, trackstore), since
+each is packaged and deployed on its own. Keep the copies identical.
+"""
+
+import json
+import struct
+from typing import Any, Dict, List, Union
+
+VERSION = 1
+
+REGIONS = ('other', 'san_francisco')
+QUALITY_SCORES = ('high', 'medium', 'low')
+
+COORD_SCALE = 10_000_000
+
+_HEADER = struct.Struct('<BHH')
+_FIX = struct.Struct('<HBii')
+_TS_FIRST = struct.Struct('<q')
+_TS_DELTA = struct.Struct('<i')
+_U8 = struct.Struct('<B')
+_U16 = struct.Struct('<H')
+_I32 = struct.Struct('<i')
+
+_SPEED, _HEADING, _ACCURACY, _PROCESSED_AT, _REGION, _QUALITY = (1 << i for i in range(6))
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be decoded"""
+    pass
+
+
+def is_binary(data: bytes) -> bool:
+    """True if `data` is a binary frame rather than JSON"""
+    return bool(data) and data[0] == VERSION
+
+
+def encode(fixes: List[Dict[str, Any]]) -> bytes:
+    """Encode fixes (dicts with the JSON field names) into one binary frame"""
+    if not fixes or len(fixes) > 0xFFFF:
+        raise CodecError(f"A frame holds 1-65535 fixes, got {len(fixes)}")
+    try:
+        return _encode(fixes)
+    except (struct.error, KeyError, TypeError) as e:
+        raise CodecError(f"Fix cannot be encoded: {e}") from e
+
+
+def _encode(fixes: List[Dict[str, Any]]) -> bytes:
+    device_index: Dict[str, int] = {}
+    for fix in fixes:
+        device_index.setdefault(fix['busId'], len(device_index))
+
+    parts = [_HEADER.pack(VERSION, len(fixes), len(device_index))]
+    for device_id in device_index:
+        raw = device_id.encode('utf-8')
+        parts.append(_U8.pack(len(raw)))
+        parts.append(raw)
+
+    previous_ts = None
+    for fix in fixes:
+        flags = 0
+        extra = []
+        if fix.get('speed') is not None:
+            flags |= _SPEED
+            extra.append(_U16.pack(round(fix['speed'] * 10)))
+        if fix.get('heading') is not None:
+            flags |= _HEADING
+            extra.append(_U16.pack(int(fix['heading'])))
+        if fix.get('accuracy') is not None:
+            flags |= _ACCURACY
+            extra.append(_U16.pack(round(fix['accuracy'] * 10)))
+        if fix.get('processed_at') is not None:
+            flags |= _PROCESSED_AT
+            extra.append(_I32.pack(fix['processed_at'] - fix['ts']))
+        if fix.get('region') in REGIONS:
+            flags |= _REGION
+            extra.append(_U8.pack(REGIONS.index(fix['region'])))
+        if fix.get('quality_score') in QUALITY_SCORES:
+            flags |= _QUALITY
+            extra.append(_U8.pack(QUALITY_SCORES.index(fix['quality_score'])))
+
+        parts.append(_FIX.pack(
+            device_index[fix['busId']],
+            flags,
+            round(fix['lat'] * COORD_SCALE),
+            round(fix['lon'] * COORD_SCALE),
+        ))
+        ts = int(fix['ts'])
+        parts.append(_TS_FIRST.pack(ts) if previous_ts is None else _TS_DELTA.pack(ts - previous_ts))
+        previous_ts = ts
+        parts.extend(extra)
+
+    return b''.join(parts)
+
+
+def decode_binary(data: bytes) -> List[Dict[str, Any]]:
+    """Decode a binary frame into fix dicts with the JSON field names"""
+    try:
+        version, count, n_devices = _HEADER.unpack_from(data, 0)
+        if version != VERSION:
+            raise CodecError(f"Unsupported telemetry version: {version}")
+        offset = _HEADER.size
+
+        devices = []
+        for _ in range(n_devices):
+            length = data[offset]
+            devices.append(data[offset + 1:offset + 1 + length].decode('utf-8'))
+            offset += 1 + length
+
+        fixes = []
+        ts = 0
+        for i in range(count):
+            index, flags, lat, lon = _FIX.unpack_from(data, offset)
+            offset += _FIX.size
+            if i == 0:
+                ts = _TS_FIRST.unpack_from(data, offset)[0]
+                offset += _TS_FIRST.size
+            else:
+                ts += _TS_DELTA.unpack_from(data, offset)[0]
+                offset += _TS_DELTA.size
+
+            fix = {
+                'busId': devices[index],
+                'lat': lat / COORD_SCALE,
+                'lon': lon / COORD_SCALE,
+                'ts': ts,
+            }
+            if flags & _SPEED:
+                fix['speed'] = _U16.unpack_from(data, offset)[0] / 10
+                offset += 2
+            if flags & _HEADING:
+                fix['heading'] = _U16.unpack_from(data, offset)[0]
+                offset += 2
+            if flags & _ACCURACY:
+                fix['accuracy'] = _U16.unpack_from(data, offset)[0] / 10
+                offset += 2
+            if flags & _PROCESSED_AT:
+                fix['processed_at'] = ts + _I32.unpack_from(data, offset)[0]
+                offset += 4
+            if flags & _REGION:
+                fix['region'] = REGIONS[data[offset]]
+                offset += 1
+            if flags & _QUALITY:
+                fix['quality_score'] = QUALITY_SCORES[data[offset]]
+                offset += 1
+            fixes.append(fix)
+        return fixes
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CodecError(f"Malformed telemetry frame: {e}") from e
+
+
+def decode(data: Union[bytes, str]) -> List[Dict[str, Any]]:
+    """
+    Decode a payload in any supported format into a list of fix dicts.
+
+    Accepts a binary frame, a single JSON fix, a JSON array of fixes, or a
+    packed {"fixes": [...]} JSON object.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+        if is_binary(data):
+            return decode_binary(data)
+    try:
+        payload = json.loads(data)
+    except ValueError as e:
+        raise CodecError(f"Payload is neither a telemetry frame nor JSON: {e}") from e
+    return fixes_from_json(payload)
+
+
+def fixes_from_json(payload: Any) -> List[Dict[str, Any]]:
+    """List of fixes in an already-parsed JSON payload (fix, array or packed)"""
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict) and isinstance(payload.get('fixes'), list):
+        return payload['fixes']
+    if isinstance(payload, dict):
+        return [payload]
+    raise CodecError(f"Unexpected JSON payload type: {type(payload).__name__}")
@@ -52,7 +52,7 @@ export class IngestionLambdaStack extends cdk.Stack {
     const iotRule = new iot.CfnTopicRule(this, 'GPSIngestionRule', {
       ruleName: `transport_gps_ingestion_${environment}`,
       topicRulePayload: {
-        sql: `SELECT * FROM 'transport/${environment}/+/location'`,
+        sql: `SELECT encode(*, 'base64') AS data FROM 'transport/${environment}/+/location'`,
         description: 'Route GPS data from IoT devices to ingestion Lambda',
         actions: [
           {
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+ddb_scan.py: Parallel segmented scans and per-partition queries over the DynamoDB location table.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import boto3
+
+_DONE = object()
+
+
+def scan_segment(
+    table_name: str,
+    segment: int,
+    total_segments: int,
+    region: str = "us-east-1",
+    scan_kwargs: Optional[Dict[str, Any]] = None,
+) -> Iterator[List[dict]]:
+    """Yield pages of items from one scan segment, following pagination."""
+    # boto3 resources are not thread-safe, so each segment gets its own
+    table = boto3.session.Session().resource("dynamodb", region_name=region).Table(table_name)
+    kwargs = dict(scan_kwargs or {})
+    kwargs.update(Segment=segment, TotalSegments=total_segments)
+
+    while True:
+        response = table.scan(**kwargs)
+        yield response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def query_pages(
+    table_name: str,
+    region: str = "us-east-1",
+    query_kwargs: Optional[Dict[str, Any]] = None,
+) -> Iterator[List[dict]]:
+    """Yield pages of items from one query, following pagination."""
+    table = boto3.session.Session().resource("dynamodb", region_name=region).Table(table_name)
+    kwargs = dict(query_kwargs or {})
+
+    while True:
+        response = table.query(**kwargs)
+        yield response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def parallel_scan(
+    table_name: str,
+    region: str = "us-east-1",
+    segments: int = 8,
+    scan_kwargs: Optional[Dict[str, Any]] = None,
+    max_buffered_pages: int = 32,
+) -> Iterator[List[dict]]:
+    """
+    Scan a table with `segments` workers and yield pages as they arrive.
+
+    Pages are handed over through a bounded queue, so a slow consumer
+    applies backpressure to the scan instead of buffering the whole table.
+    """
+    sources = [
+        lambda segment=segment: scan_segment(table_name, segment, segments, region, scan_kwargs)
+        for segment in range(segments)
+    ]
+    return _parallel_pages(sources, segments, max_buffered_pages)
+
+
+def parallel_query(
+    table_name: str,
+    queries: List[Dict[str, Any]],
+    region: str = "us-east-1",
+    max_workers: int = 8,
+    max_buffered_pages: int = 32,
+) -> Iterator[List[dict]]:
+    """
+    Run each of `queries` (Query keyword arguments, one per partition key)
+    on up to `max_workers` workers and yield pages as they arrive, with the
+    same backpressure as parallel_scan.
+    """
+    sources = [lambda kwargs=kwargs: query_pages(table_name, region, kwargs) for kwargs in queries]
+    return _parallel_pages(sources, max_workers, max_buffered_pages)
+
+
+def _parallel_pages(
+    sources: List[Callable[[], Iterator[List[dict]]]],
+    max_workers: int,
+    max_buffered_pages: int,
+) -> Iterator[List[dict]]:
+    """Drain each source's pages on a worker thread, yielding pages through a bounded queue."""
+    pages: "queue.Queue[Any]" = queue.Queue(maxsize=max_buffered_pages)
+    stop = threading.Event()
+
+    def worker(source: Callable[[], Iterator[List[dict]]]) -> None:
+        try:
+            if stop.is_set():
+                return  # the consumer stopped before this source was reached
+            for page in source():
+                if stop.is_set():
+                    return
+                pages.put(page)
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as pool:
+        for source in sources:
+            pool.submit(worker, source)
+
+        remaining = len(sources)
+        try:
+            while remaining:
+                page = pages.get()
+                if page is _DONE:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            # Unblock any worker waiting on a full queue so the pool can shut down
+            stop.set()
+            while remaining:
+                if pages.get() is _DONE:
+                    remaining -= 1
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+export_parquet.py: Export location history from DynamoDB into partitioned Parquet files.
+
+Files are laid out Hive-style as
+
+    <output>/date=YYYY-MM-DD/deviceId=<id>/part-<n>.parquet
+
+so analytics engines (pyarrow.dataset, DuckDB, Athena) can prune by day and device.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ddb_scan import parallel_scan
+
+# Partition columns (date, deviceId) live in the directory names, not in the files
+SCHEMA = pa.schema([
+    ("timestamp", pa.int64()),
+    ("latitude", pa.float32()),
+    ("longitude", pa.float32()),
+    ("speed", pa.float32()),
+    ("heading", pa.int16()),
+    ("accuracy", pa.float32()),
+    ("processed_at", pa.int64()),
+    ("region", pa.dictionary(pa.int8(), pa.string())),
+    ("quality_score", pa.dictionary(pa.int8(), pa.string())),
+])
+
+PROJECTION = "deviceId, #ts, latitude, longitude, speed, heading, accuracy, processedAt, #region, qualityScore"
+PROJECTION_NAMES = {"#ts": "timestamp", "#region": "region"}
+
+
+def _opt_float(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def _opt_int(value) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+class PartitionedParquetWriter:
+    """
+    Buffers rows per (date, device) partition and writes them out as row groups.
+
+    A partition is flushed once it holds `row_group_size` rows, and every
+    partition is flushed once `max_buffered_rows` rows are pending in total, so
+    memory stays bounded regardless of table size. At most `max_open_files`
+    writers are kept open; the least recently used one is closed when that
+    limit is hit and a new part file is started for it later.
+    """
+
+    def __init__(self, output_dir: str, row_group_size: int = 50_000,
+                 max_open_files: int = 256, max_buffered_rows: int = 500_000,
+                 compression: str = "zstd"):
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.max_open_files = max_open_files
+        self.max_buffered_rows = max_buffered_rows
+        self.compression = compression
+        self._buffered = 0
+
+        self._buffers: Dict[Tuple[str, str], Dict[str, list]] = {}
+        self._writers: "OrderedDict[Tuple[str, str], pq.ParquetWriter]" = OrderedDict()
+        self._part_counts: Dict[Tuple[str, str], int] = {}
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.files_written = 0
+
+    def add(self, item: dict) -> None:
+        """Buffer one DynamoDB location item; raises KeyError/TypeError/ValueError if it is malformed."""
+        ts = int(item["timestamp"])
+        date = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+        key = (date, item["deviceId"])
+        # Convert the whole row before appending, so a bad item leaves the columns aligned
+        row = (
+            ts,
+            float(item["latitude"]),
+            float(item["longitude"]),
+            _opt_float(item.get("speed")),
+            _opt_int(item.get("heading")),
+            _opt_float(item.get("accuracy")),
+            _opt_int(item.get("processedAt")),
+            item.get("region"),
+            item.get("qualityScore"),
+        )
+
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = {name: [] for name in SCHEMA.names}
+        for name, value in zip(SCHEMA.names, row):
+            buf[name].append(value)
+        self._buffered += 1
+
+        if len(buf["timestamp"]) >= self.row_group_size:
+            self._flush(key)
+        elif self._buffered >= self.max_buffered_rows:
+            for pending in list(self._buffers):
+                self._flush(pending)
+
+    def add_many(self, items: Iterable[dict]) -> None:
+        """Buffer items, counting malformed ones in `rows_skipped` instead of failing the export."""
+        for item in items:
+            try:
+                self.add(item)
+            except (KeyError, TypeError, ValueError):
+                self.rows_skipped += 1
+
+    def close(self) -> None:
+        """Flush all buffered rows and close every open file."""
+        for key in list(self._buffers):
+            self._flush(key)
+        while self._writers:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+
+    def _flush(self, key: Tuple[str, str]) -> None:
+        buf = self._buffers.pop(key, None)
+        if not buf or not buf["timestamp"]:
+            return
+        self._buffered -= len(buf["timestamp"])
+        table = pa.Table.from_pydict(buf, schema=SCHEMA).sort_by("timestamp")
+        self._writer_for(key).write_table(table, row_group_size=self.row_group_size)
+        self.rows_written += table.num_rows
+
+    def _writer_for(self, key: Tuple[str, str]) -> pq.ParquetWriter:
+        writer = self._writers.get(key)
+        if writer is not None:
+            self._writers.move_to_end(key)
+            return writer
+
+        if len(self._writers) >= self.max_open_files:
+            _, oldest = self._writers.popitem(last=False)
+            oldest.close()
+
+        date, device_id = key
+        part = self._part_counts.get(key, 0)
+        self._part_counts[key] = part + 1
+        directory = os.path.join(self.output_dir, f"date={date}", f"deviceId={device_id}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{part:05d}.parquet")
+
+        writer = pq.ParquetWriter(path, SCHEMA, compression=self.compression)
+        self._writers[key] = writer
+        self.files_written += 1
+        return writer
+
+
+def export_table(
+    table_name: str,
+    output_dir: str,
+    region: str = "us-east-1",
+    segments: int = 8,
+    row_group_size: int = 50_000,
+    max_open_files: int = 256,
+) -> Tuple[int, int, int]:
+    """Parallel-scan `table_name` into Parquet. Returns (rows written, files written, malformed items skipped)."""
+    scan_kwargs = {
+        "ProjectionExpression": PROJECTION,
+        "ExpressionAttributeNames": PROJECTION_NAMES,
+    }
+    writer = PartitionedParquetWriter(output_dir, row_group_size, max_open_files)
+    try:
+        for page in parallel_scan(table_name, region, segments, scan_kwargs):
+            writer.add_many(page)
+    finally:
+        writer.close()
+    return writer.rows_written, writer.files_written, writer.rows_skipped
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the DynamoDB location table to partitioned Parquet files.")
+    parser.add_argument("--table", default="transport-locations-dev", help="DynamoDB table name")
+    parser.add_argument("--region", default="us-east-1", help="AWS region of the table")
+    parser.add_argument("--output", default="export", help="Output directory for the Parquet dataset")
+    parser.add_argument("--segments", type=int, default=8, help="Number of parallel scan segments")
+    parser.add_argument("--row-group-size", type=int, default=50_000, help="Rows buffered per partition before a row group is written")
+    parser.add_argument("--max-open-files", type=int, default=256, help="Maximum Parquet writers kept open at once")
+    args = parser.parse_args()
+
+    rows, files, skipped = export_table(
+        args.table,
+        args.output,
+        region=args.region,
+        segments=args.segments,
+        row_group_size=args.row_group_size,
+        max_open_files=args.max_open_files,
+    )
+    print(f"Exported {rows} rows into {files} files under {args.output}")
+    if skipped:
+        print(f"Skipped {skipped} malformed items")
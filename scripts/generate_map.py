@@ -3,45 +3,137 @@
 generate_map.py: Fetch GPS data from DynamoDB and render an interactive map using Folium.
 """
 
-import boto3
-from decimal import Decimal
+from collections import Counter, defaultdict
+from typing import Optional
+
+from boto3.dynamodb.conditions import Attr, Key
 import folium
+from folium.plugins import FastMarkerCluster, HeatMap
+
+from ddb_scan import parallel_query, parallel_scan
+
+TRACK_COLORS = ["blue", "red", "green", "purple", "orange", "darkred", "cadetblue", "darkgreen"]
+
+
+def _time_condition(attribute, start_time: Optional[int], end_time: Optional[int]):
+    """`attribute` (an Attr or Key) within [start_time, end_time], either end optional; None if unbounded."""
+    if start_time is not None and end_time is not None:
+        return attribute.between(start_time, end_time)
+    if start_time is not None:
+        return attribute.gte(start_time)
+    if end_time is not None:
+        return attribute.lte(end_time)
+    return None
+
+
+def _projection() -> dict:
+    return {
+        "ProjectionExpression": "deviceId, latitude, longitude, #ts",
+        "ExpressionAttributeNames": {"#ts": "timestamp"},
+    }
+
+
+def build_scan_kwargs(
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+) -> dict:
+    """Build server-side filter and projection arguments for a scan of every device."""
+    kwargs = _projection()
+    condition = _time_condition(Attr("timestamp"), start_time, end_time)
+    if condition is not None:
+        kwargs["FilterExpression"] = condition
+    return kwargs
 
 
-def fetch_locations(table_name: str, region: str = "us-east-1") -> list[dict]:
-    """Scan the DynamoDB table and return a list of location dicts."""
-    ddb = boto3.resource("dynamodb", region_name=region)
-    table = ddb.Table(table_name)
+def build_query_kwargs(
+    device_id: str,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+) -> dict:
+    """
+    Build Query arguments for one device's partition, with the time range as a
+    sort key condition so only the matching items are read.
+    """
+    kwargs = _projection()
+    condition = Key("deviceId").eq(device_id)
+    time_condition = _time_condition(Key("timestamp"), start_time, end_time)
+    if time_condition is not None:
+        condition = condition & time_condition
+    kwargs["KeyConditionExpression"] = condition
+    return kwargs
 
-    items = []
-    response = table.scan()
-    items.extend(response.get("Items", []))
-    # Handle pagination
-    while "LastEvaluatedKey" in response:
-        response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-        items.extend(response.get("Items", []))
 
-    # Convert Decimal to float and pick relevant fields
+def fetch_locations(
+    table_name: str,
+    region: str = "us-east-1",
+    segments: int = 8,
+    device_ids: Optional[list[str]] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+) -> list[dict]:
+    """
+    Return a list of location dicts: queried per device when `device_ids` are
+    given, otherwise scanned in parallel segments. `segments` also bounds the
+    number of concurrent queries.
+    """
+    if device_ids:
+        queries = [build_query_kwargs(d, start_time, end_time) for d in dict.fromkeys(device_ids)]
+        pages = parallel_query(table_name, queries, region, max_workers=segments)
+    else:
+        pages = parallel_scan(table_name, region, segments, build_scan_kwargs(start_time, end_time))
+
+    # Convert Decimal to float and pick relevant fields as pages arrive
     locations = []
-    for item in items:
-        try:
-            locations.append({
-                "deviceId": item["deviceId"],
-                "lat": float(item["latitude"]),
-                "lon": float(item["longitude"]),
-                "timestamp": item.get("timestamp")
-            })
-        except KeyError:
-            continue
+    for page in pages:
+        for item in page:
+            try:
+                locations.append({
+                    "deviceId": item["deviceId"],
+                    "lat": float(item["latitude"]),
+                    "lon": float(item["longitude"]),
+                    "timestamp": item.get("timestamp")
+                })
+            except KeyError:
+                continue
     return locations
 
 
+def _heatmap_points(locations: list[dict], precision: int) -> list[list[float]]:
+    """Bin points to `precision` decimal places and weight each cell by its count."""
+    cells = Counter((round(loc["lat"], precision), round(loc["lon"], precision)) for loc in locations)
+    return [[lat, lon, count] for (lat, lon), count in cells.items()]
+
+
+def _device_tracks(locations: list[dict], max_points: int) -> dict[str, list[tuple[float, float]]]:
+    """Group points by device in time order, downsampled to at most `max_points` each."""
+    by_device = defaultdict(list)
+    for loc in locations:
+        by_device[loc["deviceId"]].append((int(loc["timestamp"] or 0), loc["lat"], loc["lon"]))
+
+    tracks = {}
+    for device_id, points in by_device.items():
+        points.sort()
+        step = max(1, -(-len(points) // max_points))
+        tracks[device_id] = [(lat, lon) for _, lat, lon in points[::step]]
+    return tracks
+
+
 def create_map(
     locations: list[dict],
     output_file: str = "map.html",
-    zoom_start: int = 12
+    zoom_start: int = 12,
+    mode: str = "markers",
+    heatmap_precision: int = 4,
+    max_track_points: int = 2000
 ) -> None:
-    """Build and save an interactive map with CircleMarkers for each GPS point."""
+    """
+    Build and save an interactive map of GPS points.
+
+    Modes:
+    - markers: one CircleMarker per point (only practical for small datasets)
+    - cluster: client-side marker clustering, points shipped as a compact array
+    - heatmap: binned heatmap layer plus one downsampled polyline per device
+    """
     if not locations:
         print("No location data found.")
         return
@@ -49,19 +141,39 @@ def create_map(
     # Center map at average coordinates
     avg_lat = sum(loc["lat"] for loc in locations) / len(locations)
     avg_lon = sum(loc["lon"] for loc in locations) / len(locations)
-    m = folium.Map(location=(avg_lat, avg_lon), zoom_start=zoom_start)
+    m = folium.Map(location=(avg_lat, avg_lon), zoom_start=zoom_start, prefer_canvas=True)
 
-    for loc in locations:
-        popup = f"{loc['deviceId']} @ {loc['timestamp']}"
-        folium.CircleMarker(
-            location=(loc["lat"], loc["lon"]),
-            radius=5,
-            popup=popup,
-            weight=1,
-            color="blue",
-            fill=True,
-            fill_opacity=0.7
-        ).add_to(m)
+    if mode == "markers":
+        for loc in locations:
+            popup = f"{loc['deviceId']} @ {loc['timestamp']}"
+            folium.CircleMarker(
+                location=(loc["lat"], loc["lon"]),
+                radius=5,
+                popup=popup,
+                weight=1,
+                color="blue",
+                fill=True,
+                fill_opacity=0.7
+            ).add_to(m)
+    elif mode == "cluster":
+        FastMarkerCluster([[loc["lat"], loc["lon"]] for loc in locations]).add_to(m)
+    elif mode == "heatmap":
+        HeatMap(_heatmap_points(locations, heatmap_precision), name="Density").add_to(m)
+        tracks = folium.FeatureGroup(name="Tracks")
+        for i, (device_id, points) in enumerate(_device_tracks(locations, max_track_points).items()):
+            if len(points) < 2:
+                continue
+            folium.PolyLine(
+                points,
+                weight=2,
+                opacity=0.8,
+                color=TRACK_COLORS[i % len(TRACK_COLORS)],
+                tooltip=device_id
+            ).add_to(tracks)
+        tracks.add_to(m)
+        folium.LayerControl().add_to(m)
+    else:
+        raise ValueError(f"Unknown map mode: {mode}")
 
     m.save(output_file)
     print(f"Map saved to {output_file}")
@@ -75,7 +187,19 @@ if __name__ == "__main__":
     parser.add_argument("--region", default="us-east-1", help="AWS region of the table")
     parser.add_argument("--output", default="map.html", help="Output HTML file for the map")
     parser.add_argument("--zoom", type=int, default=12, help="Initial zoom level")
+    parser.add_argument("--segments", type=int, default=8, help="Number of parallel scan segments, or concurrent device queries")
+    parser.add_argument("--device", action="append", dest="devices", help="Only include this device, read with a Query (repeatable)")
+    parser.add_argument("--start", type=int, default=None, help="Start timestamp (ms since epoch)")
+    parser.add_argument("--end", type=int, default=None, help="End timestamp (ms since epoch)")
+    parser.add_argument("--mode", choices=["markers", "cluster", "heatmap"], default="heatmap", help="Rendering mode")
     args = parser.parse_args()
 
-    locs = fetch_locations(args.table, args.region)
-    create_map(locs, output_file=args.output, zoom_start=args.zoom)
+    locs = fetch_locations(
+        args.table,
+        args.region,
+        segments=args.segments,
+        device_ids=args.devices,
+        start_time=args.start,
+        end_time=args.end
+    )
+    create_map(locs, output_file=args.output, zoom_start=args.zoom, mode=args.mode)
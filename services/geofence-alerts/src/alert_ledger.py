@@ -0,0 +1,126 @@
+"""
+Idempotent alert delivery for the alerts Lambda
+Every alert gets a key derived from the fix and transition that raised it,
+and the key is claimed with a conditional put before the alert is sent, so
+records that Kinesis redelivers after a partial batch failure never send the
+same alert twice
+
+A claim is pending until the alert is published and then marked sent. A
+container that dies in between leaves a pending claim that any container may
+take over once it expires, so the alert is delivered late rather than lost.
+"""
+
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+KEY_TTL_SECONDS = 86_400    # how long the table remembers a sent alert
+PENDING_TTL_SECONDS = 120   # how long a claim may stay unsent before others can take it over; above a send's retries
+MAX_CACHED_KEYS = 100_000   # keys remembered in the container, oldest dropped first
+
+
+def alert_key(alert: Dict[str, Any]) -> str:
+    """Deterministic ID for an alert: bus, event, station or zone, and fix timestamp"""
+    subject = alert.get('stationId') or alert.get('geofenceId')
+    return f"{alert['busId']}#{alert['alertType']}#{subject}#{alert['timestamp']}"
+
+
+class AlertPending(Exception):
+    """Raised when another container holds an unexpired claim on an alert it has not sent yet"""
+    pass
+
+
+class AlertLedger:
+    """
+    Keys of alerts already sent. Claims are checked against keys seen by
+    this container first, then made with a conditional put to `table` so
+    they hold across containers; without a table only redeliveries to the
+    same container are caught.
+
+    Claims record the container that made them, which may claim a key again
+    once it has released it, so a release whose delete fails does not lose
+    the alert when the record is redelivered to the same container. A claim
+    starts out pending with a `pending_ttl_seconds` expiry and becomes sent,
+    with the full `ttl_seconds`, once mark_sent() is called.
+
+    Items: alertId, owner, state (pending or sent) and ttl (epoch seconds,
+    for DynamoDB expiry and for taking over expired pending claims).
+    """
+
+    def __init__(self, table: Any = None, ttl_seconds: int = KEY_TTL_SECONDS,
+                 pending_ttl_seconds: int = PENDING_TTL_SECONDS):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.owner = uuid.uuid4().hex
+        self._keys: 'OrderedDict[str, None]' = OrderedDict()
+
+    def _remember(self, key: str):
+        self._keys[key] = None
+        if len(self._keys) > MAX_CACHED_KEYS:
+            self._keys.popitem(last=False)
+
+    def claim(self, key: str) -> bool:
+        """
+        True if the alert has not been sent yet and is now ours to send, False
+        if it was sent; raises AlertPending if another container is sending it
+        """
+        if key in self._keys:
+            return False
+        if self.table is not None:
+            now = int(time.time())
+            try:
+                self.table.put_item(
+                    Item={'alertId': key, 'owner': self.owner, 'state': 'pending',
+                          'ttl': now + self.pending_ttl_seconds},
+                    ConditionExpression=(
+                        'attribute_not_exists(alertId) OR #owner = :owner '
+                        'OR (#state = :pending AND #ttl < :now)'
+                    ),
+                    ExpressionAttributeNames={'#owner': 'owner', '#state': 'state', '#ttl': 'ttl'},
+                    ExpressionAttributeValues={':owner': self.owner, ':pending': 'pending', ':now': now}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                item = self.table.get_item(Key={'alertId': key}, ConsistentRead=True).get('Item')
+                if item is None or item.get('state') == 'pending':
+                    # Fail the record so it is retried once the claim is sent or has expired
+                    raise AlertPending(f"Alert {key} is being sent by another container")
+                self._remember(key)
+                return False
+        self._remember(key)
+        return True
+
+    def mark_sent(self, key: str):
+        """Record that a claimed alert was published, so its claim can no longer be taken over"""
+        if self.table is None:
+            return
+        try:
+            self.table.update_item(
+                Key={'alertId': key},
+                UpdateExpression='SET #state = :sent, #ttl = :ttl',
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#state': 'state', '#ttl': 'ttl', '#owner': 'owner'},
+                ExpressionAttributeValues={':sent': 'sent', ':ttl': int(time.time()) + self.ttl_seconds,
+                                           ':owner': self.owner}
+            )
+        except Exception as e:
+            # The alert is out; at worst another container sends it again once the claim expires
+            logger.error('Alert key update failed for %s: %s', key, e)
+
+    def release(self, key: str):
+        """Give up a claim whose alert could not be sent, so a retry can send it"""
+        self._keys.pop(key, None)
+        if self.table is not None:
+            try:
+                self.table.delete_item(Key={'alertId': key})
+            except Exception as e:
+                # Only this container can send the alert until the claim expires
+                logger.error('Alert key release failed for %s: %s', key, e)
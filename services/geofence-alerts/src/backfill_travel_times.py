@@ -0,0 +1,80 @@
+"""
+Backfill segment travel times from TrackStore location history
+Replays each device's stored fixes through map-matching and the travel time
+model, then adds the results to the travel times table
+
+Usage:
+    python backfill_travel_times.py --days 14
+"""
+
+import argparse
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator
+
+from boto3.dynamodb.conditions import Key
+
+import aws_clients
+from route_matching import RouteStore, StationIndex, _scan_all
+from travel_times import TravelTimeModel
+
+logger = logging.getLogger()
+
+
+def device_history(locations_table: Any, device_id: str, start_ms: int, end_ms: int) -> Iterator[Dict[str, Any]]:
+    """A device's stored fixes between two timestamps, oldest first"""
+    kwargs = {
+        'KeyConditionExpression': Key('deviceId').eq(device_id) & Key('timestamp').between(start_ms, end_ms),
+        'ScanIndexForward': True
+    }
+    while True:
+        response = locations_table.query(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def backfill(route_store: RouteStore, model: TravelTimeModel, device_table: Any, locations_table: Any,
+             start_ms: int, end_ms: int) -> int:
+    """Feed every device's history into `model`; returns the number of fixes matched"""
+    matched = 0
+    for device in _scan_all(device_table):
+        device_id = device['deviceId']
+        for item in device_history(locations_table, device_id, start_ms, end_ms):
+            if item.get('outlier'):
+                continue
+            heading = item.get('heading')
+            match = route_store.match_bus(device_id, float(item['latitude']), float(item['longitude']),
+                                          None if heading is None else float(heading),
+                                          device.get('routeId') or (device.get('attributes') or {}).get('routeId'))
+            if match is None:
+                continue
+            route, snap = match
+            model.observe(device_id, route, snap.offset, int(item['timestamp']))
+            matched += 1
+        logger.info('Backfilled %s (%d fixes matched so far)', device_id, matched)
+    model.flush()
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill segment travel times from location history.')
+    parser.add_argument('--days', type=float, default=14, help='Days of history to replay')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    dynamodb = aws_clients.resource('dynamodb')
+    route_store = RouteStore(dynamodb.Table(os.environ['ROUTES_TABLE_NAME']),
+                             StationIndex(dynamodb.Table(os.environ['STATIONS_TABLE_NAME'])))
+    model = TravelTimeModel(dynamodb.Table(os.environ['TRAVEL_TIMES_TABLE_NAME']))
+    end_ms = int(time.time() * 1000)
+    start_ms = end_ms - int(args.days * 86_400_000)
+    matched = backfill(route_store, model, dynamodb.Table(os.environ['DEVICE_TABLE_NAME']),
+                       dynamodb.Table(os.environ['LOCATION_TABLE_NAME']), start_ms, end_ms)
+    logger.info('Done: %d fixes matched', matched)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Per-bus geofence state for the alerts Lambda
+Tracks each bus against the stations around it as outside / approaching /
+inside / departed with hysteresis, and which polygon zones it is in, so
+alerts fire on transitions instead of being re-evaluated and de-duplicated
+on every fix
+"""
+
+import logging
+import math
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+logger = logging.getLogger()
+
+METERS_PER_DEGREE = 111_320.0
+
+# States; OUTSIDE is never stored, so a record only holds stations of interest
+OUTSIDE = 'outside'
+APPROACHING = 'approaching'
+INSIDE = 'inside'
+DEPARTED = 'departed'
+
+# Events emitted on transitions
+APPROACH = 'STATION_APPROACH'
+ARRIVED = 'STATION_ARRIVED'
+DEPARTED_EVENT = 'STATION_DEPARTED'
+ZONE_ENTERED = 'ZONE_ENTERED'
+ZONE_EXITED = 'ZONE_EXITED'
+
+APPROACH_ETA_S = 150       # enter APPROACHING at or under this ETA
+APPROACH_EXIT_ETA_S = 300  # along-route ETA above which a stop counts as behind or far off
+EXIT_RADIUS_FACTOR = 1.5   # leave INSIDE only beyond this multiple of the station radius
+ZONE_EXIT_FIXES = 2        # consecutive fixes outside a zone before it counts as exited
+
+
+@dataclass
+class Candidate:
+    """A station the bus may be heading for, from route matching or a radius search"""
+    station_id: str
+    name: str
+    lat: float
+    lon: float
+    radius: float
+    distance: float  # metres, along the route when along_route
+    eta: int
+    along_route: bool
+
+
+@dataclass
+class Transition:
+    event: str
+    station: Candidate
+    distance: float  # straight-line metres from the bus to the station
+
+
+@dataclass
+class ZoneTransition:
+    event: str
+    zone_id: str
+    name: str
+    category: Optional[str]
+
+
+def _distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # Equirectangular distance; accurate to well under a metre at geofence ranges
+    dy = (lat2 - lat1) * METERS_PER_DEGREE
+    dx = (lon2 - lon1) * METERS_PER_DEGREE * math.cos(math.radians(lat1))
+    return math.hypot(dx, dy)
+
+
+class GeofenceTracker:
+    """
+    Geofence state per (bus, station) and (bus, zone), cached in the warm
+    container and stored on the bus's device item as `geofenceState`:
+
+        {'ts': last fix,
+         'stations': {stationId: [state, since, lat, lon, radius, name, along_route]},
+         'zones': {geofenceId: [fixes outside, name, category]}}
+
+    Records are read once per bus per container, along with the route
+    assigned to the bus on its device item, and written back by flush()
+    only for buses that changed state, so a bus driving between stations
+    costs no DynamoDB traffic.
+
+    Transitions, with the event emitted:
+        OUTSIDE/APPROACHING/DEPARTED -> INSIDE
+                                            within the station radius (ARRIVED)
+        OUTSIDE -> APPROACHING              ETA <= APPROACH_ETA_S (APPROACH)
+        INSIDE -> DEPARTED                  beyond EXIT_RADIUS_FACTOR x radius (DEPARTED)
+        APPROACHING/DEPARTED -> OUTSIDE     no longer a candidate, or its along-route ETA
+                                            is over APPROACH_EXIT_ETA_S (the stop is behind)
+
+    Straight-line candidates only leave APPROACHING/DEPARTED once the bus is
+    over `release_distance_m` away, which should exceed the search radius,
+    since their speed-based ETAs are too noisy to decide that a bus has
+    turned away.
+
+    Fixes older than the last one applied to a bus are ignored. A record
+    that cannot be loaded raises, so the fix can be retried rather than
+    applied to empty state.
+    """
+
+    def __init__(self, device_table: Any, release_distance_m: float = 1250.0):
+        self.device_table = device_table
+        self.release_distance_m = release_distance_m
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _record(self, bus_id: str) -> Dict[str, Any]:
+        record = self._records.get(bus_id)
+        if record is not None:
+            return record
+        record = {'ts': 0, 'stations': {}, 'zones': {}, 'route': None}
+        try:
+            item = self.device_table.get_item(
+                Key={'deviceId': bus_id},
+                ProjectionExpression='geofenceState, routeId, #attributes.routeId',
+                ExpressionAttributeNames={'#attributes': 'attributes'}
+            ).get('Item', {})
+            stored = item.get('geofenceState')
+            if stored:
+                record = {
+                    'ts': int(stored.get('ts', 0)),
+                    'stations': {
+                        sid: [s[0], int(s[1]), float(s[2]), float(s[3]), float(s[4]), s[5], bool(s[6])]
+                        for sid, s in stored.get('stations', {}).items()
+                    },
+                    'zones': {
+                        zid: [int(z[0]), z[1], z[2]]
+                        for zid, z in stored.get('zones', {}).items()
+                    }
+                }
+            record['route'] = item.get('routeId') or (item.get('attributes') or {}).get('routeId')
+        except Exception as e:
+            # Not cached: starting from empty state would repeat alerts already sent
+            logger.error('Geofence state load failed for %s: %s', bus_id, e)
+            raise
+        self._records[bus_id] = record
+        return record
+
+    def checkpoint(self, bus_id: str) -> Dict[str, Any]:
+        """A copy of a bus's record, to restore() if a fix fails part-way through"""
+        record = self._record(bus_id)
+        return {
+            'ts': record['ts'],
+            'stations': {sid: list(s) for sid, s in record['stations'].items()},
+            'zones': {zid: list(z) for zid, z in record['zones'].items()},
+            'route': record['route']
+        }
+
+    def restore(self, bus_id: str, checkpoint: Dict[str, Any]):
+        """Roll a bus back to a checkpoint, so a redelivered fix raises the same transitions"""
+        self._records[bus_id] = checkpoint
+
+    def assigned_route(self, bus_id: str) -> Optional[str]:
+        """The route set on the bus's device item (routeId or attributes.routeId), if any"""
+        return self._record(bus_id)['route']
+
+    def update(self, bus_id: str, ts: int, lat: float, lon: float,
+               candidates: List[Candidate]) -> List[Transition]:
+        """Apply one fix; returns the transitions that should be alerted"""
+        record = self._record(bus_id)
+        if ts < record['ts']:
+            return []
+        record['ts'] = ts
+        states = record['stations']
+        events: List[Transition] = []
+        changed = False
+
+        seen = set()
+        for c in candidates:
+            seen.add(c.station_id)
+            entry = states.get(c.station_id)
+            state = entry[0] if entry else OUTSIDE
+            distance = _distance_m(lat, lon, c.lat, c.lon)
+            new_state, event = state, None
+
+            if state in (OUTSIDE, APPROACHING):
+                if distance <= c.radius:
+                    new_state, event = INSIDE, ARRIVED
+                elif state == OUTSIDE and c.eta <= APPROACH_ETA_S:
+                    new_state, event = APPROACHING, APPROACH
+                elif state == APPROACHING and c.along_route and c.eta > APPROACH_EXIT_ETA_S:
+                    new_state = OUTSIDE
+            elif state == INSIDE:
+                if distance > c.radius * EXIT_RADIUS_FACTOR:
+                    new_state, event = DEPARTED, DEPARTED_EVENT
+            elif state == DEPARTED:
+                # A loop route, or a bus that turned back, can reach the stop again
+                if distance <= c.radius:
+                    new_state, event = INSIDE, ARRIVED
+                elif c.along_route and c.eta > APPROACH_EXIT_ETA_S:
+                    new_state = OUTSIDE
+
+            if new_state != state:
+                changed = True
+                if new_state == OUTSIDE:
+                    del states[c.station_id]
+                else:
+                    states[c.station_id] = [new_state, ts, c.lat, c.lon, c.radius, c.name, c.along_route]
+            if event:
+                events.append(Transition(event, c, distance))
+
+        # Stations that dropped out of the candidates (passed, or out of range)
+        for station_id in [s for s in states if s not in seen]:
+            state, _, s_lat, s_lon, radius, name, along_route = states[station_id]
+            distance = _distance_m(lat, lon, s_lat, s_lon)
+            if state == INSIDE:
+                if distance > radius * EXIT_RADIUS_FACTOR:
+                    states[station_id] = [DEPARTED, ts, s_lat, s_lon, radius, name, along_route]
+                    events.append(Transition(
+                        DEPARTED_EVENT,
+                        Candidate(station_id, name, s_lat, s_lon, radius, distance, 0, along_route),
+                        distance
+                    ))
+                    changed = True
+            elif along_route or distance > self.release_distance_m:
+                del states[station_id]
+                changed = True
+
+        if changed:
+            self._dirty.add(bus_id)
+        return events
+
+    def update_zones(self, bus_id: str, ts: int, zones: Sequence[Any]) -> List[ZoneTransition]:
+        """
+        Apply the polygon geofences (anything with geofence_id, name and
+        category) containing one fix; returns zone entries and exits.
+        """
+        record = self._record(bus_id)
+        if ts < record['ts']:
+            return []
+        record['ts'] = ts
+        current = record['zones']
+        events: List[ZoneTransition] = []
+        changed = False
+
+        inside = set()
+        for zone in zones:
+            inside.add(zone.geofence_id)
+            entry = current.get(zone.geofence_id)
+            if entry is None:
+                current[zone.geofence_id] = [0, zone.name, zone.category]
+                events.append(ZoneTransition(ZONE_ENTERED, zone.geofence_id, zone.name, zone.category))
+                changed = True
+            elif entry[0]:
+                entry[0] = 0
+                changed = True
+
+        for zone_id in [z for z in current if z not in inside]:
+            entry = current[zone_id]
+            entry[0] += 1
+            changed = True
+            # A single fix outside is often GPS noise along the boundary
+            if entry[0] >= ZONE_EXIT_FIXES:
+                del current[zone_id]
+                events.append(ZoneTransition(ZONE_EXITED, zone_id, entry[1], entry[2]))
+
+        if changed:
+            self._dirty.add(bus_id)
+        return events
+
+    def flush(self):
+        """Write back the records of buses whose state changed"""
+        for bus_id in list(self._dirty):
+            record = self._records[bus_id]
+            state = {
+                'ts': record['ts'],
+                'stations': {
+                    sid: [s[0], s[1], Decimal(str(s[2])), Decimal(str(s[3])), Decimal(str(s[4])), s[5], s[6]]
+                    for sid, s in record['stations'].items()
+                },
+                'zones': record['zones']
+            }
+            try:
+                self.device_table.update_item(
+                    Key={'deviceId': bus_id},
+                    UpdateExpression='SET geofenceState = :s',
+                    ExpressionAttributeValues={':s': state}
+                )
+            except Exception as e:
+                # Stays dirty and is retried on the next flush
+                logger.error('Geofence state flush failed for %s: %s', bus_id, e)
+                continue
+            self._dirty.discard(bus_id)
@@ -1,38 +1,71 @@
 import json
-import boto3
 import os
 import logging
 import base64
 import math
-from datetime import datetime
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 from dataclasses import dataclass
 from decimal import Decimal
 
+import aws_clients
+import latency_trace
+import telemetry_codec
+from alert_ledger import AlertLedger, alert_key
+from geofence_state import APPROACH, Candidate, GeofenceTracker
+from polygons import PolygonStore
+from route_matching import RouteStore, StationIndex
+from travel_times import TravelTimeModel
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
+# Initialize AWS clients; pooled and reused across warm invocations
+dynamodb = aws_clients.resource('dynamodb')
 
 # WebSocket management API; endpoint URL must be set in env
-ws_client = boto3.client(
+ws_client = aws_clients.client(
     'apigatewaymanagementapi',
     endpoint_url=os.environ['WEBSOCKET_ENDPOINT']
 )
 
-eventbridge = boto3.client('events')
+eventbridge = aws_clients.client('events')
 
 # Tables from environment
 device_table      = dynamodb.Table(os.environ['DEVICE_TABLE_NAME'])
-stations_table    = dynamodb.Table(os.environ['STATIONS_TABLE_NAME'])
+stations          = StationIndex(dynamodb.Table(os.environ['STATIONS_TABLE_NAME']))
 connections_table = dynamodb.Table(os.environ['CONNECTIONS_TABLE_NAME'])
 event_bus         = os.environ.get('EVENT_BUS_NAME', 'default')
 
+# Per-bus geofence state, cached for the life of the container
+geofences = GeofenceTracker(device_table)
+
+# Keys of alerts already sent, so redelivered records never alert twice;
+# shared across containers when a table is configured
+sent_alerts = AlertLedger(
+    dynamodb.Table(os.environ['SENT_ALERTS_TABLE_NAME']) if os.environ.get('SENT_ALERTS_TABLE_NAME') else None
+)
+
+# Polygon geofences (terminals, depots, detour zones) shared with the geofence service
+polygon_store = None
+if os.environ.get('GEOFENCE_TABLE_NAME'):
+    polygon_store = PolygonStore(dynamodb.Table(os.environ['GEOFENCE_TABLE_NAME']))
+
+# Route geometries are optional; without them ETAs fall back to straight-line distance
+route_store = None
+travel_times = None
+if os.environ.get('ROUTES_TABLE_NAME'):
+    route_store = RouteStore(dynamodb.Table(os.environ['ROUTES_TABLE_NAME']), stations)
+    # Learned segment travel times; shared across containers when a table is configured
+    travel_times = TravelTimeModel(
+        dynamodb.Table(os.environ['TRAVEL_TIMES_TABLE_NAME']) if os.environ.get('TRAVEL_TIMES_TABLE_NAME') else None
+    )
+
 # Constants
 AVERAGE_BUS_SPEED_KMH = 30  # fallback speed
 TWO_MINUTES_METERS    = (AVERAGE_BUS_SPEED_KMH * 1000 / 60) * 2
+ROUTE_LOOKAHEAD_METERS = 2500  # along-route window for downstream stops
+ARRIVAL_RADIUS_METERS  = 40    # default station geofence radius
 
 @dataclass
 class Station:
@@ -48,7 +81,7 @@ class BusLocation:
     lat: float
     lon: float
     speed: float
-    heading: int
+    heading: Optional[int]
     timestamp: int
 
 
@@ -71,15 +104,15 @@ def calculate_eta_seconds(distance: float, speed: float) -> int:
 
 
 def get_nearby_stations(lat: float, lon: float) -> List[Tuple[Station, float]]:
-    """Scan stations_table and return those within TWO_MINUTES_METERS."""
+    """Return cached stations within TWO_MINUTES_METERS, nearest first."""
     out: List[Tuple[Station, float]] = []
-    for item in stations_table.scan().get('Items', []):
+    for item in stations.near(lat, lon, TWO_MINUTES_METERS):
         station = Station(
             station_id=item['stationId'],
             name=item['name'],
             lat=float(item['latitude']),
             lon=float(item['longitude']),
-            radius_meters=float(item.get('radiusMeters', TWO_MINUTES_METERS))
+            radius_meters=float(item.get('radiusMeters', ARRIVAL_RADIUS_METERS))
         )
         dist = haversine_distance(lat, lon, station.lat, station.lon)
         if dist <= TWO_MINUTES_METERS:
@@ -87,6 +120,36 @@ def get_nearby_stations(lat: float, lon: float) -> List[Tuple[Station, float]]:
     return sorted(out, key=lambda x: x[1])
 
 
+def get_stations_ahead(bus: BusLocation,
+                       route_hint: Optional[str] = None) -> Tuple[List[Tuple[Station, float, int]], Any]:
+    """
+    Snap the bus to its route and return downstream stops with their
+    along-route distance and ETA, plus the route ID; ([], None) if off-route.
+
+    The bus is matched against `route_hint` first, then the device's
+    assigned route, then the route it last matched, and only otherwise
+    against the routes near it.
+
+    ETAs come from learned segment travel times for the current hour, or
+    from the bus's speed until the route has history.
+    """
+    if route_store is None:
+        return [], None
+    match = route_store.match_bus(bus.bus_id, bus.lat, bus.lon, bus.heading,
+                                  route_hint or geofences.assigned_route(bus.bus_id))
+    if match is None:
+        return [], None
+    route, snap = match
+    travel_times.observe(bus.bus_id, route, snap.offset, bus.timestamp)
+
+    out = []
+    for stop, ahead in route.stops_ahead(snap.offset, ROUTE_LOOKAHEAD_METERS):
+        eta = travel_times.eta_seconds(route, snap.offset, stop.offset, bus.timestamp)
+        eta = calculate_eta_seconds(ahead, bus.speed) if eta is None else int(eta)
+        out.append((Station(stop.station_id, stop.name, stop.lat, stop.lon, ARRIVAL_RADIUS_METERS), ahead, eta))
+    return out, route.route_id
+
+
 def send_eventbridge_alert(detail: Dict[str, Any]):
     """Publish one alert event to EventBridge."""
     entry = {
@@ -97,7 +160,8 @@ def send_eventbridge_alert(detail: Dict[str, Any]):
     }
     res = eventbridge.put_events(Entries=[entry])
     if res.get('FailedEntryCount', 0):
-        logger.error('EventBridge failed: %s', res['Entries'])
+        # Raised so the record is retried rather than the alert dropped
+        raise RuntimeError(f"EventBridge failed: {res['Entries']}")
 
 
 def send_ws_alert(detail: Dict[str, Any]):
@@ -116,55 +180,189 @@ def send_ws_alert(detail: Dict[str, Any]):
             logger.error('WS send error %s: %s', cid, e)
 
 
+def publish_alert(alert: Dict[str, Any], trace: Optional[latency_trace.HopTrace] = None) -> bool:
+    """
+    Send an alert unless its key was already claimed; returns whether it was
+    sent. EventBridge failures release the claim and raise so a retry can
+    send it, and the claim is marked sent once the event is published;
+    WebSocket delivery is best-effort after that.
+    """
+    key = alert_key(alert)
+    if not sent_alerts.claim(key):
+        return False
+    alert['alertId'] = key
+    started = latency_trace.now_ms()
+    try:
+        send_eventbridge_alert(alert)
+    except Exception:
+        sent_alerts.release(key)
+        raise
+    sent_alerts.mark_sent(key)
+    try:
+        send_ws_alert(alert)
+    except Exception as e:
+        logger.error('WS broadcast error for %s: %s', key, e)
+    if trace is not None:
+        trace.since('send', started)
+        trace.since('total', alert['timestamp'])
+    return True
+
+
+def is_valid_fix(payload: Dict[str, Any]) -> bool:
+    """A fix with a bus ID, finite coordinates and a timestamp."""
+    return (
+        isinstance(payload.get('busId'), str)
+        and isinstance(payload.get('lat'), (int, float)) and isinstance(payload.get('lon'), (int, float))
+        and math.isfinite(payload['lat']) and math.isfinite(payload['lon'])
+        and isinstance(payload.get('ts'), (int, float))
+    )
+
+
+def locate_zones(payloads: List[Dict[str, Any]]) -> List[List[Any]]:
+    """Polygon geofences containing each fix, tested for the whole batch at once."""
+    zones: List[List[Any]] = [[] for _ in payloads]
+    if polygon_store is None:
+        return zones
+    located = [i for i, p in enumerate(payloads) if is_valid_fix(p)]
+    found = polygon_store.index().containing_many([(payloads[i]['lat'], payloads[i]['lon']) for i in located])
+    for i, polygons in zip(located, found):
+        zones[i] = polygons
+    return zones
+
+
+def process_location(payload: Dict[str, Any], zones: Sequence[Any] = (),
+                     trace: Optional[latency_trace.HopTrace] = None) -> int:
+    """
+    Advance the bus's geofence state with one location fix and alert on
+    every transition (station approach, arrival and departure, and entry to
+    or exit from the polygon `zones` containing the fix); returns alerts sent.
+    Alert delivery latencies are added to `trace`.
+    """
+    alerts_sent = 0
+    bus = BusLocation(
+        bus_id=payload['busId'],
+        lat=payload['lat'],
+        lon=payload['lon'],
+        speed=payload.get('speed', AVERAGE_BUS_SPEED_KMH),
+        heading=payload.get('heading'),
+        timestamp=payload['ts']
+    )
+    nearby, route_id = get_stations_ahead(bus, payload.get('routeId'))
+    if route_id is None:
+        nearby = [
+            (station, dist, calculate_eta_seconds(dist, bus.speed))
+            for station, dist in get_nearby_stations(bus.lat, bus.lon)
+        ]
+    candidates = [
+        Candidate(station.station_id, station.name, station.lat, station.lon, station.radius_meters,
+                  dist, eta, route_id is not None)
+        for station, dist, eta in nearby
+    ]
+
+    for transition in geofences.update(bus.bus_id, bus.timestamp, bus.lat, bus.lon, candidates):
+        station = transition.station
+        approach = transition.event == APPROACH
+        alert = {
+            'alertType': transition.event,
+            'busId': bus.bus_id,
+            'stationId': station.station_id,
+            'stationName': station.name,
+            'distanceMeters': round(station.distance if approach else transition.distance, 1),
+            'busLocation': {'lat': bus.lat, 'lon': bus.lon},
+            'timestamp': bus.timestamp
+        }
+        if approach:
+            alert['etaSeconds'] = station.eta
+        if route_id is not None:
+            alert['routeId'] = route_id
+        alerts_sent += publish_alert(alert, trace)
+
+    for transition in geofences.update_zones(bus.bus_id, bus.timestamp, zones):
+        alert = {
+            'alertType': transition.event,
+            'busId': bus.bus_id,
+            'geofenceId': transition.zone_id,
+            'geofenceName': transition.name,
+            'category': transition.category,
+            'busLocation': {'lat': bus.lat, 'lon': bus.lon},
+            'timestamp': bus.timestamp
+        }
+        alerts_sent += publish_alert(alert, trace)
+
+    return alerts_sent
+
+
 def handler(event: Any, context: Any) -> Dict[str, Any]:
-    """Lambda entry point: process Kinesis records and send alerts."""
+    """
+    Lambda entry point: process Kinesis records and send alerts.
+
+    Records whose fixes fail (throttling, EventBridge errors) are returned
+    in batchItemFailures, so with ReportBatchItemFailures enabled on the
+    event source mapping only the stream from the first failed record is
+    redelivered; alerts already sent are skipped then by their keys. A
+    failed fix rolls its bus back, and the bus's later fixes in the batch
+    are held for the redelivery. Records that cannot be decoded and
+    malformed fixes are logged and dropped, as retrying cannot fix them.
+
+    Logs one JSON line per invocation with per-hop latency percentiles
+    (ms): kinesis (processed_at to stream arrival), poll (arrival to this
+    invocation), send (EventBridge and WebSocket delivery) and total
+    (device ts to alert delivered).
+    """
+    received = latency_trace.now_ms()
+    trace = latency_trace.HopTrace('geofence-alerts')
     records = event.get('Records', [])
     alerts_sent = 0
 
-    for rec in records:
+    payloads, sources = [], []
+    for index, rec in enumerate(records):
         try:
             raw = base64.b64decode(rec['kinesis']['data'])
-            payload = json.loads(raw)
-            bus = BusLocation(
-                bus_id=payload['busId'],
-                lat=payload['lat'],
-                lon=payload['lon'],
-                speed=payload.get('speed', AVERAGE_BUS_SPEED_KMH),
-                heading=payload.get('heading', 0),
-                timestamp=payload['ts']
-            )
-            stations = get_nearby_stations(bus.lat, bus.lon)
-
-            for station, dist in stations:
-                eta = calculate_eta_seconds(dist, bus.speed)
-                # threshold: 90-150s
-                if 90 <= eta <= 150:
-                    alert = {
-                        'alertType': 'STATION_APPROACH',
-                        'busId': bus.bus_id,
-                        'stationId': station.station_id,
-                        'stationName': station.name,
-                        'distanceMeters': round(dist, 1),
-                        'etaSeconds': eta,
-                        'busLocation': {'lat': bus.lat, 'lon': bus.lon},
-                        'timestamp': bus.timestamp
-                    }
-                    key = f'approach_{station.station_id}'
-                    item = device_table.get_item(Key={'deviceId': bus.bus_id}).get('Item', {})
-                    last = item.get('recentAlerts', {}).get(key, 0)
-                    now = int(datetime.utcnow().timestamp() * 1000)
-
-                    if now - last > 300000:
-                        send_eventbridge_alert(alert)
-                        send_ws_alert(alert)
-                        device_table.update_item(
-                            Key={'deviceId': bus.bus_id},
-                            UpdateExpression='SET recentAlerts.#k = :t',
-                            ExpressionAttributeNames={'#k': key},
-                            ExpressionAttributeValues={':t': now}
-                        )
-                        alerts_sent += 1
+            # A record holds one or more fixes, as JSON or a binary frame
+            fixes = telemetry_codec.decode(raw)
+        except Exception as e:
+            logger.error('Record decode error: %s', e)
+            continue
+        arrival = rec['kinesis'].get('approximateArrivalTimestamp')
+        if arrival is not None:
+            trace.add('poll', received - arrival * 1000)
+        for payload in fixes:
+            if is_valid_fix(payload):
+                payloads.append(payload)
+                sources.append(index)
+                if arrival is not None and payload.get('processed_at'):
+                    trace.add('kinesis', arrival * 1000 - payload['processed_at'])
+            else:
+                logger.error('Malformed fix dropped: %s', payload)
+
+    failed_records = set()
+    failed_buses = set()
+    for payload, zones, index in zip(payloads, locate_zones(payloads), sources):
+        bus_id = payload['busId']
+        if bus_id in failed_buses:
+            failed_records.add(index)
+            continue
+        checkpoint = None
+        try:
+            checkpoint = geofences.checkpoint(bus_id)
+            alerts_sent += process_location(payload, zones, trace)
         except Exception as e:
             logger.error('Record processing error: %s', e)
+            if checkpoint is not None:
+                geofences.restore(bus_id, checkpoint)
+            failed_records.add(index)
+            failed_buses.add(bus_id)
+
+    # State records are written once per batch, only for buses that changed state
+    geofences.flush()
+    if travel_times is not None:
+        travel_times.maybe_flush()
+    trace.log(logger, records=len(records), alerts=alerts_sent, failed=len(failed_records))
 
-    return {'recordsProcessed': len(records), 'alertsSent': alerts_sent}
\ No newline at end of file
+    return {
+        'recordsProcessed': len(records),
+        'alertsSent': alerts_sent,
+        'batchItemFailures': [
+            {'itemIdentifier': records[index]['kinesis']['sequenceNumber']} for index in sorted(failed_records)
+        ]
+    }
@@ -0,0 +1,63 @@
+"""
+Per-hop latency tracing for the Lambdas
+Each invocation collects the latency (ms) of every hop it sees in a
+HopTrace, and logs one JSON line summarising each hop (count, p50, p90, p99,
+max), so CloudWatch Logs Insights can chart where fixes spend their time:
+
+    filter trace = "geofence-alerts"
+    | stats max(hops.total.p99) by bin(5m)
+
+Hops spanning the device clock (anything measured from a fix's `ts`)
+include any clock skew on the bus.
+
+This module is copied verbatim into each Lambda that traces
+(ingestion-lambda, geofence-alerts). Keep the copies identical.
+"""
+
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, List
+
+PERCENTILES = (50, 90, 99)
+
+
+def now_ms() -> float:
+    return time.time() * 1000
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+class HopTrace:
+    """Latencies per hop for one invocation of `stage`"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.hops: Dict[str, List[float]] = {}
+
+    def add(self, hop: str, latency_ms: float):
+        self.hops.setdefault(hop, []).append(latency_ms)
+
+    def since(self, hop: str, start_ms: float):
+        """Add the time from `start_ms` (epoch ms) until now"""
+        self.add(hop, now_ms() - start_ms)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        hops = {}
+        for hop, latencies in self.hops.items():
+            ordered = sorted(latencies)
+            stats = {'count': len(ordered)}
+            for q in PERCENTILES:
+                stats[f'p{q}'] = round(_percentile(ordered, q), 1)
+            stats['max'] = round(ordered[-1], 1)
+            hops[hop] = stats
+        return hops
+
+    def log(self, logger: logging.Logger, **fields: Any):
+        """Log the summary as one JSON line, if anything was traced"""
+        if self.hops and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({'trace': self.stage, **fields, 'hops': self.summary()}))
@@ -0,0 +1,194 @@
+"""
+Polygon geofences for the alerts Lambda
+Terminals, depots and detour zones from the geofences table, with a grid index
+that settles most fixes from their cell alone and a latitude-band edge index
+per zone for the fixes in cells a zone boundary passes through
+"""
+
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from route_matching import _scan_all
+
+logger = logging.getLogger()
+
+CELL_SIZE_DEG = 0.002  # grid cell edge, about 220 m north-south
+MAX_BANDS = 64         # latitude bands per polygon edge index
+LOAD_RETRY_SECONDS = 30.0  # wait after a failed load before scanning again
+
+
+class PolygonGeofence:
+    """
+    A simple polygon (lat, lon vertices, either winding, implicitly closed).
+
+    Edges are bucketed into horizontal bands of latitude, so a ray cast
+    only visits edges in the point's band: a handful even for polygons
+    with hundreds of vertices.
+    """
+
+    __slots__ = ('geofence_id', 'name', 'category', 'points', 'min_lat', 'max_lat', 'min_lon', 'max_lon',
+                 '_band_height', '_bands')
+
+    def __init__(self, geofence_id: str, name: str, points: Sequence[Tuple[float, float]],
+                 category: Optional[str] = None):
+        if len(points) < 3:
+            raise ValueError(f"Polygon {geofence_id} needs at least three points")
+        self.geofence_id = geofence_id
+        self.name = name
+        self.category = category
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        lats = [p[0] for p in self.points]
+        lons = [p[1] for p in self.points]
+        self.min_lat, self.max_lat = min(lats), max(lats)
+        self.min_lon, self.max_lon = min(lons), max(lons)
+
+        n_bands = max(1, min(len(self.points) // 2, MAX_BANDS))
+        self._band_height = (self.max_lat - self.min_lat) / n_bands or 1.0
+        self._bands: List[List[Tuple[float, float, float, float]]] = [[] for _ in range(n_bands)]
+        for (lat1, lon1), (lat2, lon2) in zip(self.points, self.points[1:] + self.points[:1]):
+            if lat1 == lat2:
+                continue  # horizontal edges never cross an eastward ray
+            # (lower lat, upper lat, lon at lower lat, dlon/dlat)
+            if lat1 > lat2:
+                lat1, lon1, lat2, lon2 = lat2, lon2, lat1, lon1
+            edge = (lat1, lat2, lon1, (lon2 - lon1) / (lat2 - lat1))
+            for band in range(self._band(lat1), self._band(lat2) + 1):
+                self._bands[band].append(edge)
+
+    def _band(self, lat: float) -> int:
+        return min(int((lat - self.min_lat) / self._band_height), len(self._bands) - 1)
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Even-odd ray cast; points exactly on an edge may fall either way"""
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon):
+            return False
+        bands = self._bands
+        band = int((lat - self.min_lat) / self._band_height)
+        inside = False
+        for low, high, lon0, slope in bands[band] if band < len(bands) else bands[-1]:
+            if low <= lat < high and lon < lon0 + (lat - low) * slope:
+                inside = not inside
+        return inside
+
+
+def _cell(lat: float, lon: float) -> Tuple[int, int]:
+    return int(math.floor(lat / CELL_SIZE_DEG)), int(math.floor(lon / CELL_SIZE_DEG))
+
+
+class PolygonIndex:
+    """
+    Grid from cell to (polygons covering the whole cell, polygons whose
+    boundary passes through it). Points in a cell are inside every covering
+    polygon without a test; only boundary polygons need a ray cast. Cells
+    outside a polygon, even within its bounding box, do not list it.
+    """
+
+    def __init__(self, polygons: Sequence[PolygonGeofence]):
+        self.polygons = list(polygons)
+        self._grid: Dict[Tuple[int, int], Tuple[List[PolygonGeofence], List[PolygonGeofence]]] = {}
+        for polygon in self.polygons:
+            # Cells touched by an edge's bounding box (a superset of those it crosses)
+            boundary = set()
+            points = polygon.points
+            for (lat1, lon1), (lat2, lon2) in zip(points, points[1:] + points[:1]):
+                r0, c0 = _cell(min(lat1, lat2), min(lon1, lon2))
+                r1, c1 = _cell(max(lat1, lat2), max(lon1, lon2))
+                boundary.update((r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1))
+
+            r0, c0 = _cell(polygon.min_lat, polygon.min_lon)
+            r1, c1 = _cell(polygon.max_lat, polygon.max_lon)
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    if (r, c) in boundary:
+                        self._entry((r, c))[1].append(polygon)
+                    elif polygon.contains((r + 0.5) * CELL_SIZE_DEG, (c + 0.5) * CELL_SIZE_DEG):
+                        # No edge enters the cell, so its centre decides for all of it
+                        self._entry((r, c))[0].append(polygon)
+
+    def _entry(self, cell: Tuple[int, int]) -> Tuple[List[PolygonGeofence], List[PolygonGeofence]]:
+        entry = self._grid.get(cell)
+        if entry is None:
+            entry = self._grid[cell] = ([], [])
+        return entry
+
+    def __len__(self) -> int:
+        return len(self.polygons)
+
+    def containing(self, lat: float, lon: float) -> List[PolygonGeofence]:
+        """Polygons containing one point"""
+        entry = self._grid.get(_cell(lat, lon))
+        if entry is None:
+            return []
+        covering, boundary = entry
+        return covering + [p for p in boundary if p.contains(lat, lon)]
+
+    def containing_many(self, points: Sequence[Tuple[float, float]]) -> List[List[PolygonGeofence]]:
+        """
+        Polygons containing each of a batch of points. Points are grouped by
+        cell first, so each cell's entry is looked up once for all the points
+        in it and each boundary polygon is tested against them in one loop.
+        """
+        out: List[List[PolygonGeofence]] = [[] for _ in points]
+        by_cell: Dict[Tuple[int, int], List[int]] = {}
+        for i, (lat, lon) in enumerate(points):
+            by_cell.setdefault(_cell(lat, lon), []).append(i)
+        grid = self._grid
+        for cell, indices in by_cell.items():
+            entry = grid.get(cell)
+            if entry is None:
+                continue
+            covering, boundary = entry
+            for i in indices:
+                out[i].extend(covering)
+            for polygon in boundary:
+                contains = polygon.contains
+                for i in indices:
+                    if contains(*points[i]):
+                        out[i].append(polygon)
+        return out
+
+
+class PolygonStore:
+    """
+    Active polygon geofences from the geofences table shared with the
+    geofence service (type 'polygon', coordinates.points as {lat, lng}),
+    indexed and cached for `ttl_seconds`. Circle geofences are stations
+    and are left to the station checks.
+    """
+
+    def __init__(self, table: Any, ttl_seconds: float = 300.0):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self._index = PolygonIndex([])
+        self._loaded_at = -math.inf
+
+    def index(self) -> PolygonIndex:
+        if time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self._load()
+        return self._index
+
+    def _load(self):
+        polygons = []
+        try:
+            items = _scan_all(self.table)
+        except Exception as e:
+            logger.error('Polygon geofence load failed: %s', e)
+            # Keep the last index and retry later, not on every batch during an outage
+            self._loaded_at = time.monotonic() - self.ttl_seconds + LOAD_RETRY_SECONDS
+            return
+        for item in items:
+            if item.get('type') != 'polygon' or not item.get('isActive', True):
+                continue
+            try:
+                points = [(float(p['lat']), float(p['lng'])) for p in item['coordinates']['points']]
+                polygons.append(PolygonGeofence(
+                    item['id'], item.get('name', item['id']), points,
+                    (item.get('metadata') or {}).get('category')
+                ))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error('Skipping geofence %s: %s', item.get('id'), e)
+        self._index = PolygonIndex(polygons)
+        self._loaded_at = time.monotonic()
+        logger.info('Loaded %d polygon geofences', len(polygons))
@@ -0,0 +1,340 @@
+"""
+Route geometry and map-matching for the geofence alerts Lambda
+Snaps fixes onto route polylines through a precomputed grid index of
+segments and gives the along-route distance to each downstream stop; buses
+are matched against their own route first and otherwise only against the
+routes near them
+"""
+
+import logging
+import math
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger()
+
+METERS_PER_DEGREE = 111_320.0
+CELL_SIZE_M = 100.0          # grid cell edge for the segment index
+MAX_SNAP_DISTANCE_M = 50.0   # fixes further than this from every segment are off-route
+MAX_HEADING_DIFF_DEG = 90.0  # segments driven the other way are skipped when heading is known
+NETWORK_CELL_DEG = 0.005     # cell edge for the route and station network grids, about 550 m north-south
+LOAD_RETRY_SECONDS = 30.0    # wait after a failed load before scanning again
+
+
+@dataclass
+class Stop:
+    station_id: str
+    name: str
+    lat: float
+    lon: float
+    offset: float  # metres along the route from its first point
+
+
+@dataclass
+class Snap:
+    route_id: str
+    offset: float    # metres along the route from its first point
+    distance: float  # metres from the fix to the route
+    segment: int
+
+
+class RouteGeometry:
+    """
+    One route polyline in a local flat frame (metres east/north of its first
+    point), with cumulative segment offsets, a grid index from cell to the
+    segments passing near it, and its stops ordered by offset.
+
+    Snapping looks at the fix's grid cell only, so it costs a handful of
+    point-segment projections regardless of route length.
+    """
+
+    def __init__(self, route_id: str, points: Sequence[Tuple[float, float]],
+                 stops: Iterable[Tuple[str, str, float, float]] = (), loop: bool = True):
+        if len(points) < 2:
+            raise ValueError(f"Route {route_id} needs at least two points")
+        self.route_id = route_id
+        self.loop = loop
+        self.lat0, self.lon0 = points[0]
+        self.lon_scale = METERS_PER_DEGREE * math.cos(math.radians(self.lat0))
+
+        xy = [self._project(lat, lon) for lat, lon in points]
+        if loop and xy[0] != xy[-1]:
+            xy.append(xy[0])
+        self._xy = xy
+
+        self._offsets: List[float] = []
+        self._lengths: List[float] = []
+        self._bearings: List[float] = []
+        total = 0.0
+        for (x1, y1), (x2, y2) in zip(xy, xy[1:]):
+            length = math.hypot(x2 - x1, y2 - y1)
+            self._offsets.append(total)
+            self._lengths.append(length)
+            self._bearings.append(math.degrees(math.atan2(x2 - x1, y2 - y1)) % 360)
+            total += length
+        self.length = total
+
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        for seg, ((x1, y1), (x2, y2)) in enumerate(zip(xy, xy[1:])):
+            cx0, cy0 = self._cell(min(x1, x2) - MAX_SNAP_DISTANCE_M, min(y1, y2) - MAX_SNAP_DISTANCE_M)
+            cx1, cy1 = self._cell(max(x1, x2) + MAX_SNAP_DISTANCE_M, max(y1, y2) + MAX_SNAP_DISTANCE_M)
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self._grid.setdefault((cx, cy), []).append(seg)
+
+        placed = []
+        for station_id, name, lat, lon in stops:
+            snap = self._snap_xy(*self._project(lat, lon), None, range(len(self._lengths)), math.inf)
+            placed.append(Stop(station_id, name, lat, lon, snap.offset))
+        self.stops = sorted(placed, key=lambda s: s.offset)
+        self._stop_offsets = [s.offset for s in self.stops]
+
+    def _project(self, lat: float, lon: float) -> Tuple[float, float]:
+        return (lon - self.lon0) * self.lon_scale, (lat - self.lat0) * METERS_PER_DEGREE
+
+    @staticmethod
+    def _cell(x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / CELL_SIZE_M)), int(math.floor(y / CELL_SIZE_M))
+
+    def _snap_xy(self, x: float, y: float, heading: Optional[float], candidates: Iterable[int],
+                 max_distance: float) -> Optional[Snap]:
+        best = None
+        best_d2 = max_distance * max_distance
+        for seg in candidates:
+            if heading is not None:
+                diff = abs(heading - self._bearings[seg]) % 360
+                if min(diff, 360 - diff) > MAX_HEADING_DIFF_DEG:
+                    continue
+            (x1, y1), (x2, y2) = self._xy[seg], self._xy[seg + 1]
+            dx, dy = x2 - x1, y2 - y1
+            seg_len2 = dx * dx + dy * dy
+            t = 0.0 if seg_len2 == 0 else max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / seg_len2))
+            px, py = x1 + t * dx - x, y1 + t * dy - y
+            d2 = px * px + py * py
+            if d2 <= best_d2:
+                best_d2 = d2
+                best = Snap(self.route_id, self._offsets[seg] + t * self._lengths[seg], math.sqrt(d2), seg)
+        return best
+
+    def snap(self, lat: float, lon: float, heading: Optional[float] = None) -> Optional[Snap]:
+        """Nearest point on the route within MAX_SNAP_DISTANCE_M, preferring segments matching `heading`"""
+        x, y = self._project(lat, lon)
+        candidates = self._grid.get(self._cell(x, y))
+        if not candidates:
+            return None
+        snap = self._snap_xy(x, y, heading, candidates, MAX_SNAP_DISTANCE_M)
+        if snap is None and heading is not None:
+            # Heading can be stale or noisy when stopped; fall back to distance alone
+            snap = self._snap_xy(x, y, None, candidates, MAX_SNAP_DISTANCE_M)
+        return snap
+
+    def snap_many(self, fixes: Iterable[Tuple[float, float, Optional[float]]]) -> List[Optional[Snap]]:
+        """Snap (lat, lon, heading) tuples in one call"""
+        return [self.snap(lat, lon, heading) for lat, lon, heading in fixes]
+
+    def distance_ahead(self, from_offset: float, to_offset: float) -> float:
+        """Metres driven from one offset to another, wrapping around loops"""
+        ahead = to_offset - from_offset
+        if ahead < 0 and self.loop:
+            ahead += self.length
+        return ahead
+
+    def stops_ahead(self, offset: float, max_distance: float) -> List[Tuple[Stop, float]]:
+        """Downstream stops within `max_distance` metres along the route, nearest first"""
+        out: List[Tuple[Stop, float]] = []
+        n = len(self.stops)
+        if not n:
+            return out
+        start = bisect_right(self._stop_offsets, offset)
+        for k in range(n if self.loop else n - start):
+            index = start + k
+            if index >= n:
+                index -= n
+            stop = self.stops[index]
+            ahead = self.distance_ahead(offset, stop.offset)
+            if ahead > max_distance:
+                break
+            out.append((stop, ahead))
+        return out
+
+
+class StationIndex:
+    """
+    The stations table cached for `ttl_seconds`, with a grid from cell to
+    the stations in it, so a radius search reads a few cells instead of
+    scanning every station.
+    """
+
+    def __init__(self, table: Any, ttl_seconds: float = 300.0):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self._stations: Dict[str, Dict[str, Any]] = {}
+        self._grid: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        self._loaded_at = -math.inf
+
+    def stations(self) -> Dict[str, Dict[str, Any]]:
+        """Station items by stationId"""
+        if time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self._load()
+        return self._stations
+
+    def _load(self):
+        stations, grid = {}, {}
+        try:
+            items = _scan_all(self.table)
+        except Exception as e:
+            logger.error('Station load failed: %s', e)
+            # Keep the last index and retry later, not on every fix during an outage
+            self._loaded_at = time.monotonic() - self.ttl_seconds + LOAD_RETRY_SECONDS
+            return
+        for item in items:
+            try:
+                cell = _network_cell(float(item['latitude']), float(item['longitude']))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error('Skipping station %s: %s', item.get('stationId'), e)
+                continue
+            stations[item['stationId']] = item
+            grid.setdefault(cell, []).append(item)
+        self._stations = stations
+        self._grid = grid
+        self._loaded_at = time.monotonic()
+        logger.info('Loaded %d stations', len(stations))
+
+    def near(self, lat: float, lon: float, radius_m: float) -> List[Dict[str, Any]]:
+        """Station items in the cells within `radius_m` of a point (a superset of those in range)"""
+        self.stations()
+        dr = math.ceil(radius_m / (NETWORK_CELL_DEG * METERS_PER_DEGREE))
+        dc = math.ceil(radius_m / (NETWORK_CELL_DEG * METERS_PER_DEGREE * math.cos(math.radians(lat))))
+        r, c = _network_cell(lat, lon)
+        out: List[Dict[str, Any]] = []
+        for row in range(r - dr, r + dr + 1):
+            for col in range(c - dc, c + dc + 1):
+                out.extend(self._grid.get((row, col), ()))
+        return out
+
+
+class RouteStore:
+    """
+    Routes loaded from DynamoDB and cached for the life of the Lambda container,
+    refreshed every `ttl_seconds`.
+
+    Route items: routeId, points (list of {lat, lon}), stops (ordered station
+    IDs, resolved against the stations table) and an optional loop flag.
+
+    A network grid maps each cell to the routes passing within snapping
+    distance of it, so matching a fix with no known route only tries the
+    few routes near it. Each bus keeps the route it last matched, so fixes
+    on corridors shared by several routes stay with the bus's own route.
+    """
+
+    def __init__(self, routes_table: Any, stations: StationIndex, ttl_seconds: float = 300.0):
+        self.routes_table = routes_table
+        self.stations = stations
+        self.ttl_seconds = ttl_seconds
+        self._routes: Dict[str, RouteGeometry] = {}
+        self._network: Dict[Tuple[int, int], List[RouteGeometry]] = {}
+        self._assigned: Dict[str, str] = {}
+        self._loaded_at = -math.inf
+
+    def routes(self) -> Dict[str, RouteGeometry]:
+        if time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self._load()
+        return self._routes
+
+    def _load(self):
+        stations = {
+            sid: (sid, item['name'], float(item['latitude']), float(item['longitude']))
+            for sid, item in self.stations.stations().items()
+        }
+        try:
+            items = _scan_all(self.routes_table)
+        except Exception as e:
+            logger.error('Route load failed: %s', e)
+            # Keep the last routes and retry later, not on every fix during an outage
+            self._loaded_at = time.monotonic() - self.ttl_seconds + LOAD_RETRY_SECONDS
+            return
+        routes = {}
+        network: Dict[Tuple[int, int], List[RouteGeometry]] = {}
+        for item in items:
+            try:
+                points = [(float(p['lat']), float(p['lon'])) for p in item['points']]
+                stops = [stations[s] for s in item.get('stops', []) if s in stations]
+                route = RouteGeometry(item['routeId'], points, stops, bool(item.get('loop', True)))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error('Skipping route %s: %s', item.get('routeId'), e)
+                continue
+            routes[route.route_id] = route
+            for cell in _route_cells(points, route.loop):
+                network.setdefault(cell, []).append(route)
+        self._routes = routes
+        self._network = network
+        self._loaded_at = time.monotonic()
+        logger.info('Loaded %d routes', len(routes))
+
+    def routes_near(self, lat: float, lon: float) -> List[RouteGeometry]:
+        """Routes passing within snapping distance of a point's network cell"""
+        self.routes()
+        return self._network.get(_network_cell(lat, lon), [])
+
+    def match(self, lat: float, lon: float, heading: Optional[float] = None,
+              route_id: Optional[str] = None) -> Optional[Tuple[RouteGeometry, Snap]]:
+        """
+        Snap to `route_id` if given and the fix is on it, otherwise to the
+        nearest of the routes around the fix
+        """
+        routes = self.routes()
+        preferred = routes.get(route_id) if route_id is not None else None
+        if preferred is not None:
+            snap = preferred.snap(lat, lon, heading)
+            if snap is not None:
+                return preferred, snap
+        best = None
+        for route in self.routes_near(lat, lon):
+            if route is preferred:
+                continue
+            snap = route.snap(lat, lon, heading)
+            if snap is not None and (best is None or snap.distance < best[1].distance):
+                best = (route, snap)
+        return best
+
+    def match_bus(self, bus_id: str, lat: float, lon: float, heading: Optional[float] = None,
+                  route_id: Optional[str] = None) -> Optional[Tuple[RouteGeometry, Snap]]:
+        """
+        Snap a bus's fix, preferring `route_id` (from telemetry or the
+        device's attributes) and then the route the bus last matched
+        """
+        match = self.match(lat, lon, heading, route_id or self._assigned.get(bus_id))
+        if match is not None:
+            self._assigned[bus_id] = match[0].route_id
+        return match
+
+
+def _network_cell(lat: float, lon: float) -> Tuple[int, int]:
+    return int(math.floor(lat / NETWORK_CELL_DEG)), int(math.floor(lon / NETWORK_CELL_DEG))
+
+
+def _route_cells(points: Sequence[Tuple[float, float]], loop: bool) -> Set[Tuple[int, int]]:
+    """Network cells within MAX_SNAP_DISTANCE_M of any segment's bounding box"""
+    margin_lat = MAX_SNAP_DISTANCE_M / METERS_PER_DEGREE
+    cells = set()
+    segments = list(zip(points, points[1:]))
+    if loop and points[0] != points[-1]:
+        segments.append((points[-1], points[0]))
+    for (lat1, lon1), (lat2, lon2) in segments:
+        margin_lon = margin_lat / max(math.cos(math.radians(max(abs(lat1), abs(lat2)))), 1e-6)
+        r0, c0 = _network_cell(min(lat1, lat2) - margin_lat, min(lon1, lon2) - margin_lon)
+        r1, c1 = _network_cell(max(lat1, lat2) + margin_lat, max(lon1, lon2) + margin_lon)
+        cells.update((r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1))
+    return cells
+
+
+def _scan_all(table: Any) -> List[Dict[str, Any]]:
+    """Every item in a table, following scan pagination"""
+    response = table.scan()
+    items = response.get('Items', [])
+    while 'LastEvaluatedKey' in response:
+        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+        items.extend(response.get('Items', []))
+    return items
@@ -0,0 +1,275 @@
+"""
+Historical segment travel times for ETA prediction
+Learns how long buses take to drive each stretch of a route at each hour of
+the day from consecutive map-matched fixes, and predicts travel time between
+two points on a route with two prefix-sum lookups
+"""
+
+import logging
+import math
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from route_matching import RouteGeometry, _scan_all
+
+logger = logging.getLogger()
+
+SEGMENT_LENGTH_M = 200.0  # routes are cut into fixed-length segments from their first point
+TIME_BUCKETS = 24         # hour of day (UTC)
+MIN_COVERAGE_M = 400.0    # metres observed before a segment's bucket is trusted over its daily mean
+MIN_MOVE_M = 5.0          # smaller moves are GPS jitter; dwell time keeps accumulating
+MAX_GAP_S = 120.0         # longer gaps (layovers, dropouts) are not attributed to any segment
+MAX_JUMP_M = 2000.0       # longer moves between fixes are treated as a route change
+REBUILD_SECONDS = 30.0    # how stale a bucket's prefix table may get while observations arrive
+LOAD_RETRY_SECONDS = 30.0 # wait after a failed load before scanning again
+
+
+def time_bucket(ts: int) -> int:
+    """Hour-of-day bucket for a timestamp in milliseconds"""
+    return int(ts // 3_600_000) % TIME_BUCKETS
+
+
+class RouteTravelTimes:
+    """
+    Seconds and metres observed per (time bucket, segment) of one route.
+
+    Travel time along a segment is its length times the observed pace
+    (seconds per metre). For each bucket, a prefix sum of segment times is
+    built on first use and rebuilt at most every REBUILD_SECONDS while new
+    observations arrive, so a lookup between any two offsets is O(1).
+    """
+
+    def __init__(self, route: RouteGeometry):
+        self.route_id = route.route_id
+        self.length = route.length
+        self.loop = route.loop
+        n = max(1, math.ceil(self.length / SEGMENT_LENGTH_M))
+        self.segment_lengths = [SEGMENT_LENGTH_M] * (n - 1) + [self.length - SEGMENT_LENGTH_M * (n - 1)]
+        self.seconds = [[0.0] * n for _ in range(TIME_BUCKETS)]
+        self.meters = [[0.0] * n for _ in range(TIME_BUCKETS)]
+        self._tables: List[Optional[Tuple[List[float], List[float]]]] = [None] * TIME_BUCKETS
+        self._built_at = [0.0] * TIME_BUCKETS
+        self._built_version = [0] * TIME_BUCKETS
+        self._version = 0
+        self._observed = False  # set by add(), for observations and stored totals alike
+
+    @property
+    def observed(self) -> bool:
+        return self._observed
+
+    def add(self, bucket: int, segment: int, seconds: float, meters: float):
+        if 0 <= segment < len(self.segment_lengths):
+            self.seconds[bucket][segment] += seconds
+            self.meters[bucket][segment] += meters
+            self._observed = self._observed or meters > 0
+            # Other buckets fall back to daily paces, so every table is affected
+            self._version += 1
+
+    def record(self, bucket: int, from_offset: float, distance: float,
+               elapsed_s: float) -> List[Tuple[int, float, float]]:
+        """
+        Spread `elapsed_s` over the segments between `from_offset` and
+        `distance` metres further along, in proportion to the metres driven
+        in each. Returns the (segment, seconds, metres) added.
+        """
+        added = []
+        n = len(self.segment_lengths)
+        offset = from_offset % self.length if self.loop else from_offset
+        remaining = distance
+        while remaining > 1e-6:
+            segment = min(int(offset // SEGMENT_LENGTH_M), n - 1)
+            segment_end = min((segment + 1) * SEGMENT_LENGTH_M, self.length)
+            step = min(remaining, segment_end - offset)
+            if step <= 0:
+                if not self.loop:
+                    break
+                offset = 0.0
+                continue
+            seconds = elapsed_s * step / distance
+            self.add(bucket, segment, seconds, step)
+            added.append((segment, seconds, step))
+            remaining -= step
+            offset += step
+            if offset >= self.length - 1e-6 and self.loop:
+                offset = 0.0
+        return added
+
+    def _table(self, bucket: int) -> Tuple[List[float], List[float]]:
+        """(segment seconds, prefix sums) for a bucket, rebuilt after new observations"""
+        table = self._tables[bucket]
+        now = time.monotonic()
+        stale = self._built_version[bucket] != self._version
+        if table is not None and not (stale and now - self._built_at[bucket] >= REBUILD_SECONDS):
+            return table
+
+        n = len(self.segment_lengths)
+        day_seconds = [sum(self.seconds[b][s] for b in range(TIME_BUCKETS)) for s in range(n)]
+        day_meters = [sum(self.meters[b][s] for b in range(TIME_BUCKETS)) for s in range(n)]
+        total_meters = sum(day_meters)
+        route_pace = sum(day_seconds) / total_meters if total_meters else 0.0
+
+        segment_seconds = []
+        prefix = [0.0]
+        for s, length in enumerate(self.segment_lengths):
+            # Prefer this hour's pace, then the segment's daily pace, then the route's
+            if self.meters[bucket][s] >= MIN_COVERAGE_M:
+                pace = self.seconds[bucket][s] / self.meters[bucket][s]
+            elif day_meters[s] >= MIN_COVERAGE_M:
+                pace = day_seconds[s] / day_meters[s]
+            else:
+                pace = route_pace
+            segment_seconds.append(pace * length)
+            prefix.append(prefix[-1] + pace * length)
+        table = self._tables[bucket] = (segment_seconds, prefix)
+        self._built_at[bucket] = now
+        self._built_version[bucket] = self._version
+        return table
+
+    def _elapsed_to(self, table: Tuple[List[float], List[float]], offset: float) -> float:
+        segment_seconds, prefix = table
+        segment = min(int(offset // SEGMENT_LENGTH_M), len(segment_seconds) - 1)
+        within = (offset - segment * SEGMENT_LENGTH_M) / self.segment_lengths[segment]
+        return prefix[segment] + min(max(within, 0.0), 1.0) * segment_seconds[segment]
+
+    def travel_time(self, from_offset: float, to_offset: float, ts: int) -> float:
+        """Predicted seconds to drive from one offset to another, starting at `ts`"""
+        table = self._table(time_bucket(ts))
+        seconds = self._elapsed_to(table, to_offset) - self._elapsed_to(table, from_offset)
+        if to_offset < from_offset and self.loop:
+            seconds += table[1][-1]
+        return max(seconds, 0.0)
+
+
+class TravelTimeModel:
+    """
+    Segment travel times for every route, learned from the stream.
+
+    Each bus's last matched position is kept as an anchor; when a later fix
+    shows the bus further along the same route, the time between them is
+    spread over the segments driven, including any dwell at stops in
+    between. Moves under MIN_MOVE_M leave the anchor in place so dwell
+    accumulates; gaps over MAX_GAP_S, jumps over MAX_JUMP_M and route
+    changes restart it.
+
+    With a table, observations are added to per-(route, segment) counters in
+    DynamoDB every `flush_seconds`, and totals from all containers are
+    reloaded every `ttl_seconds`. Items: routeId, segment, and s<HH>/m<HH>
+    seconds and metres for each hour bucket.
+    """
+
+    def __init__(self, table: Any = None, ttl_seconds: float = 300.0, flush_seconds: float = 60.0):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.flush_seconds = flush_seconds
+        self._routes: Dict[str, RouteTravelTimes] = {}
+        self._stored: Dict[str, List[Dict[str, Any]]] = {}
+        self._anchors: Dict[str, Tuple[str, float, int]] = {}
+        self._pending: Dict[Tuple[str, int], Dict[int, List[float]]] = {}
+        self._loaded_at = -math.inf
+        self._flushed_at = time.monotonic()
+
+    def _refresh(self):
+        if self.table is None or time.monotonic() - self._loaded_at <= self.ttl_seconds:
+            return
+        self.flush()
+        stored: Dict[str, List[Dict[str, Any]]] = {}
+        try:
+            for item in _scan_all(self.table):
+                stored.setdefault(item['routeId'], []).append(item)
+        except Exception as e:
+            logger.error('Travel time load failed: %s', e)
+            # Keep the last totals and retry later, not on every fix during an outage
+            self._loaded_at = time.monotonic() - self.ttl_seconds + LOAD_RETRY_SECONDS
+            return
+        self._stored = stored
+        self._routes = {}
+        self._loaded_at = time.monotonic()
+
+    def route(self, route: RouteGeometry) -> RouteTravelTimes:
+        """Travel times for a route, seeded from stored totals and unflushed observations"""
+        self._refresh()
+        times = self._routes.get(route.route_id)
+        if times is None or times.length != route.length:
+            times = RouteTravelTimes(route)
+            for item in self._stored.get(route.route_id, []):
+                for bucket in range(TIME_BUCKETS):
+                    if f's{bucket:02d}' in item:
+                        times.add(bucket, int(item['segment']),
+                                  float(item[f's{bucket:02d}']), float(item.get(f'm{bucket:02d}', 0)))
+            for (route_id, segment), buckets in self._pending.items():
+                if route_id == route.route_id:
+                    for bucket, (seconds, meters) in buckets.items():
+                        times.add(bucket, segment, seconds, meters)
+            self._routes[route.route_id] = times
+        return times
+
+    def observe(self, bus_id: str, route: RouteGeometry, offset: float, ts: int):
+        """Feed one map-matched fix"""
+        anchor = self._anchors.get(bus_id)
+        self._anchors[bus_id] = (route.route_id, offset, ts)
+        if anchor is None:
+            return
+        anchor_route, anchor_offset, anchor_ts = anchor
+        elapsed = (ts - anchor_ts) / 1000.0
+        if anchor_route != route.route_id or elapsed > MAX_GAP_S:
+            return
+        if elapsed <= 0:
+            self._anchors[bus_id] = anchor
+            return
+
+        moved = route.distance_ahead(anchor_offset, offset)
+        if abs(moved) < MIN_MOVE_M or (route.loop and moved > route.length - MIN_MOVE_M):
+            # Standing still (or jitter just behind the anchor): keep counting dwell
+            self._anchors[bus_id] = anchor
+            return
+        if moved < 0 or moved > MAX_JUMP_M:
+            return
+
+        bucket = time_bucket(anchor_ts)
+        for segment, seconds, meters in self.route(route).record(bucket, anchor_offset, moved, elapsed):
+            totals = self._pending.setdefault((route.route_id, segment), {}).setdefault(bucket, [0.0, 0.0])
+            totals[0] += seconds
+            totals[1] += meters
+
+    def eta_seconds(self, route: RouteGeometry, from_offset: float, to_offset: float,
+                    ts: int) -> Optional[float]:
+        """Predicted seconds between two offsets, or None until the route has any history"""
+        times = self.route(route)
+        if not times.observed:
+            return None
+        return times.travel_time(from_offset, to_offset, ts)
+
+    def maybe_flush(self):
+        """Flush if `flush_seconds` have passed since the last flush"""
+        if time.monotonic() - self._flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Add unflushed observations to the table's counters"""
+        self._flushed_at = time.monotonic()
+        if self.table is None:
+            self._pending.clear()
+            return
+        for key in list(self._pending):
+            route_id, segment = key
+            buckets = self._pending[key]
+            names, values, clauses = {}, {':zero': Decimal(0)}, []
+            for bucket, (seconds, meters) in buckets.items():
+                for prefix, amount in (('s', seconds), ('m', meters)):
+                    name = f'{prefix}{bucket:02d}'
+                    names[f'#{name}'] = name
+                    values[f':{name}'] = Decimal(str(round(amount, 3)))
+                    clauses.append(f'#{name} = if_not_exists(#{name}, :zero) + :{name}')
+            try:
+                self.table.update_item(
+                    Key={'routeId': route_id, 'segment': segment},
+                    UpdateExpression='SET ' + ', '.join(clauses),
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+            except Exception as e:
+                # Keep the rest for the next flush
+                logger.error('Travel time flush failed for %s/%d: %s', route_id, segment, e)
+                return
+            del self._pending[key]
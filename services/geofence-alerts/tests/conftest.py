@@ -0,0 +1,9 @@
+"""
+The Lambda's modules import each other by bare name, as they do from the
+deployment package root, so the tests put src/ on the path
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,117 @@
+"""
+Geofence state: each transition alerts once, with hysteresis on exit, a
+bus coming back to a stop it departed arrives again, and state written by
+one container is picked up by the next
+"""
+
+import geofence_state as gs
+from geofence_state import Candidate, GeofenceTracker
+from route_matching import METERS_PER_DEGREE
+
+RADIUS = 50.0
+
+
+class DeviceTable:
+    """get_item/update_item stand-in keeping geofenceState per device"""
+
+    def __init__(self):
+        self.items = {}
+        self.updates = 0
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(Key['deviceId'])
+        return {'Item': item} if item else {}
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        self.updates += 1
+        self.items.setdefault(Key['deviceId'], {'deviceId': Key['deviceId']})['geofenceState'] = \
+            ExpressionAttributeValues[':s']
+
+
+def north(metres):
+    return 43.47 + metres / METERS_PER_DEGREE, -80.54
+
+
+def candidates(metres, eta, along_route=False):
+    return [Candidate('stop-1', 'Stop 1', *north(0), RADIUS, abs(metres), eta, along_route)]
+
+
+def drive(tracker, steps, bus_id='bus-1'):
+    """Apply (metres north of the stop, eta) fixes one second apart; the events of each"""
+    events = []
+    for i, (metres, eta) in enumerate(steps):
+        transitions = tracker.update(bus_id, 1_000 * (i + 1), *north(metres), candidates(metres, eta))
+        events.append([t.event for t in transitions])
+    return events
+
+
+def test_approach_arrive_depart_alert_once_each():
+    tracker = GeofenceTracker(DeviceTable())
+    events = drive(tracker, [(1000, 200), (600, 120), (300, 60), (20, 5), (0, 0), (60, 10), (100, 20), (200, 40)])
+
+    assert events == [[], [gs.APPROACH], [], [gs.ARRIVED], [], [], [gs.DEPARTED_EVENT], []]
+
+
+def test_exit_hysteresis():
+    tracker = GeofenceTracker(DeviceTable())
+    # Inside, then wandering between the radius and EXIT_RADIUS_FACTOR x radius
+    events = drive(tracker, [(0, 0), (RADIUS * 1.2, 5), (RADIUS * 0.5, 5), (RADIUS * 1.4, 5)])
+
+    assert events == [[gs.ARRIVED], [], [], []]
+
+
+def test_departed_bus_can_arrive_again():
+    tracker = GeofenceTracker(DeviceTable())
+    # A loop route, or a bus that pulls out and comes back to the same stop
+    events = drive(tracker, [(0, 0), (200, 40), (20, 5), (300, 60)])
+
+    assert events == [[gs.ARRIVED], [gs.DEPARTED_EVENT], [gs.ARRIVED], [gs.DEPARTED_EVENT]]
+
+
+def test_stop_behind_on_the_route_is_released():
+    tracker = GeofenceTracker(DeviceTable())
+    tracker.update('bus-1', 1_000, *north(0), candidates(0, 0, along_route=True))
+    tracker.update('bus-1', 2_000, *north(200), candidates(200, 40, along_route=True))
+    assert tracker.checkpoint('bus-1')['stations']['stop-1'][0] == gs.DEPARTED
+
+    # Along the route the stop is now most of a lap away
+    tracker.update('bus-1', 3_000, *north(300), candidates(3000, 600, along_route=True))
+    assert tracker.checkpoint('bus-1')['stations'] == {}
+
+
+def test_older_fixes_are_ignored():
+    tracker = GeofenceTracker(DeviceTable())
+    drive(tracker, [(0, 0), (200, 40)])
+
+    assert tracker.update('bus-1', 500, *north(0), candidates(0, 0)) == []
+
+
+def test_state_survives_a_new_container():
+    table = DeviceTable()
+    first = GeofenceTracker(table)
+    drive(first, [(600, 120), (0, 0)])
+    first.flush()
+    first.flush()
+    assert table.updates == 1
+
+    second = GeofenceTracker(table)
+    # Still inside: no second ARRIVED from the new container
+    assert second.update('bus-1', 10_000, *north(10), candidates(10, 2)) == []
+    events = [t.event for t in second.update('bus-1', 11_000, *north(200), candidates(200, 40))]
+    assert events == [gs.DEPARTED_EVENT]
+
+
+class Zone:
+    def __init__(self, geofence_id):
+        self.geofence_id = geofence_id
+        self.name = geofence_id.title()
+        self.category = 'depot'
+
+
+def test_zone_exit_needs_consecutive_fixes_outside():
+    tracker = GeofenceTracker(DeviceTable())
+    depot = Zone('depot')
+    steps = [[depot], [depot], [], [depot], [], []]
+    events = [[e.event for e in tracker.update_zones('bus-1', 1_000 * i, zones)] for i, zones in enumerate(steps)]
+
+    assert events == [[gs.ZONE_ENTERED], [], [], [], [], [gs.ZONE_EXITED]]
@@ -0,0 +1,72 @@
+"""
+Polygon geofences: the banded ray cast and the grid index agree with a
+plain ray cast over every edge, for convex, concave and many-sided zones
+"""
+
+import math
+import random
+
+import pytest
+
+from polygons import PolygonGeofence, PolygonIndex
+
+
+def brute_force_contains(points, lat, lon):
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:] + points[:1]):
+        if (lat1 > lat) != (lat2 > lat):
+            if lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                inside = not inside
+    return inside
+
+
+def star(rng, c_lat, c_lon, size_deg, vertices):
+    """A random star-shaped polygon, concave for most draws"""
+    points = []
+    for k in range(vertices):
+        angle = 2 * math.pi * k / vertices
+        r = size_deg * rng.uniform(0.3, 1.0)
+        points.append((c_lat + r * math.sin(angle), c_lon + r * math.cos(angle)))
+    return points
+
+
+@pytest.mark.parametrize('vertices', [3, 4, 7, 12, 50, 400])
+def test_contains_matches_brute_force(vertices):
+    rng = random.Random(vertices)
+    for _ in range(5):
+        points = star(rng, 43.47, -80.54, 0.003, vertices)
+        polygon = PolygonGeofence('zone', 'Zone', points)
+        for _ in range(500):
+            lat = 43.47 + rng.uniform(-0.004, 0.004)
+            lon = -80.54 + rng.uniform(-0.004, 0.004)
+            assert polygon.contains(lat, lon) == brute_force_contains(points, lat, lon), (lat, lon)
+
+
+def test_winding_does_not_matter():
+    square = [(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, 0.0)]
+    for points in (square, square[::-1]):
+        polygon = PolygonGeofence('square', 'Square', points)
+        assert polygon.contains(0.5, 0.5)
+        assert not polygon.contains(1.5, 0.5)
+        assert not polygon.contains(0.5, -0.5)
+
+
+def test_index_matches_brute_force():
+    rng = random.Random(7)
+    polygons = [
+        PolygonGeofence(f'zone-{i}', f'Zone {i}',
+                        star(rng, 43.47 + rng.uniform(-0.02, 0.02), -80.54 + rng.uniform(-0.02, 0.02),
+                             rng.uniform(0.0005, 0.005), rng.randint(3, 40)))
+        for i in range(30)
+    ]
+    index = PolygonIndex(polygons)
+    points = [(43.47 + rng.uniform(-0.03, 0.03), -80.54 + rng.uniform(-0.03, 0.03)) for _ in range(3000)]
+
+    expected = [{p.geofence_id for p in polygons if brute_force_contains(p.points, lat, lon)} for lat, lon in points]
+    assert [{p.geofence_id for p in index.containing(lat, lon)} for lat, lon in points] == expected
+    assert [{p.geofence_id for p in found} for found in index.containing_many(points)] == expected
+
+
+def test_needs_three_points():
+    with pytest.raises(ValueError):
+        PolygonGeofence('line', 'Line', [(0.0, 0.0), (1.0, 1.0)])
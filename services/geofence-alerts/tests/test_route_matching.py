@@ -0,0 +1,117 @@
+"""
+Map matching: fixes snap to the right place on a route, heading picks the
+direction of travel on two-way corridors, stops ahead wrap around loops,
+and buses keep their own route where routes share a street
+"""
+
+import math
+
+import pytest
+
+from route_matching import MAX_SNAP_DISTANCE_M, METERS_PER_DEGREE, RouteGeometry, RouteStore, StationIndex
+
+LAT0, LON0 = 43.47, -80.54
+
+
+def point(east_m, north_m):
+    return (LAT0 + north_m / METERS_PER_DEGREE,
+            LON0 + east_m / (METERS_PER_DEGREE * math.cos(math.radians(LAT0))))
+
+
+def stop(station_id, east_m, north_m):
+    return (station_id, station_id.title(), *point(east_m, north_m))
+
+
+# A 1 km square loop driven counter-clockwise from the south-west corner
+SQUARE = [point(0, 0), point(1000, 0), point(1000, 1000), point(0, 1000)]
+
+
+def test_snap_gives_offset_and_distance():
+    route = RouteGeometry('square', SQUARE)
+
+    assert route.length == pytest.approx(4000, abs=1)
+    snap = route.snap(*point(300, 20))
+    assert snap.offset == pytest.approx(300, abs=0.5)
+    assert snap.distance == pytest.approx(20, abs=0.5)
+    snap = route.snap(*point(1010, 500))
+    assert snap.offset == pytest.approx(1500, abs=0.5)
+
+
+def test_fix_far_from_the_route_does_not_snap():
+    route = RouteGeometry('square', SQUARE)
+
+    assert route.snap(*point(500, 500)) is None
+    assert route.snap(*point(300, -(MAX_SNAP_DISTANCE_M + 5))) is None
+
+
+def test_heading_picks_the_direction_of_travel():
+    # Out and back along the same street
+    route = RouteGeometry('shuttle', [point(0, 0), point(1000, 0), point(0, 0)], loop=False)
+
+    assert route.snap(*point(300, 5), heading=90).offset == pytest.approx(300, abs=0.5)
+    assert route.snap(*point(300, 5), heading=270).offset == pytest.approx(1700, abs=0.5)
+    # A heading matching neither direction falls back to the nearest segment
+    assert route.snap(*point(300, 5), heading=0) is not None
+
+
+def test_stops_ahead_wrap_around_a_loop():
+    stops = [stop('a', 500, 0), stop('b', 1000, 500), stop('c', 500, 1000), stop('d', 0, 500)]
+    route = RouteGeometry('square', SQUARE, stops)
+
+    assert [s.station_id for s in route.stops] == ['a', 'b', 'c', 'd']
+    ahead = route.stops_ahead(3200, 1500)
+    assert [(s.station_id, round(d)) for s, d in ahead] == [('d', 300), ('a', 1300)]
+    assert route.stops_ahead(3600, 100) == []
+
+
+def test_stops_ahead_end_at_the_terminus_of_a_line():
+    stops = [stop('a', 200, 0), stop('b', 600, 0), stop('c', 900, 0)]
+    route = RouteGeometry('line', [point(0, 0), point(1000, 0)], stops, loop=False)
+
+    assert [(s.station_id, round(d)) for s, d in route.stops_ahead(500, 10_000)] == [('b', 100), ('c', 400)]
+    assert route.stops_ahead(950, 10_000) == []
+
+
+class Table:
+    """Scan-only stand-in for a DynamoDB table; raises while `failing`"""
+
+    def __init__(self, items):
+        self.items = items
+        self.failing = False
+
+    def scan(self, **kwargs):
+        if self.failing:
+            raise RuntimeError('scan failed')
+        return {'Items': self.items}
+
+
+def route_item(route_id, points):
+    return {'routeId': route_id, 'points': [{'lat': lat, 'lon': lon} for lat, lon in points], 'loop': False}
+
+
+def test_bus_stays_on_its_route_along_a_shared_corridor():
+    routes = Table([
+        route_item('east', [point(0, 0), point(2000, 0)]),
+        route_item('north', [point(0, 0), point(1000, 0), point(1000, 1000)]),
+    ])
+    store = RouteStore(routes, StationIndex(Table([])))
+
+    route, _ = store.match_bus('bus-1', *point(1000, 800))
+    assert route.route_id == 'north'
+    route, _ = store.match_bus('bus-1', *point(500, 0))
+    assert route.route_id == 'north'
+    route, _ = store.match_bus('bus-1', *point(1500, 0))
+    assert route.route_id == 'east'
+
+
+def test_failed_reload_keeps_the_last_routes():
+    routes = Table([route_item('east', [point(0, 0), point(2000, 0)])])
+    store = RouteStore(routes, StationIndex(Table([])), ttl_seconds=0)
+    assert list(store.routes()) == ['east']
+
+    routes.failing = True
+    assert list(store.routes()) == ['east']
+    # Backs off instead of scanning again on every fix
+    routes.failing = False
+    routes.items = []
+    assert list(store.routes()) == ['east']
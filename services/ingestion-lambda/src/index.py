@@ -4,11 +4,21 @@ Validates and forwards IoT GPS data to Kinesis Data Streams
 """
 
 import json
-import boto3
+import base64
+import binascii
 import os
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+import random
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+import latency_trace
+import telemetry_codec
 
 # Set up logging
 logger = logging.getLogger()
@@ -26,15 +36,25 @@ except ImportError:
     XRAY_AVAILABLE = False
     logger.info("X-Ray SDK not available, using basic tracing")
 
-# Initialize Kinesis client
-kinesis = boto3.client('kinesis')
+# Initialize Kinesis client; pooled and reused across warm invocations
+kinesis = aws_clients.client('kinesis')
 
 # Environment variables
 STREAM_NAME = os.environ.get('KINESIS_STREAM_NAME', 'transport-gps-stream-dev')
+KINESIS_ENCODING = os.environ.get('KINESIS_ENCODING', 'json')  # json or binary
 MAX_LAT = 90.0
 MIN_LAT = -90.0
 MAX_LON = 180.0
 MIN_LON = -180.0
+PUT_RECORDS_LIMIT = 500  # Kinesis PutRecords maximum
+PUT_RECORDS_ATTEMPTS = 5  # for PutRecord and PutRecords alike
+PUT_RECORDS_BACKOFF_S = 0.1  # upper bound of the first retry delay, doubled after each attempt
+# Errors for which a whole PutRecord(s) call is retried, like throttled entries
+KINESIS_RETRY_CODES = frozenset({'ProvisionedThroughputExceededException', 'ThrottlingException'})
+# Fixes are aggregated into one Kinesis record per partition bucket. Every
+# fix for a bus hashes to the same bucket, so per-bus order is kept on one shard.
+AGGREGATION_BUCKETS = int(os.environ.get('AGGREGATION_BUCKETS', '32'))  # keep a few times the shard count
+AGGREGATE_MAX_FIXES = int(os.environ.get('AGGREGATE_MAX_FIXES', '1000'))  # well under the 1 MiB record limit; 1 disables
 
 class ValidationError(Exception):
     """Custom exception for validation errors"""
@@ -129,7 +149,7 @@ def enrich_message(message: Dict[str, Any]) -> Dict[str, Any]:
     """Add metadata to the message"""
     enriched = {
         **message,
-        'processed_at': int(datetime.utcnow().timestamp() * 1000),
+        'processed_at': int(time.time() * 1000),
         'processor_version': '1.0.0',
         'valid': True
     }
@@ -153,8 +173,41 @@ def enrich_message(message: Dict[str, Any]) -> Dict[str, Any]:
     
     return enriched
 
+def partition_key(bus_id: str) -> str:
+    """Partition bucket for a bus; stable across invocations and containers"""
+    return f"bucket-{zlib.crc32(bus_id.encode('utf-8')) % AGGREGATION_BUCKETS}"
+
+def serialize_record(messages: List[Dict[str, Any]]):
+    """Encode one or more enriched messages as a single Kinesis record payload"""
+    if KINESIS_ENCODING == 'binary':
+        return telemetry_codec.encode(messages)
+    if len(messages) == 1:
+        return json.dumps(messages[0])
+    return json.dumps({'fixes': messages})
+
+def aggregate_records(messages: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], int]]:
+    """
+    Group messages into aggregated PutRecords entries by partition bucket.
+    
+    Returns (entry, fix count) pairs. Message order is preserved within each bucket.
+    """
+    buckets: Dict[str, List[Dict[str, Any]]] = {}
+    for m in messages:
+        buckets.setdefault(partition_key(m['busId']), []).append(m)
+    
+    entries = []
+    for key, bucket in buckets.items():
+        for i in range(0, len(bucket), AGGREGATE_MAX_FIXES):
+            chunk = bucket[i:i + AGGREGATE_MAX_FIXES]
+            entries.append(({'Data': serialize_record(chunk), 'PartitionKey': key}, len(chunk)))
+    return entries
+
+def backoff(attempt: int):
+    """Exponential backoff with full jitter, so a throttled shard gets time to recover"""
+    time.sleep(random.uniform(0, PUT_RECORDS_BACKOFF_S * 2 ** (attempt - 1)))
+
 def send_to_kinesis(message: Dict[str, Any], bus_id: str) -> Dict[str, Any]:
-    """Send validated message to Kinesis stream"""
+    """Send validated message to Kinesis stream, retrying throttled calls"""
     try:
         # Add X-Ray annotation if available
         if XRAY_AVAILABLE:
@@ -162,11 +215,21 @@ def send_to_kinesis(message: Dict[str, Any], bus_id: str) -> Dict[str, Any]:
             xray_recorder.current_subsegment().put_annotation('bus_id', bus_id)
             xray_recorder.current_subsegment().put_annotation('stream_name', STREAM_NAME)
         
-        response = kinesis.put_record(
-            StreamName=STREAM_NAME,
-            Data=json.dumps(message),
-            PartitionKey=bus_id  # Use busId to ensure all data from same bus goes to same shard
-        )
+        data = serialize_record([message])
+        for attempt in range(PUT_RECORDS_ATTEMPTS):
+            if attempt:
+                backoff(attempt)
+            try:
+                response = kinesis.put_record(
+                    StreamName=STREAM_NAME,
+                    Data=data,
+                    PartitionKey=partition_key(bus_id)  # Same bucket as aggregated records, so the bus stays on one shard
+                )
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] not in KINESIS_RETRY_CODES or attempt == PUT_RECORDS_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"PutRecord throttled on attempt {attempt + 1}: {str(e)}")
         
         logger.info(f"Successfully sent to Kinesis: {response['SequenceNumber']} for bus {bus_id}")
         
@@ -187,6 +250,94 @@ def send_to_kinesis(message: Dict[str, Any], bus_id: str) -> Dict[str, Any]:
             xray_recorder.end_subsegment()
         raise
 
+def send_batch_to_kinesis(messages: List[Dict[str, Any]]) -> int:
+    """
+    Send validated messages to Kinesis as aggregated records with PutRecords,
+    retrying throttled entries and throttled calls.
+    
+    Returns the number of messages that could not be written.
+    """
+    entries = aggregate_records(messages)
+    failed = 0
+    
+    if XRAY_AVAILABLE:
+        xray_recorder.begin_subsegment('kinesis_put_records')
+        xray_recorder.current_subsegment().put_annotation('stream_name', STREAM_NAME)
+        xray_recorder.current_subsegment().put_annotation('record_count', len(entries))
+        xray_recorder.current_subsegment().put_annotation('fix_count', len(messages))
+    
+    try:
+        for i in range(0, len(entries), PUT_RECORDS_LIMIT):
+            pending = entries[i:i + PUT_RECORDS_LIMIT]
+            for attempt in range(PUT_RECORDS_ATTEMPTS):
+                if attempt:
+                    backoff(attempt)
+                try:
+                    response = kinesis.put_records(StreamName=STREAM_NAME, Records=[entry for entry, _ in pending])
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in KINESIS_RETRY_CODES:
+                        raise
+                    # The whole call was throttled; resubmit the same entries
+                    logger.warning(f"PutRecords throttled on attempt {attempt + 1}: {str(e)}")
+                    continue
+                if not response.get('FailedRecordCount'):
+                    pending = []
+                    break
+                # Only resubmit the entries that failed, in their original order
+                pending = [
+                    item for item, result in zip(pending, response['Records'])
+                    if 'ErrorCode' in result
+                ]
+            if pending:
+                lost = sum(count for _, count in pending)
+                logger.error(f"Failed to send {len(pending)} records ({lost} fixes) to Kinesis after {PUT_RECORDS_ATTEMPTS} attempts")
+                failed += lost
+    except Exception as e:
+        logger.error(f"Failed to send batch to Kinesis: {str(e)}")
+        if XRAY_AVAILABLE and xray_recorder.current_subsegment():
+            xray_recorder.current_subsegment().add_exception(e)
+            xray_recorder.end_subsegment()
+        raise
+    
+    if XRAY_AVAILABLE:
+        xray_recorder.end_subsegment()
+    
+    return failed
+
+def process_packed_message(fixes: List[Any], trace: latency_trace.HopTrace) -> Dict[str, Any]:
+    """Validate, enrich and forward a packed {"fixes": [...]} message"""
+    valid = []
+    rejected = 0
+    for fix in fixes:
+        try:
+            if not isinstance(fix, dict):
+                raise ValidationError("Packed fix must be an object")
+            enriched = enrich_message(validate_message(fix))
+        except ValidationError as e:
+            logger.warning(f"Validation error in packed message: {str(e)}")
+            rejected += 1
+            continue
+        trace.add('ingest', enriched['processed_at'] - enriched['ts'])
+        valid.append(enriched)
+    
+    if not valid:
+        raise ValidationError(f"All {rejected} packed fixes failed validation")
+    
+    started = latency_trace.now_ms()
+    failed = send_batch_to_kinesis(valid)
+    trace.since('put', started)
+    logger.info(f"Processed packed message: {len(valid)} accepted, {rejected} rejected, {failed} failed")
+    
+    return {
+        'statusCode': 200 if not failed else 500,
+        'body': json.dumps({
+            'message': 'Successfully processed' if not failed else 'Partially processed',
+            'accepted': len(valid) - failed,
+            'rejected': rejected,
+            'failed': failed
+        })
+    }
+
 def handler(event: Any, context: Any) -> Dict[str, Any]:
     """
     Main Lambda handler
@@ -200,6 +351,9 @@ def handler(event: Any, context: Any) -> Dict[str, Any]:
     """
     logger.info(f"Received event: {json.dumps(event)}")
     
+    # Device to Lambda and PutRecords latency, logged as one line per invocation
+    trace = latency_trace.HopTrace('ingestion')
+    
     # Add X-Ray annotations for the main handler
     if XRAY_AVAILABLE and context:
         xray_recorder.put_annotation('function_name', context.function_name)
@@ -214,19 +368,30 @@ def handler(event: Any, context: Any) -> Dict[str, Any]:
             # For testing, support wrapped format
             if 'body' in event and isinstance(event['body'], str):
                 message = json.loads(event['body'])
+            elif isinstance(event.get('data'), str):
+                # IoT rule delivers the raw payload base64-encoded, JSON or binary
+                fixes = telemetry_codec.decode(base64.b64decode(event['data'], validate=True))
+                message = fixes[0] if len(fixes) == 1 else {'fixes': fixes}
             else:
                 message = event
         else:
             raise ValidationError("Invalid event format")
         
+        # Packed messages carry several fixes, possibly from different buses
+        if isinstance(message, dict) and isinstance(message.get('fixes'), list):
+            return process_packed_message(message['fixes'], trace)
+        
         # Validate the message
         validated_message = validate_message(message)
         
         # Enrich the message
         enriched_message = enrich_message(validated_message)
+        trace.add('ingest', enriched_message['processed_at'] - enriched_message['ts'])
         
         # Send to Kinesis
+        started = latency_trace.now_ms()
         kinesis_response = send_to_kinesis(enriched_message, message['busId'])
+        trace.since('put', started)
         
         # Log successful processing
         logger.info(f"Successfully processed message from bus {message['busId']}")
@@ -251,6 +416,16 @@ def handler(event: Any, context: Any) -> Dict[str, Any]:
             })
         }
         
+    except (telemetry_codec.CodecError, binascii.Error) as e:
+        logger.warning(f"Payload decoding error: {str(e)}")
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': 'Invalid Payload',
+                'message': str(e)
+            })
+        }
+        
     except json.JSONDecodeError as e:
         logger.error(f"JSON parsing error: {str(e)}")
         return {
@@ -270,6 +445,9 @@ def handler(event: Any, context: Any) -> Dict[str, Any]:
                 'message': str(e)
             })
         }
+    
+    finally:
+        trace.log(logger)
 
 # For local testing
 if __name__ == "__main__":
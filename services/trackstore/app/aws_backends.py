@@ -0,0 +1,246 @@
+"""
+Async DynamoDB and Kinesis access for TrackStore
+
+Two backends behind the same interface, selected by AWS_BACKEND:
+
+    threaded  boto3 calls run on a dedicated thread pool (the default)
+    async     aiobotocore clients on the event loop, so concurrent calls are
+              bounded by pooled connections rather than threads and skip
+              the thread hand-off
+
+Tables expose async versions of the boto3 Table methods DynamoStore uses,
+taking and returning plain Python values and boto3.dynamodb.conditions;
+AsyncTable does the wire-format conversion the boto3 resource layer would.
+Kinesis clients expose the client methods as coroutines.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+
+from . import aws_clients, metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_WRITE_LIMIT = 25       # items per BatchWriteItem call
+BATCH_WRITE_ATTEMPTS = 8     # calls per chunk before unprocessed items are given up
+BATCH_WRITE_BACKOFF_S = 0.05 # first retry delay for unprocessed items, doubled each time
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def _serialize(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def _deserialize(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+class ThreadedTable:
+    """A boto3 Table whose calls run on `executor`"""
+
+    def __init__(self, table: Any, executor: ThreadPoolExecutor):
+        self.table = table
+        self.executor = executor
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+    async def table_status(self) -> str:
+        return await self._run(lambda: self.table.table_status)
+
+    async def put_item(self, **kwargs) -> Dict[str, Any]:
+        return await self._run(self.table.put_item, **kwargs)
+
+    async def get_item(self, **kwargs) -> Dict[str, Any]:
+        return await self._run(self.table.get_item, **kwargs)
+
+    async def update_item(self, **kwargs) -> Dict[str, Any]:
+        return await self._run(self.table.update_item, **kwargs)
+
+    async def query(self, **kwargs) -> Dict[str, Any]:
+        return await self._run(self.table.query, **kwargs)
+
+    async def scan(self, **kwargs) -> Dict[str, Any]:
+        return await self._run(self.table.scan, **kwargs)
+
+    async def batch_write(self, items: List[Dict[str, Any]]):
+        """Put `items` with boto3's batch writer, which resubmits unprocessed items"""
+        def write():
+            with self.table.batch_writer() as writer:
+                for item in items:
+                    writer.put_item(Item=item)
+        await self._run(write)
+
+
+class AsyncTable:
+    """A DynamoDB table through an aiobotocore client, with boto3 Table semantics"""
+
+    def __init__(self, client: Any, name: str):
+        self.client = client
+        self.name = name
+
+    def _request(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Resource-style arguments to client-style ones"""
+        request = {'TableName': self.name, **kwargs}
+        names = dict(request.pop('ExpressionAttributeNames', None) or {})
+        values = dict(request.pop('ExpressionAttributeValues', None) or {})
+        builder = ConditionExpressionBuilder()
+        for field in ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression'):
+            condition = request.get(field)
+            if isinstance(condition, ConditionBase):
+                built = builder.build_expression(condition, is_key_condition=field == 'KeyConditionExpression')
+                request[field] = built.condition_expression
+                names.update(built.attribute_name_placeholders)
+                values.update(built.attribute_value_placeholders)
+        if names:
+            request['ExpressionAttributeNames'] = names
+        if values:
+            request['ExpressionAttributeValues'] = _serialize(values)
+        for field in ('Item', 'Key', 'ExclusiveStartKey'):
+            if field in request:
+                request[field] = _serialize(request[field])
+        return request
+
+    @staticmethod
+    def _response(response: Dict[str, Any]) -> Dict[str, Any]:
+        if 'Items' in response:
+            response['Items'] = [_deserialize(item) for item in response['Items']]
+        for field in ('Item', 'Attributes', 'LastEvaluatedKey'):
+            if field in response:
+                response[field] = _deserialize(response[field])
+        return response
+
+    async def table_status(self) -> str:
+        response = await self.client.describe_table(TableName=self.name)
+        return response['Table']['TableStatus']
+
+    async def put_item(self, **kwargs) -> Dict[str, Any]:
+        return self._response(await self.client.put_item(**self._request(kwargs)))
+
+    async def get_item(self, **kwargs) -> Dict[str, Any]:
+        return self._response(await self.client.get_item(**self._request(kwargs)))
+
+    async def update_item(self, **kwargs) -> Dict[str, Any]:
+        return self._response(await self.client.update_item(**self._request(kwargs)))
+
+    async def query(self, **kwargs) -> Dict[str, Any]:
+        return self._response(await self.client.query(**self._request(kwargs)))
+
+    async def scan(self, **kwargs) -> Dict[str, Any]:
+        return self._response(await self.client.scan(**self._request(kwargs)))
+
+    async def batch_write(self, items: List[Dict[str, Any]]):
+        """
+        Put `items` in concurrent BatchWriteItem calls of up to 25, retrying
+        unprocessed items with backoff
+        """
+        await asyncio.gather(*(
+            self._write_chunk(items[i:i + BATCH_WRITE_LIMIT]) for i in range(0, len(items), BATCH_WRITE_LIMIT)
+        ))
+
+    async def _write_chunk(self, items: List[Dict[str, Any]]):
+        requests = [{'PutRequest': {'Item': _serialize(item)}} for item in items]
+        delay = BATCH_WRITE_BACKOFF_S
+        for attempt in range(BATCH_WRITE_ATTEMPTS):
+            response = await self.client.batch_write_item(RequestItems={self.name: requests})
+            requests = response.get('UnprocessedItems', {}).get(self.name, [])
+            if not requests:
+                return
+            await asyncio.sleep(delay)
+            delay *= 2
+        raise RuntimeError(f"{len(requests)} items unprocessed by {self.name} after {BATCH_WRITE_ATTEMPTS} attempts")
+
+
+class ThreadedClient:
+    """A boto3 client whose methods are coroutines run on `executor`"""
+
+    def __init__(self, client: Any, executor: ThreadPoolExecutor):
+        self.client = client
+        self.executor = executor
+
+    def __getattr__(self, name: str):
+        method = getattr(self.client, name)
+
+        async def call(**kwargs):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: method(**kwargs))
+        return call
+
+
+class ThreadedBackend:
+    """boto3 clients with a thread pool sized to their connection pools"""
+
+    def __init__(self, region: str, config: Optional[Config] = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.region = region
+        self.config = config or aws_clients.client_config()
+        self.executor = executor or aws_clients.executor(self.config.max_pool_connections)
+        self._dynamodb = None
+        self._kinesis = None
+
+    async def start(self):
+        pass
+
+    def table(self, name: str) -> ThreadedTable:
+        if self._dynamodb is None:
+            self._dynamodb = aws_clients.resource('dynamodb', region_name=self.region, config=self.config)
+            metrics.instrument_client(self._dynamodb.meta.client)
+        return ThreadedTable(self._dynamodb.Table(name), self.executor)
+
+    def kinesis(self) -> ThreadedClient:
+        if self._kinesis is None:
+            self._kinesis = aws_clients.client('kinesis', region_name=self.region, config=self.config)
+            metrics.instrument_client(self._kinesis)
+        return ThreadedClient(self._kinesis, self.executor)
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class AsyncBackend:
+    """aiobotocore clients, opened by start() and closed by close()"""
+
+    def __init__(self, region: str, config: Optional[Config] = None):
+        self.region = region
+        self.config = config or aws_clients.client_config()
+        self._stack = AsyncExitStack()
+        self._dynamodb = None
+        self._kinesis = None
+
+    async def start(self):
+        from aiobotocore.session import get_session
+
+        session = get_session()
+        self._dynamodb = await self._stack.enter_async_context(
+            session.create_client('dynamodb', region_name=self.region, config=self.config)
+        )
+        self._kinesis = await self._stack.enter_async_context(
+            session.create_client('kinesis', region_name=self.region, config=self.config)
+        )
+        metrics.instrument_client(self._dynamodb)
+        metrics.instrument_client(self._kinesis)
+
+    def table(self, name: str) -> AsyncTable:
+        return AsyncTable(self._dynamodb, name)
+
+    def kinesis(self) -> Any:
+        return self._kinesis
+
+    async def close(self):
+        await self._stack.aclose()
+
+
+def create_backend(kind: str, region: str, config: Optional[Config] = None):
+    """The backend named by AWS_BACKEND ('threaded' or 'async'); call start() before use"""
+    if kind == 'threaded':
+        return ThreadedBackend(region, config)
+    if kind == 'async':
+        return AsyncBackend(region, config)
+    raise ValueError(f"Unknown AWS backend: {kind}")
@@ -0,0 +1,65 @@
+"""
+Shared boto3 client configuration
+
+Clients are created once per process (warm Lambda container or TrackStore
+instance) with:
+
+    max_pool_connections  sized to the number of threads making calls, so
+                          requests never wait for a pooled connection
+    retries               adaptive mode: exponential backoff plus a
+                          client-side rate limiter that slows down when
+                          the service throttles, instead of every thread
+                          retrying at full speed
+    tcp_keepalive         keeps idle pooled connections from being dropped
+                          between invocations
+    connect/read timeout  fail fast and retry rather than hang for botocore's
+                          default 60 s
+
+executor() builds a thread pool of the same size for run_in_executor calls,
+so async callers get a connection per thread rather than sharing the event
+loop's default executor.
+
+This module is copied verbatim into each component that calls AWS
+(ingestion-lambda, geofence-alerts, trackstore), since each is packaged
+and deployed on its own. Keep the copies identical.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+import boto3
+from botocore.config import Config
+
+MAX_POOL_CONNECTIONS = 10  # botocore's default; enough for single-threaded Lambdas
+MAX_ATTEMPTS = 5           # including the first call
+CONNECT_TIMEOUT_S = 2.0
+READ_TIMEOUT_S = 10.0
+
+
+def client_config(max_pool_connections: int = MAX_POOL_CONNECTIONS, max_attempts: int = MAX_ATTEMPTS,
+                  connect_timeout: float = CONNECT_TIMEOUT_S, read_timeout: float = READ_TIMEOUT_S) -> Config:
+    """botocore Config for a client used by up to `max_pool_connections` threads"""
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={'mode': 'adaptive', 'total_max_attempts': max_attempts},
+        tcp_keepalive=True,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout
+    )
+
+
+def client(service_name: str, region_name: Optional[str] = None, config: Optional[Config] = None,
+           **kwargs: Any) -> Any:
+    """boto3.client with the shared configuration unless `config` is given"""
+    return boto3.client(service_name, region_name=region_name, config=config or client_config(), **kwargs)
+
+
+def resource(service_name: str, region_name: Optional[str] = None, config: Optional[Config] = None,
+             **kwargs: Any) -> Any:
+    """boto3.resource with the shared configuration unless `config` is given"""
+    return boto3.resource(service_name, region_name=region_name, config=config or client_config(), **kwargs)
+
+
+def executor(max_workers: int = MAX_POOL_CONNECTIONS, name: str = 'aws') -> ThreadPoolExecutor:
+    """Thread pool for blocking AWS calls, one thread per pooled connection"""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
@@ -18,6 +18,19 @@ class Settings(BaseSettings):
     KINESIS_SHARD_ITERATOR_TYPE: str = "LASTEST"
     KINESIS_BATCH_SIZE: int = 100
     KINESIS_POLL_INTERVAL: float = 1.0
+    KINESIS_MAX_LAG_MS: int = 60000  # Consumer reports degraded when any shard is further behind its tip
+    LATENCY_WINDOW_SECONDS: float = 300.0  # Rolling window for per-hop latency percentiles at /latency
+    DEDUP_CACHE_SIZE: int = 100000  # Recent (device, timestamp) keys remembered for duplicate filtering
+    
+    # Per-device Kalman smoothing and outlier rejection
+    SMOOTHING_ENABLED: bool = True
+    SMOOTHING_PROCESS_NOISE: float = 1.0  # Acceleration noise, m^2/s^3
+    SMOOTHING_MAX_SPEED_KMH: float = 150.0  # Faster implied jumps are flagged as outliers
+    
+    # Dead-band filter for stationary buses (distance 0 disables it)
+    DEADBAND_MIN_DISTANCE_M: float = 15.0
+    DEADBAND_MIN_HEADING_DEG: float = 20.0
+    DEADBAND_MAX_INTERVAL_S: float = 60.0
     
     # DynamoDB Configuration
     DEVICE_TABLE_NAME: str = "transport-devices-dev"
@@ -27,6 +40,14 @@ class Settings(BaseSettings):
     SERVICE_NAME: str = "trackstore"
     LOG_LEVEL: str = "INFO"
     
+    # AWS clients: "threaded" runs boto3 on one executor thread per pooled connection,
+    # "async" runs aiobotocore on the event loop
+    AWS_BACKEND: str = "threaded"
+    AWS_MAX_POOL_CONNECTIONS: int = 50
+    AWS_MAX_ATTEMPTS: int = 5  # adaptive retry mode, including the first call
+    AWS_CONNECT_TIMEOUT: float = 2.0
+    AWS_READ_TIMEOUT: float = 10.0
+    
     # Performance
     BATCH_WRITE_SIZE: int = 25  # DynamoDB batch write limit
     LOCATION_TTL_DAYS: int = 30  # How long to keep location data
@@ -0,0 +1,73 @@
+"""
+Per-shard lag of the Kinesis consumer
+Measured from what Kinesis reports rather than from when records last
+arrived, so an idle stream reads as caught up instead of lagging:
+
+    millis_behind_latest  MillisBehindLatest from the last GetRecords call,
+                          how far the shard's iterator is behind its tip
+    record age            now minus ApproximateArrivalTimestamp of the oldest
+                          record in a batch, the delay added by the consumer
+    ingest delay          ApproximateArrivalTimestamp minus the device's `ts`
+                          for the newest fix in a batch, the delay added
+                          between the bus and the stream
+
+Updated once per GetRecords call, never per record.
+"""
+
+import math
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from . import metrics
+from .decoding import arrival_ms
+
+
+class ShardLag:
+    """Lag signals for one shard"""
+
+    def __init__(self, shard_id: str):
+        self.shard_id = shard_id
+        self.millis_behind_latest: Optional[int] = None
+        self.record_age_ms: Optional[float] = None
+        self.ingest_delay_ms: Optional[float] = None
+        self.started = time.monotonic()
+        self.last_poll: Optional[float] = None  # time.monotonic() of the last successful GetRecords
+        self.error: Optional[str] = None  # why reading the shard stopped, if it failed
+        self._millis_behind = metrics.MILLIS_BEHIND_LATEST.labels(shard_id)
+        self._record_age = metrics.RECORD_AGE_SECONDS.labels(shard_id)
+        self._ingest_delay = metrics.INGEST_DELAY_SECONDS.labels(shard_id)
+
+    def record_poll(self, response: Dict[str, Any]):
+        """Note a GetRecords response, with or without records"""
+        self.last_poll = time.monotonic()
+        if 'MillisBehindLatest' in response:
+            self.millis_behind_latest = response['MillisBehindLatest']
+            self._millis_behind.set(self.millis_behind_latest)
+
+    def record_batch(self, records: Sequence[Dict[str, Any]], fix_ts: np.ndarray):
+        """Note the arrival times of a non-empty batch and the device timestamps decoded from it"""
+        oldest = arrival_ms(records[0])
+        newest = arrival_ms(records[-1])
+        if math.isnan(oldest) or math.isnan(newest):
+            return
+        self.record_age_ms = max(time.time() * 1000 - oldest, 0.0)
+        self._record_age.observe(self.record_age_ms / 1000)
+        if len(fix_ts):
+            # Device clocks can run ahead of the stream's
+            self.ingest_delay_ms = max(newest - float(fix_ts.max()), 0.0)
+            self._ingest_delay.observe(self.ingest_delay_ms / 1000)
+
+    def close(self):
+        """Stop reporting every per-shard series for a shard that is no longer read"""
+        for metric in (metrics.MILLIS_BEHIND_LATEST, metrics.RECORD_AGE_SECONDS,
+                       metrics.INGEST_DELAY_SECONDS, metrics.GET_RECORDS_SECONDS):
+            try:
+                metric.remove(self.shard_id)
+            except KeyError:
+                pass  # never created for this shard
+
+    def seconds_since_poll(self) -> float:
+        """Time since the last successful GetRecords call, or since the shard was opened if none has succeeded"""
+        return time.monotonic() - (self.started if self.last_poll is None else self.last_poll)
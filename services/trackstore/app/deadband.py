@@ -0,0 +1,82 @@
+"""
+Dead-band filtering for TrackStore
+Suppresses fixes from buses that have not moved or turned since the last fix
+that was kept, such as buses parked at depots and layovers, while still
+keeping one fix per device every keepalive interval
+"""
+
+import math
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .location_batch import FLAG_OUTLIER, MISSING, LocationBatch
+
+METERS_PER_DEGREE = 111_320.0
+
+
+class DeadbandFilter:
+    """
+    Keeps a fix only if, since the device's last kept fix, it has moved at least
+    `min_distance_m`, turned at least `min_heading_deg`, or `max_interval_s`
+    has passed. A `min_distance_m` of 0 keeps everything.
+
+    The last kept (lat, lon, heading, ts) per device lives in memory. Fixes
+    older than the last kept one, and fixes flagged as outliers, are passed
+    through untouched.
+    """
+
+    def __init__(self, min_distance_m: float = 15.0, min_heading_deg: float = 20.0,
+                 max_interval_s: float = 60.0):
+        self.min_distance_m = min_distance_m
+        self.min_heading_deg = min_heading_deg
+        self.max_interval_ms = int(max_interval_s * 1000)
+        self._last: Dict[str, Tuple[float, float, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._last)
+
+    def filter(self, batch: LocationBatch) -> Tuple[LocationBatch, int]:
+        """Return the batch without suppressed fixes, in arrival order, and the number suppressed"""
+        if not len(batch) or self.min_distance_m <= 0:
+            return batch, 0
+
+        # Each device's fixes must be compared in time order against its last kept fix
+        order = np.lexsort((batch.ts, batch.device_idx))
+        keep = np.ones(len(batch), dtype=bool)
+        last = self._last
+        device_ids = batch.device_ids
+        min_distance = self.min_distance_m
+        min_heading = self.min_heading_deg
+        max_interval = self.max_interval_ms
+
+        rows = zip(order.tolist(), batch.device_idx[order].tolist(), batch.lat[order].tolist(),
+                   batch.lon[order].tolist(), batch.heading[order].tolist(), batch.ts[order].tolist(),
+                   (batch.flags[order] & FLAG_OUTLIER).tolist())
+        for i, device, lat, lon, heading, ts, outlier in rows:
+            if outlier:
+                continue
+            device_id = device_ids[device]
+            previous = last.get(device_id)
+            if previous is not None:
+                last_lat, last_lon, last_heading, last_ts = previous
+                if ts < last_ts:
+                    continue
+                # Equirectangular distance is accurate to well under a metre at these ranges
+                dy = (lat - last_lat) * METERS_PER_DEGREE
+                dx = (lon - last_lon) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+                turned = 0
+                if heading != MISSING and last_heading != MISSING:
+                    turned = abs(heading - last_heading) % 360
+                    turned = min(turned, 360 - turned)
+                if (ts - last_ts < max_interval
+                        and dx * dx + dy * dy < min_distance * min_distance
+                        and turned < min_heading):
+                    keep[i] = False
+                    continue
+            last[device_id] = (lat, lon, heading, ts)
+
+        suppressed = len(batch) - int(keep.sum())
+        if not suppressed:
+            return batch, 0
+        return batch.take(keep), suppressed
@@ -0,0 +1,135 @@
+"""
+Batch decoding of Kinesis records for TrackStore
+Parses record payloads with the fastest JSON library available and builds
+a columnar LocationBatch instead of Pydantic models
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .location_batch import LocationBatch
+from .telemetry_codec import CodecError, decode_binary, fixes_from_json, is_binary
+
+# Prefer orjson, then msgspec, then the standard library
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+    _JSON_ERRORS: Tuple[type, ...] = (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+        json_loads = msgspec.json.decode
+        JSON_BACKEND = "msgspec"
+        _JSON_ERRORS = (msgspec.DecodeError,)
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = "json"
+        _JSON_ERRORS = (ValueError,)
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_json_batch(payloads: List[bytes]) -> List[Any]:
+    """
+    Parse many JSON documents with one parser call by joining them into an
+    array. Falls back to one call per document if any of them is malformed.
+    """
+    try:
+        parsed = json_loads(b'[' + b','.join(payloads) + b']')
+        # A malformed payload can still join into valid JSON with the wrong length
+        if isinstance(parsed, list) and len(parsed) == len(payloads):
+            return parsed
+    except _JSON_ERRORS:
+        pass
+    
+    parsed = []
+    for payload in payloads:
+        try:
+            parsed.append(json_loads(payload))
+        except _JSON_ERRORS as e:
+            parsed.append(CodecError(f"Payload is neither a telemetry frame nor JSON: {e}"))
+    return parsed
+
+
+def arrival_ms(record: Dict[str, Any]) -> float:
+    """A record's ApproximateArrivalTimestamp as epoch milliseconds, NaN if missing"""
+    value = record.get('ApproximateArrivalTimestamp')
+    if value is None:
+        return float('nan')
+    if isinstance(value, datetime):
+        return value.timestamp() * 1000
+    return float(value) * 1000
+
+
+def decode_records(records: Sequence[Dict[str, Any]]) -> Tuple[LocationBatch, int]:
+    """
+    Decode a batch of Kinesis records into fixes, keeping record order.
+    
+    Records may be JSON or binary telemetry frames and may each carry several
+    fixes. Returns the batch and the number of records or fixes that failed.
+    """
+    messages, _, errors = _decode_messages(records)
+    batch, rejected = LocationBatch.from_messages(messages)
+    return batch, errors + rejected
+
+
+def decode_records_with_arrivals(
+    records: Sequence[Dict[str, Any]]
+) -> Tuple[LocationBatch, int, Optional[np.ndarray]]:
+    """
+    decode_records, plus the ApproximateArrivalTimestamp (epoch ms) of the
+    record each fix came from, or None when malformed fixes were dropped and
+    the rows no longer line up with their records
+    """
+    messages, counts, errors = _decode_messages(records)
+    batch, rejected = LocationBatch.from_messages(messages)
+    if rejected:
+        return batch, errors + rejected, None
+    arrivals = np.repeat(np.array([arrival_ms(record) for record in records], dtype=np.float64), counts)
+    return batch, errors, arrivals
+
+
+def _decode_messages(records: Sequence[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[int], int]:
+    """Fixes decoded from `records`, how many came from each record, and the number of records that failed"""
+    decoded: List[Optional[Any]] = [None] * len(records)
+    json_index = []
+    json_payloads = []
+    
+    for i, record in enumerate(records):
+        data = record['Data']
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if is_binary(data):
+            try:
+                decoded[i] = decode_binary(data)
+            except CodecError as e:
+                decoded[i] = e
+        else:
+            json_index.append(i)
+            json_payloads.append(data)
+    
+    if json_payloads:
+        for i, payload in zip(json_index, _parse_json_batch(json_payloads)):
+            decoded[i] = payload
+    
+    messages = []
+    counts = []
+    errors = 0
+    for payload in decoded:
+        try:
+            if isinstance(payload, CodecError):
+                raise payload
+            fixes = fixes_from_json(payload)
+        except CodecError as e:
+            logger.error(f"Error decoding record: {str(e)}")
+            errors += 1
+            counts.append(0)
+            continue
+        messages.extend(fixes)
+        counts.append(len(fixes))
+    return messages, counts, errors
@@ -0,0 +1,63 @@
+"""
+Duplicate fix filtering for TrackStore
+Kinesis delivers at least once and devices publish with QoS 1, so the same
+fix can arrive several times; this drops repeats before they reach DynamoDB
+"""
+
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+
+from .location_batch import LocationBatch
+
+
+class FixDeduplicator:
+    """
+    Drops fixes whose (device, timestamp) was already seen.
+
+    Remembers the most recent `capacity` keys in an LRU, which covers
+    redeliveries from Kinesis retries and QoS 1 republishes; anything older
+    is written again, which is harmless because location writes are keyed
+    on (deviceId, timestamp).
+    """
+
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self._seen: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def filter(self, batch: LocationBatch) -> Tuple[LocationBatch, int]:
+        """Return the batch without duplicates, in arrival order, and the number dropped"""
+        if not len(batch):
+            return batch, 0
+
+        # Repeats within the batch are adjacent once sorted by (device, ts)
+        order = np.lexsort((batch.ts, batch.device_idx))
+        devices = batch.device_idx[order]
+        ts = batch.ts[order]
+        repeat = np.zeros(len(batch), dtype=bool)
+        repeat[order[1:]] = (devices[1:] == devices[:-1]) & (ts[1:] == ts[:-1])
+
+        keep = ~repeat
+        seen = self._seen
+        device_ids = batch.device_ids
+        for i, device, timestamp in zip(np.flatnonzero(keep).tolist(),
+                                        batch.device_idx[keep].tolist(),
+                                        batch.ts[keep].tolist()):
+            key = (device_ids[device], timestamp)
+            if key in seen:
+                seen.move_to_end(key)
+                keep[i] = False
+            else:
+                seen[key] = None
+
+        while len(seen) > self.capacity:
+            seen.popitem(last=False)
+
+        dropped = len(batch) - int(keep.sum())
+        if not dropped:
+            return batch, 0
+        return batch.take(keep), dropped
@@ -2,42 +2,46 @@
 DynamoDB storage operations for TrackStore
 """
 
-import boto3
 from boto3.dynamodb.conditions import Key, Attr
-from typing import List, Dict, Any, Optional
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Sequence, Union
 import logging
 from datetime import datetime, timedelta
 import asyncio
+import time
 from decimal import Decimal
 
-from .models import LocationRecord, DeviceStatus
+import numpy as np
+
+from . import metrics
+from .aws_backends import ThreadedBackend
+from .location_batch import FLAG_OUTLIER, MISSING, LocationBatch
+from .models import LocationRecord, DeviceStatus, Fix
 
 logger = logging.getLogger(__name__)
 
 class DynamoStore:
     """Handles all DynamoDB operations"""
     
-    def __init__(self, device_table: str, location_table: str, region: str = "us-east-1"):
-        self.dynamodb = boto3.resource('dynamodb', region_name=region)
-        self.device_table = self.dynamodb.Table(device_table)
-        self.location_table = self.dynamodb.Table(location_table)
+    def __init__(self, device_table: str, location_table: str, region: str = "us-east-1",
+                 config: Optional[Config] = None, executor: Optional[ThreadPoolExecutor] = None,
+                 backend: Any = None):
+        # Tables come from a started backend (see aws_backends), or boto3 on a dedicated thread pool
+        self.backend = backend or ThreadedBackend(region, config, executor)
+        self.device_table = self.backend.table(device_table)
+        self.location_table = self.backend.table(location_table)
         self.device_table_name = device_table
         self.location_table_name = location_table
         
     async def health_check(self) -> bool:
         """Check if DynamoDB tables are accessible"""
         try:
-            # Run in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            
             # Get table descriptions
-            device_status = await loop.run_in_executor(
-                None, 
-                lambda: self.device_table.table_status
-            )
-            location_status = await loop.run_in_executor(
-                None, 
-                lambda: self.location_table.table_status
+            device_status, location_status = await asyncio.gather(
+                self.device_table.table_status(),
+                self.location_table.table_status()
             )
             
             return device_status == 'ACTIVE' and location_status == 'ACTIVE'
@@ -73,8 +77,7 @@ class DynamoStore:
                 item['qualityScore'] = location.quality_score
             
             # Store in DynamoDB
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, self.location_table.put_item, {'Item': item})
+            await self.location_table.put_item(Item=item)
             
             # Update device status
             await self.update_device_status(location)
@@ -85,66 +88,99 @@ class DynamoStore:
             logger.error(f"Error storing location: {str(e)}")
             return False
     
-    async def store_locations_batch(self, locations: List[LocationRecord]) -> int:
+    async def store_locations_batch(self, locations: Union[LocationBatch, Sequence[LocationRecord]]) -> int:
         """Store multiple locations in batch"""
-        if not locations:
+        if not isinstance(locations, LocationBatch):
+            locations = LocationBatch.from_records(locations)
+        if not len(locations):
             return 0
             
         success_count = 0
         
         try:
-            # Process in batches of 25 (DynamoDB limit)
-            for i in range(0, len(locations), 25):
-                batch = locations[i:i+25]
+            # Column-wise conversions once per batch rather than per item
+            device_ids = [locations.device_ids[i] for i in locations.device_idx.tolist()]
+            timestamps = locations.ts.tolist()
+            latitudes = locations.lat.astype(str).tolist()
+            longitudes = locations.lon.astype(str).tolist()
+            speeds = locations.speed.astype(str).tolist()
+            has_speed = (~np.isnan(locations.speed)).tolist()
+            headings = locations.heading.tolist()
+            accuracies = locations.accuracy.astype(str).tolist()
+            has_accuracy = (~np.isnan(locations.accuracy)).tolist()
+            outlier = (locations.flags & FLAG_OUTLIER).astype(bool)
+            outliers = outlier.tolist()
+            
+            # Partition dates in local time, computed once per distinct minute
+            minutes, minute_idx = np.unique(locations.ts // 60000, return_inverse=True)
+            minute_dates = [datetime.fromtimestamp(m * 60).strftime('%Y-%m-%d') for m in minutes.tolist()]
+            dates = [minute_dates[i] for i in minute_idx.tolist()]
+            ttl = int((datetime.utcnow() + timedelta(days=30)).timestamp())
+            
+            items = []
+            for i in range(len(locations)):
+                item = {
+                    'deviceId': device_ids[i],
+                    'timestamp': timestamps[i],
+                    'latitude': Decimal(latitudes[i]),
+                    'longitude': Decimal(longitudes[i]),
+                    'date': dates[i],
+                    'ttl': ttl
+                }
                 
-                with self.location_table.batch_writer() as batch_writer:
-                    for location in batch:
-                        item = {
-                            'deviceId': location.device_id,
-                            'timestamp': location.timestamp,
-                            'latitude': Decimal(str(location.latitude)),
-                            'longitude': Decimal(str(location.longitude)),
-                            'date': datetime.fromtimestamp(location.timestamp / 1000).strftime('%Y-%m-%d'),
-                            'ttl': int((datetime.utcnow() + timedelta(days=30)).timestamp())
-                        }
-                        
-                        if location.speed is not None:
-                            item['speed'] = Decimal(str(location.speed))
-                        if location.heading is not None:
-                            item['heading'] = location.heading
-                        if location.accuracy is not None:
-                            item['accuracy'] = Decimal(str(location.accuracy))
-                        
-                        batch_writer.put_item(Item=item)
-                        success_count += 1
+                if has_speed[i]:
+                    item['speed'] = Decimal(speeds[i])
+                if headings[i] != MISSING:
+                    item['heading'] = headings[i]
+                if has_accuracy[i]:
+                    item['accuracy'] = Decimal(accuracies[i])
+                if outliers[i]:
+                    item['outlier'] = True
                 
-                # Update device statuses
-                for location in batch:
-                    await self.update_device_status(location)
+                items.append(item)
+            
+            started = time.perf_counter()
+            await self.location_table.batch_write(items)
+            metrics.BATCH_WRITE_SECONDS.observe(time.perf_counter() - started)
+            success_count = len(items)
+            
+            # One device status update per device, from its newest fix; outliers never move a device.
+            # Updates run concurrently, bounded by the backend's connection pool
+            if outlier.any():
+                locations = locations.take(~outlier)
+            latest, counts = locations.latest_per_device()
+            await asyncio.gather(*(
+                self.update_device_status(locations[i], count)
+                for i, count in zip(latest.tolist(), counts.tolist())
+            ))
                     
         except Exception as e:
             logger.error(f"Error in batch write: {str(e)}")
             
         return success_count
     
-    async def update_device_status(self, location: LocationRecord):
-        """Update device status with latest location"""
+    async def update_device_status(self, location: Union[LocationRecord, Fix], updates: int = 1):
+        """
+        Update device status with latest location, counting `updates` fixes.
+        
+        The location only replaces the stored one if it is newer, so a fix that
+        arrives late cannot move the device backwards.
+        """
+        started = time.perf_counter()
         try:
-            loop = asyncio.get_event_loop()
-            
             # Update device table
             update_expr = """
                 SET lastSeen = :ts,
                     lastLocation = :loc,
                     #status = :status,
-                    totalUpdates = if_not_exists(totalUpdates, :zero) + :one
+                    totalUpdates = if_not_exists(totalUpdates, :zero) + :count
             """
             
-            await loop.run_in_executor(
-                None,
-                lambda: self.device_table.update_item(
+            try:
+                await self.device_table.update_item(
                     Key={'deviceId': location.device_id},
                     UpdateExpression=update_expr,
+                    ConditionExpression='attribute_not_exists(lastSeen) OR lastSeen < :ts',
                     ExpressionAttributeNames={'#status': 'status'},
                     ExpressionAttributeValues={
                         ':ts': location.timestamp,
@@ -154,13 +190,24 @@ class DynamoStore:
                         },
                         ':status': 'active',
                         ':zero': 0,
-                        ':one': 1
+                        ':count': updates
                     }
                 )
-            )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Out-of-order fix: keep the newer location, still count the update
+                logger.debug(f"Stale fix for {location.device_id} at {location.timestamp}; status unchanged")
+                await self.device_table.update_item(
+                    Key={'deviceId': location.device_id},
+                    UpdateExpression='SET totalUpdates = if_not_exists(totalUpdates, :zero) + :count',
+                    ExpressionAttributeValues={':zero': 0, ':count': updates}
+                )
             
         except Exception as e:
             logger.error(f"Error updating device status: {str(e)}")
+        finally:
+            metrics.DEVICE_UPDATE_SECONDS.observe(time.perf_counter() - started)
     
     async def get_device_locations(
         self,
@@ -171,8 +218,6 @@ class DynamoStore:
     ) -> List[LocationRecord]:
         """Get location history for a device"""
         try:
-            loop = asyncio.get_event_loop()
-            
             # Build query parameters
             key_condition = Key('deviceId').eq(device_id)
             
@@ -184,13 +229,10 @@ class DynamoStore:
                 key_condition = key_condition & Key('timestamp').lte(end_time)
             
             # Query DynamoDB
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.location_table.query(
-                    KeyConditionExpression=key_condition,
-                    ScanIndexForward=False,  # Most recent first
-                    Limit=limit
-                )
+            response = await self.location_table.query(
+                KeyConditionExpression=key_condition,
+                ScanIndexForward=False,  # Most recent first
+                Limit=limit
             )
             
             # Convert to LocationRecord objects
@@ -223,13 +265,8 @@ class DynamoStore:
     async def get_all_devices(self) -> List[DeviceStatus]:
         """Get all registered devices"""
         try:
-            loop = asyncio.get_event_loop()
-            
             # Scan device table
-            response = await loop.run_in_executor(
-                None,
-                self.device_table.scan
-            )
+            response = await self.device_table.scan()
             
             devices = []
             for item in response.get('Items', []):
@@ -256,12 +293,7 @@ class DynamoStore:
     async def get_device_status(self, device_id: str) -> Optional[DeviceStatus]:
         """Get status for a specific device"""
         try:
-            loop = asyncio.get_event_loop()
-            
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.device_table.get_item(Key={'deviceId': device_id})
-            )
+            response = await self.device_table.get_item(Key={'deviceId': device_id})
             
             item = response.get('Item')
             if not item:
@@ -288,8 +320,6 @@ class DynamoStore:
     async def register_device(self, device_id: str, device_info: Dict[str, Any]):
         """Register a new device"""
         try:
-            loop = asyncio.get_event_loop()
-            
             item = {
                 'deviceId': device_id,
                 'registeredAt': int(datetime.utcnow().timestamp() * 1000),
@@ -297,10 +327,7 @@ class DynamoStore:
                 'attributes': device_info
             }
             
-            await loop.run_in_executor(
-                None,
-                lambda: self.device_table.put_item(Item=item)
-            )
+            await self.device_table.put_item(Item=item)
             
         except Exception as e:
             logger.error(f"Error registering device: {str(e)}")
@@ -2,16 +2,25 @@
 Kinesis consumer for TrackStore service
 """
 
-import boto3
-import json
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import time
 
-from .models import LocationRecord, KinesisRecord
+from botocore.config import Config
+
+from . import metrics
+from .aws_backends import ThreadedBackend
+from .consumer_lag import ShardLag
+from .models import KinesisRecord
 from .dynamo_store import DynamoStore
+from .decoding import decode_records_with_arrivals
+from .deadband import DeadbandFilter
+from .dedup import FixDeduplicator
+from .smoothing import KalmanSmoother
+from .tracing import LatencyWindow, now_ms
 
 logger = logging.getLogger(__name__)
 
@@ -25,20 +34,45 @@ class KinesisConsumer:
         dynamo_store: DynamoStore,
         shard_iterator_type: str = "LATEST",
         batch_size: int = 100,
-        poll_interval: float = 1.0
+        poll_interval: float = 1.0,
+        max_lag_ms: int = 60_000,
+        stall_timeout: float = 300.0,
+        latency_window_s: float = 300.0,
+        dedup_cache_size: int = 100_000,
+        smoothing_enabled: bool = True,
+        smoothing_process_noise: float = 1.0,
+        smoothing_max_speed_kmh: float = 150.0,
+        deadband_distance_m: float = 15.0,
+        deadband_heading_deg: float = 20.0,
+        deadband_interval_s: float = 60.0,
+        config: Optional[Config] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+        backend: Any = None
     ):
         self.stream_name = stream_name
-        self.kinesis_client = boto3.client('kinesis', region_name=region)
+        # Client methods are coroutines: aiobotocore, or boto3 on a dedicated thread pool
+        self.kinesis_client = (backend or ThreadedBackend(region, config, executor)).kinesis()
         self.dynamo_store = dynamo_store
         self.shard_iterator_type = shard_iterator_type
         self.batch_size = batch_size
         self.poll_interval = poll_interval
+        self.max_lag_ms = max_lag_ms
+        self.stall_timeout = stall_timeout
+        self.deduplicator = FixDeduplicator(dedup_cache_size)
+        self.smoother = KalmanSmoother(smoothing_process_noise, smoothing_max_speed_kmh) if smoothing_enabled else None
+        self.deadband = DeadbandFilter(deadband_distance_m, deadband_heading_deg, deadband_interval_s)
+        self.latency = LatencyWindow(latency_window_s)
         
         self.is_running = False
         self.records_processed = 0
+        self.duplicates_dropped = 0
+        self.outliers_rejected = 0
+        self.fixes_suppressed = 0
         self.error_count = 0
         self.last_sequence_number = None
         self.last_record_time = None
+        self.shard_lag: Dict[str, ShardLag] = {}
+        self.stream_error: Optional[str] = None
         
     async def start_consuming(self):
         """Start consuming from Kinesis stream"""
@@ -70,6 +104,7 @@ class KinesisConsumer:
         except Exception as e:
             logger.error(f"Error in Kinesis consumer: {str(e)}")
             self.error_count += 1
+            self.stream_error = str(e)
             # Don't crash the service, just log the error
             if "AccessDeniedException" in str(e):
                 logger.error("Permission denied accessing Kinesis. Check IAM roles.")
@@ -83,42 +118,31 @@ class KinesisConsumer:
         
     def is_healthy(self) -> bool:
         """Check if consumer is healthy"""
-        # During startup, consider healthy if running
-        if not self.is_running:
+        if not self.is_running or self.stream_error:
             return False
-            
-        # If we haven't processed any records yet, still consider healthy for first 5 minutes
-        if self.records_processed == 0 and hasattr(self, '_start_time'):
-            startup_grace_period = 300  # 5 minutes
-            if time.time() - self._start_time < startup_grace_period:
-                return True
-        
-        # Check if we've received data recently (within 5 minutes)
-        if self.last_record_time:
-            time_since_last = time.time() - self.last_record_time
-            if time_since_last > 300:  # 5 minutes
+        
+        # GetRecords succeeds even when the stream is idle, so a shard whose reader
+        # died, or whose calls have failed for `stall_timeout`, is stuck
+        for lag in self.shard_lag.values():
+            if lag.error or lag.seconds_since_poll() > self.stall_timeout:
                 return False
-                
-        return True
+        
+        # Falling behind the tip of any shard, however recently records arrived
+        lag_ms = self.get_lag_ms()
+        return lag_ms is None or lag_ms <= self.max_lag_ms
     
     def get_lag_ms(self) -> Optional[int]:
-        """Get consumer lag in milliseconds"""
-        if not self.last_record_time:
-            return None
-        return int((time.time() - self.last_record_time) * 1000)
+        """Largest MillisBehindLatest across shards; 0 when caught up, even if the stream is idle"""
+        reported = [lag.millis_behind_latest for lag in self.shard_lag.values()
+                    if lag.millis_behind_latest is not None]
+        return max(reported) if reported else None
     
     async def _describe_stream(self) -> Dict[str, Any]:
         """Get stream description"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            lambda: self.kinesis_client.describe_stream(StreamName=self.stream_name)
-        )
+        return await self.kinesis_client.describe_stream(StreamName=self.stream_name)
     
     async def _get_shard_iterator(self, shard_id: str) -> str:
         """Get shard iterator"""
-        loop = asyncio.get_event_loop()
-        
         params = {
             'StreamName': self.stream_name,
             'ShardId': shard_id,
@@ -129,10 +153,7 @@ class KinesisConsumer:
         if self.last_sequence_number and self.shard_iterator_type == "AFTER_SEQUENCE_NUMBER":
             params['StartingSequenceNumber'] = self.last_sequence_number
         
-        response = await loop.run_in_executor(
-            None,
-            lambda: self.kinesis_client.get_shard_iterator(**params)
-        )
+        response = await self.kinesis_client.get_shard_iterator(**params)
         
         return response['ShardIterator']
     
@@ -140,26 +161,47 @@ class KinesisConsumer:
         """Consume records from a single shard"""
         logger.info(f"Starting consumer for shard: {shard_id}")
         
+        lag = self.shard_lag[shard_id] = ShardLag(shard_id)
+        try:
+            closed = await self._read_shard(shard_id, lag)
+        except Exception as e:
+            # Stays in shard_lag, marked failed, so health and the gauges show it
+            logger.error(f"Stopped consuming shard {shard_id}: {str(e)}")
+            self.error_count += 1
+            lag.error = str(e)
+            return
+        if closed:
+            # A closed shard (after resharding) no longer counts towards lag or health
+            logger.info(f"Shard {shard_id} is closed")
+            self.shard_lag.pop(shard_id, None)
+            lag.close()
+    
+    async def _read_shard(self, shard_id: str, lag: ShardLag) -> bool:
+        """
+        Read a shard until it is closed (returns True) or the consumer stops
+        (returns False); raises if no iterator can be obtained
+        """
         # Get initial iterator
         shard_iterator = await self._get_shard_iterator(shard_id)
+        get_records_seconds = metrics.GET_RECORDS_SECONDS.labels(shard_id)
         
         while self.is_running and shard_iterator:
             try:
                 # Get records
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.kinesis_client.get_records(
-                        ShardIterator=shard_iterator,
-                        Limit=self.batch_size
-                    )
+                started = time.perf_counter()
+                response = await self.kinesis_client.get_records(
+                    ShardIterator=shard_iterator,
+                    Limit=self.batch_size
                 )
+                get_records_seconds.observe(time.perf_counter() - started)
                 
                 records = response.get('Records', [])
+                metrics.RECORDS_PER_BATCH.observe(len(records))
+                lag.record_poll(response)
                 
                 if records:
                     # Process records
-                    await self._process_records(records)
+                    await self._process_records(records, lag)
                     
                     # Update last sequence number
                     self.last_sequence_number = records[-1]['SequenceNumber']
@@ -179,44 +221,39 @@ class KinesisConsumer:
                 # Wait before retrying
                 await asyncio.sleep(5)
                 
-                # Try to get a new iterator
-                try:
-                    shard_iterator = await self._get_shard_iterator(shard_id)
-                except Exception as e:
-                    logger.error(f"Failed to get new iterator: {str(e)}")
-                    break
+                # Try to get a new iterator; if that fails too, the shard has failed
+                shard_iterator = await self._get_shard_iterator(shard_id)
+        
+        return self.is_running
     
-    async def _process_records(self, records: List[Dict[str, Any]]):
+    async def _process_records(self, records: List[Dict[str, Any]], lag: Optional[ShardLag] = None):
         """Process a batch of Kinesis records"""
-        locations = []
+        started = time.perf_counter()
+        locations, errors, arrivals = decode_records_with_arrivals(records)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - started)
+        self.error_count += errors
+        decoded_at = now_ms()
+        self.latency.record_decoded(locations, arrivals, decoded_at)
+        if lag is not None:
+            lag.record_batch(records, locations.ts)
         
-        for record in records:
-            try:
-                # Decode the data
-                data = json.loads(record['Data'])
-                
-                # Create LocationRecord
-                location = LocationRecord(
-                    busId=data.get('busId'),
-                    lat=data.get('lat'),
-                    lon=data.get('lon'),
-                    ts=data.get('ts'),
-                    speed=data.get('speed'),
-                    heading=data.get('heading'),
-                    accuracy=data.get('accuracy'),
-                    processed_at=data.get('processed_at'),
-                    region=data.get('region'),
-                    quality_score=data.get('quality_score')
-                )
-                
-                locations.append(location)
-                
-            except Exception as e:
-                logger.error(f"Error processing record: {str(e)}")
-                self.error_count += 1
+        # Drop redelivered fixes before they cost any write capacity
+        locations, duplicates = self.deduplicator.filter(locations)
+        self.duplicates_dropped += duplicates
+        
+        # Smooth positions and flag implausible jumps; needs every fix, so before the dead-band
+        if self.smoother is not None:
+            locations, outliers = self.smoother.filter(locations)
+            self.outliers_rejected += outliers
+        
+        # Skip fixes from buses that are standing still
+        locations, suppressed = self.deadband.filter(locations)
+        self.fixes_suppressed += suppressed
         
         # Store locations in batch
         if locations:
             stored_count = await self.dynamo_store.store_locations_batch(locations)
             self.records_processed += stored_count
+            if stored_count:
+                self.latency.record_stored(locations, decoded_at, now_ms())
             logger.info(f"Processed {stored_count} locations from Kinesis")
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""
+Columnar location batches for TrackStore
+A batch of fixes held as parallel NumPy arrays, with device IDs and other
+repeated strings interned into per-batch tables, instead of one object per fix
+"""
+
+import logging
+import math
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .models import Fix
+
+MISSING = -1  # heading and interned-string index for an absent value
+
+# Bits in LocationBatch.flags
+FLAG_SMOOTHED = 1  # lat/lon replaced by the smoothing filter's estimate
+FLAG_OUTLIER = 2   # rejected as an implausible jump
+
+logger = logging.getLogger(__name__)
+
+
+class LocationBatch:
+    """
+    Fixes stored column-wise: float64 lat/lon, int64 ts and processed_at,
+    float32 speed/accuracy, int16 heading, int32/int16 indices into the
+    device, region and quality tables and uint8 processing flags. About 50
+    bytes per fix.
+
+    Missing values are NaN for speed/accuracy, 0 for processed_at and
+    MISSING for heading and the interned strings. Indexing a batch gives a
+    Fix, so row-at-a-time code keeps working.
+    """
+    __slots__ = (
+        'device_ids', 'regions', 'quality_scores', 'device_idx', 'lat', 'lon', 'ts',
+        'speed', 'heading', 'accuracy', 'processed_at', 'region_idx', 'quality_idx', 'flags'
+    )
+
+    def __init__(self, device_ids: List[str], regions: List[str], quality_scores: List[str],
+                 device_idx: np.ndarray, lat: np.ndarray, lon: np.ndarray, ts: np.ndarray,
+                 speed: np.ndarray, heading: np.ndarray, accuracy: np.ndarray,
+                 processed_at: np.ndarray, region_idx: np.ndarray, quality_idx: np.ndarray,
+                 flags: Optional[np.ndarray] = None):
+        self.device_ids = device_ids
+        self.regions = regions
+        self.quality_scores = quality_scores
+        self.device_idx = device_idx
+        self.lat = lat
+        self.lon = lon
+        self.ts = ts
+        self.speed = speed
+        self.heading = heading
+        self.accuracy = accuracy
+        self.processed_at = processed_at
+        self.region_idx = region_idx
+        self.quality_idx = quality_idx
+        self.flags = np.zeros(len(ts), dtype=np.uint8) if flags is None else flags
+
+    @classmethod
+    def from_messages(cls, messages: Sequence[Dict[str, Any]]) -> Tuple["LocationBatch", int]:
+        """
+        Build from decoded messages (JSON field names), returning the batch and
+        the number of messages rejected.
+
+        Converts whole columns at once; if any message is malformed, falls back
+        to appending row by row so only the bad ones are dropped.
+        """
+        try:
+            return cls._from_columns(messages), 0
+        except (KeyError, TypeError, ValueError, OverflowError):
+            pass
+
+        builder = LocationBatchBuilder()
+        rejected = 0
+        for data in messages:
+            try:
+                builder.append_message(data)
+            except (KeyError, TypeError, ValueError, OverflowError) as e:
+                logger.error(f"Error processing record: {str(e)}")
+                rejected += 1
+        return builder.build(), rejected
+
+    @classmethod
+    def _from_columns(cls, messages: Sequence[Dict[str, Any]]) -> "LocationBatch":
+        device_ids = [m['busId'] for m in messages]
+        if not all(type(d) is str for d in device_ids):
+            raise TypeError("busId must be a string")
+        headings = np.array([MISSING if (h := m.get('heading')) is None else h for m in messages], dtype=np.int64)
+        if len(headings) and (headings.min() < MISSING or headings.max() > 360):
+            raise ValueError("heading out of range")
+
+        # None becomes NaN here, where float() would reject it; Decimal cannot hold either
+        lat = np.array([m['lat'] for m in messages], dtype=np.float64)
+        lon = np.array([m['lon'] for m in messages], dtype=np.float64)
+        if not (np.isfinite(lat).all() and np.isfinite(lon).all()):
+            raise ValueError("lat/lon must be finite numbers")
+        speed = np.array([m.get('speed') for m in messages], dtype=np.float32)
+        accuracy = np.array([m.get('accuracy') for m in messages], dtype=np.float32)
+        if np.isinf(speed).any() or np.isinf(accuracy).any():
+            raise ValueError("speed/accuracy must be finite")
+
+        devices: Dict[str, int] = {}
+        regions: Dict[str, int] = {}
+        quality: Dict[str, int] = {}
+        device_idx = [devices.setdefault(d, len(devices)) for d in device_ids]
+        region_idx = [MISSING if (r := m.get('region')) is None else regions.setdefault(r, len(regions))
+                      for m in messages]
+        quality_idx = [MISSING if (q := m.get('quality_score')) is None else quality.setdefault(q, len(quality))
+                       for m in messages]
+        return cls(
+            list(devices), list(regions), list(quality),
+            np.array(device_idx, dtype=np.int32),
+            lat,
+            lon,
+            np.array([m['ts'] for m in messages], dtype=np.int64),
+            speed,
+            headings.astype(np.int16),
+            accuracy,
+            np.array([m.get('processed_at') or 0 for m in messages], dtype=np.int64),
+            np.array(region_idx, dtype=np.int16),
+            np.array(quality_idx, dtype=np.int16)
+        )
+
+    @classmethod
+    def from_records(cls, locations: Sequence[Any]) -> "LocationBatch":
+        """Build from LocationRecord or Fix objects"""
+        builder = LocationBatchBuilder()
+        for location in locations:
+            builder.append(location)
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def __getitem__(self, i: int) -> Fix:
+        heading = int(self.heading[i])
+        region = int(self.region_idx[i])
+        quality = int(self.quality_idx[i])
+        return Fix(
+            self.device_ids[self.device_idx[i]],
+            float(self.lat[i]),
+            float(self.lon[i]),
+            int(self.ts[i]),
+            # str() gives the shortest float32 repr, so 12.3 reads back as 12.3
+            None if np.isnan(self.speed[i]) else float(str(self.speed[i])),
+            None if heading == MISSING else heading,
+            None if np.isnan(self.accuracy[i]) else float(str(self.accuracy[i])),
+            int(self.processed_at[i]) or None,
+            None if region == MISSING else self.regions[region],
+            None if quality == MISSING else self.quality_scores[quality]
+        )
+
+    def __iter__(self) -> Iterator[Fix]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the column arrays"""
+        return sum(getattr(self, name).nbytes for name in self.__slots__[3:])
+
+    def take(self, idx: np.ndarray) -> "LocationBatch":
+        """New batch with the rows at `idx` (indices or a boolean mask), sharing the string tables"""
+        return LocationBatch(
+            self.device_ids, self.regions, self.quality_scores,
+            *(getattr(self, name)[idx] for name in self.__slots__[3:])
+        )
+
+    def with_columns(self, **columns: np.ndarray) -> "LocationBatch":
+        """New batch with some columns replaced, e.g. with_columns(lat=..., lon=...)"""
+        return LocationBatch(
+            self.device_ids, self.regions, self.quality_scores,
+            *(columns.get(name, getattr(self, name)) for name in self.__slots__[3:])
+        )
+
+    def latest_per_device(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row of the newest fix for each device present, and how many fixes each
+        of those devices has in the batch.
+        """
+        order = np.lexsort((self.ts, self.device_idx))
+        devices = self.device_idx[order]
+        last = np.flatnonzero(np.append(devices[1:] != devices[:-1], True))
+        counts = np.bincount(self.device_idx, minlength=len(self.device_ids))
+        return order[last], counts[devices[last]]
+
+
+class LocationBatchBuilder:
+    """Accumulates fixes row by row, then builds a LocationBatch in one step"""
+
+    def __init__(self):
+        self._devices: Dict[str, int] = {}
+        self._regions: Dict[str, int] = {}
+        self._quality: Dict[str, int] = {}
+        self._columns: Tuple[List[Any], ...] = tuple([] for _ in LocationBatch.__slots__[3:-1])
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    @staticmethod
+    def _intern(table: Dict[str, int], value: Optional[str]) -> int:
+        if value is None:
+            return MISSING
+        return table.setdefault(value, len(table))
+
+    def append(self, location: Any):
+        """Add a LocationRecord or Fix; raises ValueError if it does not fit the column types"""
+        heading = location.heading
+        if heading is not None and not 0 <= heading <= 360:
+            raise ValueError(f"heading out of range: {heading}")
+        row = (
+            self._intern(self._devices, location.device_id),
+            location.latitude,
+            location.longitude,
+            location.timestamp,
+            np.nan if location.speed is None else location.speed,
+            MISSING if heading is None else heading,
+            np.nan if location.accuracy is None else location.accuracy,
+            location.processed_at or 0,
+            self._intern(self._regions, location.region),
+            self._intern(self._quality, location.quality_score)
+        )
+        for column, value in zip(self._columns, row):
+            column.append(value)
+
+    def append_message(self, data: Dict[str, Any]):
+        """Add a decoded message (JSON field names); raises if a field is missing or mistyped"""
+        device_id = data['busId']
+        if not isinstance(device_id, str):
+            raise ValueError(f"busId must be a string, got {type(device_id).__name__}")
+        get = data.get
+        speed = get('speed')
+        heading = get('heading')
+        accuracy = get('accuracy')
+        heading = MISSING if heading is None else int(heading)
+        if not MISSING <= heading <= 360:
+            raise ValueError(f"heading out of range: {heading}")
+        lat = float(data['lat'])
+        lon = float(data['lon'])
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            raise ValueError(f"lat/lon must be finite numbers, got {lat}, {lon}")
+        speed = np.nan if speed is None else float(speed)
+        accuracy = np.nan if accuracy is None else float(accuracy)
+        if math.isinf(speed) or math.isinf(accuracy):
+            raise ValueError(f"speed/accuracy must be finite, got {speed}, {accuracy}")
+        row = (
+            lat,
+            lon,
+            int(data['ts']),
+            speed,
+            heading,
+            accuracy,
+            int(get('processed_at') or 0),
+            self._intern(self._regions, get('region')),
+            self._intern(self._quality, get('quality_score'))
+        )
+        self._columns[0].append(self._intern(self._devices, device_id))
+        for column, value in zip(self._columns[1:], row):
+            column.append(value)
+
+    def build(self) -> LocationBatch:
+        device_idx, lat, lon, ts, speed, heading, accuracy, processed_at, region, quality = self._columns
+        return LocationBatch(
+            list(self._devices), list(self._regions), list(self._quality),
+            np.array(device_idx, dtype=np.int32),
+            np.array(lat, dtype=np.float64),
+            np.array(lon, dtype=np.float64),
+            np.array(ts, dtype=np.int64),
+            np.array(speed, dtype=np.float32),
+            np.array(heading, dtype=np.int16),
+            np.array(accuracy, dtype=np.float32),
+            np.array(processed_at, dtype=np.int64),
+            np.array(region, dtype=np.int16),
+            np.array(quality, dtype=np.int16)
+        )
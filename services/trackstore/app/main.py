@@ -5,13 +5,17 @@ Consumes GPS data from Kinesis and stores in DynamoDB
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
 import asyncio
 import logging
 from datetime import datetime
 import os
 
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from . import aws_clients, metrics
+from .aws_backends import ThreadedBackend, create_backend
 from .config import settings
 from .kinesis_consumer import KinesisConsumer
 from .models import LocationRecord, DeviceStatus, HealthStatus
@@ -25,29 +29,57 @@ logger = logging.getLogger(__name__)
 kinesis_consumer = None
 dynamo_store = None
 consumer_task = None
+aws_backend = None
+consumer_metrics = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle"""
-    global kinesis_consumer, dynamo_store, consumer_task
+    global kinesis_consumer, dynamo_store, consumer_task, aws_backend, consumer_metrics
     
     # Startup
     logger.info("Starting TrackStore service...")
     
+    # AWS clients shared by the store and the consumer: boto3 on a thread pool, or aiobotocore
+    aws_config = aws_clients.client_config(
+        max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+        max_attempts=settings.AWS_MAX_ATTEMPTS,
+        connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_READ_TIMEOUT
+    )
+    aws_backend = create_backend(settings.AWS_BACKEND, settings.AWS_REGION, aws_config)
+    await aws_backend.start()
+    if isinstance(aws_backend, ThreadedBackend):
+        metrics.watch_executor(aws_backend.executor)
+    logger.info(f"Using {settings.AWS_BACKEND} AWS backend")
+    
     # Initialize DynamoDB store
     dynamo_store = DynamoStore(
         device_table=settings.DEVICE_TABLE_NAME,
         location_table=settings.LOCATION_TABLE_NAME,
-        region=settings.AWS_REGION
+        region=settings.AWS_REGION,
+        backend=aws_backend
     )
     
     # Initialize Kinesis consumer
     kinesis_consumer = KinesisConsumer(
         stream_name=settings.KINESIS_STREAM_NAME,
         region=settings.AWS_REGION,
-        dynamo_store=dynamo_store
+        dynamo_store=dynamo_store,
+        max_lag_ms=settings.KINESIS_MAX_LAG_MS,
+        latency_window_s=settings.LATENCY_WINDOW_SECONDS,
+        dedup_cache_size=settings.DEDUP_CACHE_SIZE,
+        smoothing_enabled=settings.SMOOTHING_ENABLED,
+        smoothing_process_noise=settings.SMOOTHING_PROCESS_NOISE,
+        smoothing_max_speed_kmh=settings.SMOOTHING_MAX_SPEED_KMH,
+        deadband_distance_m=settings.DEADBAND_MIN_DISTANCE_M,
+        deadband_heading_deg=settings.DEADBAND_MIN_HEADING_DEG,
+        deadband_interval_s=settings.DEADBAND_MAX_INTERVAL_S,
+        backend=aws_backend
     )
     
+    consumer_metrics = metrics.register_consumer(kinesis_consumer)
+    
     # Start consuming in background
     consumer_task = asyncio.create_task(kinesis_consumer.start_consuming())
     logger.info("Started Kinesis consumer")
@@ -64,6 +96,10 @@ async def lifespan(app: FastAPI):
             await consumer_task
         except asyncio.CancelledError:
             pass
+    if consumer_metrics:
+        REGISTRY.unregister(consumer_metrics)
+    if aws_backend:
+        await aws_backend.close()
 
 # Create FastAPI app
 app = FastAPI(
@@ -141,17 +177,23 @@ async def health_check():
         )
 
 @app.get("/metrics")
-async def metrics():
+async def metrics_endpoint():
     """Prometheus metrics endpoint"""
     if not kinesis_consumer:
         return JSONResponse(content={"error": "Service not initialized"}, status_code=503)
     
-    return JSONResponse(content={
-        "records_processed": kinesis_consumer.records_processed,
-        "errors": kinesis_consumer.error_count,
-        "last_sequence_number": kinesis_consumer.last_sequence_number,
-        "consumer_lag_ms": kinesis_consumer.get_lag_ms()
-    })
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/latency")
+async def latency():
+    """Per-hop latency percentiles (ms) of fixes from the device to DynamoDB, over a rolling window"""
+    if not kinesis_consumer:
+        return JSONResponse(content={"error": "Service not initialized"}, status_code=503)
+    
+    return {
+        "window_seconds": kinesis_consumer.latency.window_seconds,
+        "hops": kinesis_consumer.latency.summary()
+    }
 
 @app.get("/locations/{device_id}", response_model=list[LocationRecord])
 async def get_device_locations(
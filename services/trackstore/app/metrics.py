@@ -0,0 +1,115 @@
+"""
+Prometheus metrics for TrackStore
+
+Per-stage latency histograms are observed once per batch or AWS call, never
+per record, so instrumentation stays off the per-fix path. Throttles are
+counted from botocore's retry events, so those retried inside the client
+are included, not just the ones that surface as errors.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+THROTTLE_CODES = frozenset((
+    'ThrottlingException', 'Throttling', 'ThrottledException', 'RequestThrottledException',
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'LimitExceededException',
+    'TooManyRequestsException', 'SlowDown',
+))
+
+GET_RECORDS_SECONDS = Histogram(
+    'trackstore_get_records_seconds', 'Kinesis GetRecords latency', ['shard']
+)
+RECORDS_PER_BATCH = Histogram(
+    'trackstore_records_per_batch', 'Kinesis records returned per GetRecords call', buckets=BATCH_SIZE_BUCKETS
+)
+MILLIS_BEHIND_LATEST = Gauge(
+    'trackstore_millis_behind_latest', 'MillisBehindLatest from the last GetRecords call', ['shard']
+)
+RECORD_AGE_SECONDS = Histogram(
+    'trackstore_record_age_seconds', 'Age of the oldest record in each batch, from ApproximateArrivalTimestamp',
+    ['shard'], buckets=LAG_BUCKETS
+)
+INGEST_DELAY_SECONDS = Histogram(
+    'trackstore_ingest_delay_seconds', 'ApproximateArrivalTimestamp minus device ts for the newest fix in each batch',
+    ['shard'], buckets=LAG_BUCKETS
+)
+DECODE_SECONDS = Histogram(
+    'trackstore_decode_seconds', 'Time to decode a batch of Kinesis records', buckets=FAST_BUCKETS
+)
+BATCH_WRITE_SECONDS = Histogram(
+    'trackstore_batch_write_seconds', 'Time to write a batch of locations'
+)
+DEVICE_UPDATE_SECONDS = Histogram(
+    'trackstore_device_update_seconds', 'Latency of one device status update'
+)
+AWS_THROTTLES = Counter(
+    'trackstore_aws_throttles', 'Throttled AWS calls, including those retried by the client',
+    ['service', 'operation']
+)
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    'trackstore_executor_queue_depth', 'Blocking AWS calls waiting for an executor thread'
+)
+
+
+def _count_throttle(response=None, operation=None, **kwargs):
+    if response is None:
+        return None
+    code = response[1].get('Error', {}).get('Code')
+    if code in THROTTLE_CODES:
+        AWS_THROTTLES.labels(operation.service_model.service_id.hyphenize(), operation.name).inc()
+    return None  # never decides on the retry itself
+
+
+def instrument_client(client: Any):
+    """Count throttled responses from a boto3 or aiobotocore client"""
+    client.meta.events.register('needs-retry', _count_throttle)
+
+
+def watch_executor(executor: ThreadPoolExecutor):
+    """Report how many calls are queued behind `executor`'s threads"""
+    EXECUTOR_QUEUE_DEPTH.set_function(lambda: executor._work_queue.qsize())
+
+
+class ConsumerCollector:
+    """The Kinesis consumer's running counts, read at scrape time"""
+
+    def __init__(self, consumer: Any):
+        self.consumer = consumer
+
+    def collect(self):
+        consumer = self.consumer
+        for name, documentation, value in (
+            ('trackstore_records_processed', 'Locations stored', consumer.records_processed),
+            ('trackstore_duplicates_dropped', 'Redelivered fixes dropped', consumer.duplicates_dropped),
+            ('trackstore_outliers_rejected', 'Fixes flagged as outliers', consumer.outliers_rejected),
+            ('trackstore_fixes_suppressed', 'Stationary fixes skipped by the dead-band filter',
+             consumer.fixes_suppressed),
+            ('trackstore_consumer_errors', 'Undecodable records and consumer errors', consumer.error_count),
+        ):
+            yield CounterMetricFamily(name, documentation, value=value)
+        lag_ms = consumer.get_lag_ms()
+        if lag_ms is not None:
+            yield GaugeMetricFamily('trackstore_consumer_lag_seconds',
+                                    'Largest MillisBehindLatest across shards', value=lag_ms / 1000)
+        since_poll = GaugeMetricFamily('trackstore_seconds_since_poll',
+                                       'Time since the last successful GetRecords call', labels=['shard'])
+        failed = GaugeMetricFamily('trackstore_shard_failed',
+                                   '1 if reading the shard stopped on an error', labels=['shard'])
+        for shard_id, lag in list(consumer.shard_lag.items()):
+            since_poll.add_metric([shard_id], lag.seconds_since_poll())
+            failed.add_metric([shard_id], 1 if lag.error else 0)
+        yield since_poll
+        yield failed
+
+
+def register_consumer(consumer: Any) -> ConsumerCollector:
+    collector = ConsumerCollector(consumer)
+    REGISTRY.register(collector)
+    return collector
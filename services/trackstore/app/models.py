@@ -25,6 +25,33 @@ class LocationRecord(BaseModel):
             datetime: lambda v: int(v.timestamp() * 1000)
         }
 
+class Fix:
+    """
+    Lightweight location fix, one row of a LocationBatch.
+    
+    Has the same attribute names as LocationRecord, so code that handles one
+    fix at a time accepts either; Pydantic models are only built for API responses.
+    """
+    __slots__ = (
+        'device_id', 'latitude', 'longitude', 'timestamp', 'speed',
+        'heading', 'accuracy', 'processed_at', 'region', 'quality_score'
+    )
+    
+    def __init__(self, device_id: str, latitude: float, longitude: float, timestamp: int,
+                 speed: Optional[float] = None, heading: Optional[int] = None,
+                 accuracy: Optional[float] = None, processed_at: Optional[int] = None,
+                 region: Optional[str] = None, quality_score: Optional[str] = None):
+        self.device_id = device_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.speed = speed
+        self.heading = heading
+        self.accuracy = accuracy
+        self.processed_at = processed_at
+        self.region = region
+        self.quality_score = quality_score
+
 class DeviceStatus(BaseModel):
     """Device status information"""
     device_id: str
@@ -0,0 +1,175 @@
+"""
+GPS smoothing and outlier rejection for TrackStore
+A constant-velocity Kalman filter per device, with measurement noise taken
+from each fix's reported accuracy, run across all devices in a batch at once
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .deadband import METERS_PER_DEGREE
+from .location_batch import FLAG_OUTLIER, FLAG_SMOOTHED, LocationBatch
+
+
+class KalmanSmoother:
+    """
+    Replaces each fix's position with the filtered estimate and flags fixes
+    that imply an impossible speed.
+
+    Each device has an independent constant-velocity model per axis (east and
+    north, in metres) driven by white-noise acceleration of spectral density
+    `process_noise` (m^2/s^3). A fix's measurement variance is its accuracy
+    squared. A fix more than `max_speed_kmh` away from the previous estimate
+    is flagged FLAG_OUTLIER and leaves the state untouched, unless
+    `max_rejects` have been rejected in a row, in which case the device is
+    assumed to have really moved and its track restarts there. Tracks also
+    restart after `max_gap_s` without fixes. Fixes older than the device's
+    state pass through unchanged.
+
+    Batches are processed in rounds: round k takes every device's k-th fix in
+    time order, so each round is one set of array operations over devices.
+    """
+
+    def __init__(self, process_noise: float = 1.0, max_speed_kmh: float = 150.0,
+                 default_accuracy_m: float = 10.0, min_accuracy_m: float = 3.0,
+                 max_gap_s: float = 300.0, max_rejects: int = 3):
+        self.process_noise = process_noise
+        self.max_speed = max_speed_kmh / 3.6
+        self.default_accuracy_m = default_accuracy_m
+        self.min_accuracy_m = min_accuracy_m
+        self.max_gap_s = max_gap_s
+        self.max_rejects = max_rejects
+
+        self._slots: Dict[str, int] = {}
+        capacity = 64
+        self._active = np.zeros(capacity, dtype=bool)
+        self._ts = np.zeros(capacity, dtype=np.int64)
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._ve = np.zeros(capacity)   # m/s east
+        self._vn = np.zeros(capacity)   # m/s north
+        self._p00 = np.zeros(capacity)  # position variance, m^2 (same for both axes)
+        self._p01 = np.zeros(capacity)  # position-velocity covariance
+        self._p11 = np.zeros(capacity)  # velocity variance, (m/s)^2
+        self._rejects = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _state_slots(self, batch: LocationBatch) -> np.ndarray:
+        """Per-row index into the state arrays, allocating slots for new devices"""
+        table = np.array([self._slots.setdefault(d, len(self._slots)) for d in batch.device_ids],
+                         dtype=np.int64)
+        if len(self._slots) > len(self._active):
+            grow = max(len(self._slots), 2 * len(self._active)) - len(self._active)
+            for name in ('_active', '_ts', '_lat', '_lon', '_ve', '_vn', '_p00', '_p01', '_p11', '_rejects'):
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate((column, np.zeros(grow, dtype=column.dtype))))
+        return table[batch.device_idx]
+
+    def filter(self, batch: LocationBatch) -> Tuple[LocationBatch, int]:
+        """Return the batch with smoothed positions and outliers flagged, and the number flagged"""
+        n = len(batch)
+        if not n:
+            return batch, 0
+
+        slots = self._state_slots(batch)
+        order = np.lexsort((batch.ts, slots))
+        sorted_slots = slots[order]
+        starts = np.flatnonzero(np.append(True, sorted_slots[1:] != sorted_slots[:-1]))
+        rank = np.arange(n) - np.repeat(starts, np.diff(np.append(starts, n)))
+        by_round = order[np.argsort(rank, kind='stable')]
+        round_sizes = np.bincount(rank)
+
+        accuracy = np.where(np.isnan(batch.accuracy), self.default_accuracy_m, batch.accuracy)
+        variance = np.maximum(accuracy, self.min_accuracy_m).astype(np.float64) ** 2
+        lat = batch.lat.copy()
+        lon = batch.lon.copy()
+        flags = batch.flags.copy()
+
+        begin = 0
+        for size in round_sizes.tolist():
+            rows = by_round[begin:begin + size]
+            begin += size
+            self._step(rows, slots[rows], batch, variance, lat, lon, flags)
+
+        rejected = int(np.count_nonzero(flags & FLAG_OUTLIER))
+        return batch.with_columns(lat=lat, lon=lon, flags=flags), rejected
+
+    def _step(self, rows: np.ndarray, s: np.ndarray, batch: LocationBatch, variance: np.ndarray,
+              lat: np.ndarray, lon: np.ndarray, flags: np.ndarray):
+        """Advance one fix for each of a set of distinct devices"""
+        z_lat = batch.lat[rows]
+        z_lon = batch.lon[rows]
+        ts = batch.ts[rows]
+        r = variance[rows]
+
+        active = self._active[s]
+        dt = (ts - self._ts[s]) / 1000.0
+        stale = active & (dt <= 0)
+        restart = ~active | (dt > self.max_gap_s)
+
+        # Implied speed from the previous estimate
+        cos_lat = np.cos(np.radians(z_lat))
+        dn = (z_lat - self._lat[s]) * METERS_PER_DEGREE
+        de = (z_lon - self._lon[s]) * METERS_PER_DEGREE * cos_lat
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jump = np.hypot(dn, de) / dt > self.max_speed
+        jump &= ~stale & ~restart
+        give_up = jump & (self._rejects[s] + 1 >= self.max_rejects)
+        reject = jump & ~give_up
+        restart |= give_up
+        update = ~stale & ~restart & ~reject
+
+        self._rejects[s[reject]] += 1
+        flags[rows[reject]] |= FLAG_OUTLIER
+
+        # (Re)start tracks at the measurement
+        rs = s[restart]
+        self._active[rs] = True
+        self._ts[rs] = ts[restart]
+        self._lat[rs] = z_lat[restart]
+        self._lon[rs] = z_lon[restart]
+        self._ve[rs] = 0.0
+        self._vn[rs] = 0.0
+        self._p00[rs] = r[restart]
+        self._p01[rs] = 0.0
+        self._p11[rs] = (self.max_speed / 3) ** 2
+        self._rejects[rs] = 0
+
+        if not update.any():
+            return
+
+        # Predict
+        i, us = rows[update], s[update]
+        dt = dt[update]
+        q = self.process_noise
+        p00 = self._p00[us] + dt * (2 * self._p01[us] + dt * self._p11[us]) + q * dt ** 3 / 3
+        p01 = self._p01[us] + dt * self._p11[us] + q * dt ** 2 / 2
+        p11 = self._p11[us] + q * dt
+        cos_lat = cos_lat[update]
+        pred_n = self._vn[us] * dt
+        pred_e = self._ve[us] * dt
+
+        # Update with the measured offset from the previous estimate, in metres
+        k0 = p00 / (p00 + r[update])
+        k1 = p01 / (p00 + r[update])
+        innov_n = dn[update] - pred_n
+        innov_e = de[update] - pred_e
+        est_n = pred_n + k0 * innov_n
+        est_e = pred_e + k0 * innov_e
+
+        self._lat[us] += est_n / METERS_PER_DEGREE
+        self._lon[us] += est_e / (METERS_PER_DEGREE * cos_lat)
+        self._vn[us] += k1 * innov_n
+        self._ve[us] += k1 * innov_e
+        self._p11[us] = p11 - k1 * p01
+        self._p01[us] = (1 - k0) * p01
+        self._p00[us] = (1 - k0) * p00
+        self._ts[us] = ts[update]
+        self._rejects[us] = 0
+
+        lat[i] = self._lat[us]
+        lon[i] = self._lon[us]
+        flags[i] |= FLAG_SMOOTHED
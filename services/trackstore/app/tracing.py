@@ -0,0 +1,88 @@
+"""
+End-to-end latency of fixes through TrackStore
+Each fix is stamped along its path and the time spent in each hop is kept in
+a rolling window, so percentiles show where the freshness budget goes:
+
+    ingest    device ts to processed_at, stamped by the ingestion Lambda
+              (includes the device uplink and IoT Core)
+    kinesis   processed_at to ApproximateArrivalTimestamp (PutRecords)
+    consumer  arrival to decoded: time waiting in the shard, GetRecords
+              and decode
+    commit    decoded to stored: filters, the DynamoDB batch write and
+              device status updates
+    total     device ts to stored
+
+Latencies are added a batch at a time as numpy arrays, so the per-fix cost
+is a few vector operations. Device and host clocks are not synchronised, so
+hops that span them (ingest, total) include any clock skew.
+"""
+
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+from .location_batch import LocationBatch
+
+HOPS = ('ingest', 'kinesis', 'consumer', 'commit', 'total')
+PERCENTILES = (50, 90, 99)
+WINDOW_SECONDS = 300.0
+MAX_SAMPLES = 200_000  # per hop; the oldest batches are dropped first
+
+
+def now_ms() -> float:
+    return time.time() * 1000
+
+
+class LatencyWindow:
+    """Per-hop latencies (ms) over the last `window_seconds`"""
+
+    def __init__(self, window_seconds: float = WINDOW_SECONDS, max_samples: int = MAX_SAMPLES):
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self._samples: Dict[str, Deque[Tuple[float, np.ndarray]]] = {hop: deque() for hop in HOPS}
+        self._counts: Dict[str, int] = dict.fromkeys(HOPS, 0)
+
+    def add(self, hop: str, latencies_ms: np.ndarray):
+        latencies_ms = latencies_ms[~np.isnan(latencies_ms)]
+        if not len(latencies_ms):
+            return
+        self._samples[hop].append((time.monotonic(), latencies_ms.astype(np.float32)))
+        self._counts[hop] += len(latencies_ms)
+        self._prune(hop)
+
+    def _prune(self, hop: str):
+        samples = self._samples[hop]
+        cutoff = time.monotonic() - self.window_seconds
+        while samples and (samples[0][0] < cutoff or self._counts[hop] - len(samples[0][1]) >= self.max_samples):
+            self._counts[hop] -= len(samples.popleft()[1])
+
+    def record_decoded(self, batch: LocationBatch, arrivals_ms: Optional[np.ndarray], decoded_ms: float):
+        """Hops up to decode, for every fix read; `arrivals_ms` as from decode_records_with_arrivals"""
+        stamped = batch.processed_at > 0
+        processed = batch.processed_at[stamped].astype(np.float64)
+        self.add('ingest', processed - batch.ts[stamped])
+        if arrivals_ms is not None:
+            self.add('kinesis', arrivals_ms[stamped] - processed)
+            self.add('consumer', decoded_ms - arrivals_ms)
+
+    def record_stored(self, batch: LocationBatch, decoded_ms: float, stored_ms: float):
+        """Hops after decode, for the fixes written"""
+        self.add('commit', np.full(len(batch), stored_ms - decoded_ms))
+        self.add('total', stored_ms - batch.ts.astype(np.float64))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count, p50, p90, p99 and max (ms) for each hop with samples in the window"""
+        hops = {}
+        for hop in HOPS:
+            self._prune(hop)
+            if not self._samples[hop]:
+                continue
+            values = np.concatenate([latencies for _, latencies in self._samples[hop]])
+            stats = {'count': int(len(values))}
+            for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()):
+                stats[f'p{q}'] = round(value, 1)
+            stats['max'] = round(float(values.max()), 1)
+            hops[hop] = stats
+        return hops
@@ -23,7 +23,7 @@ def test_metrics():
     print("Testing metrics endpoint...")
     response = requests.get(f"{BASE_URL}/metrics")
     print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}\n")
+    print(f"Response:\n{response.text}\n")
 
 def test_get_devices():
     """Test get all devices"""
@@ -0,0 +1,58 @@
+"""
+Dead-band filter: a bus standing still is suppressed, except for one fix
+per keepalive interval, while moving or turning buses are kept
+"""
+
+from app.deadband import DeadbandFilter
+from app.location_batch import LocationBatch
+
+METERS_PER_DEGREE = 111_320.0
+
+
+def batch(*fixes):
+    locations, rejected = LocationBatch.from_messages([
+        {'busId': 'bus-1', 'lat': 37.7 + north_m / METERS_PER_DEGREE, 'lon': -122.4, 'ts': ts, 'heading': heading}
+        for north_m, heading, ts in fixes
+    ])
+    assert rejected == 0
+    return locations
+
+
+def test_stationary_fixes_are_suppressed():
+    deadband = DeadbandFilter(min_distance_m=15.0, min_heading_deg=20.0, max_interval_s=60.0)
+    kept, suppressed = deadband.filter(batch(*[(i % 3, 90, 5_000 * i) for i in range(6)]))
+
+    assert suppressed == 5
+    assert kept.ts.tolist() == [0]
+
+
+def test_keepalive_fix_after_the_interval():
+    deadband = DeadbandFilter(min_distance_m=15.0, min_heading_deg=20.0, max_interval_s=60.0)
+    # Parked for three minutes, reporting every 10 s
+    kept, suppressed = deadband.filter(batch(*[(0, 90, 10_000 * i) for i in range(19)]))
+
+    assert kept.ts.tolist() == [0, 60_000, 120_000, 180_000]
+    assert suppressed == 15
+
+
+def test_moving_or_turning_fixes_are_kept():
+    deadband = DeadbandFilter(min_distance_m=15.0, min_heading_deg=20.0, max_interval_s=60.0)
+    kept, suppressed = deadband.filter(batch(
+        (0, 90, 0),
+        (20, 90, 1_000),   # moved 20 m
+        (25, 90, 2_000),   # 5 m: suppressed
+        (25, 120, 3_000),  # turned 30 degrees
+        (25, 350, 4_000),  # turned 130 degrees
+        (25, 5, 5_000),    # 15 degrees across north: suppressed
+    ))
+
+    assert kept.ts.tolist() == [0, 1_000, 3_000, 4_000]
+    assert suppressed == 2
+
+
+def test_zero_distance_keeps_everything():
+    deadband = DeadbandFilter(min_distance_m=0.0)
+    kept, suppressed = deadband.filter(batch(*[(0, 90, 1_000 * i) for i in range(5)]))
+
+    assert suppressed == 0
+    assert len(kept) == 5
@@ -0,0 +1,45 @@
+"""
+Duplicate filter: repeats of a (device, ts) are dropped within and across
+batches, and the LRU forgets the least recently seen keys first
+"""
+
+from app.dedup import FixDeduplicator
+from app.location_batch import LocationBatch
+
+
+def batch(*keys):
+    locations, rejected = LocationBatch.from_messages(
+        [{'busId': bus, 'lat': 37.7, 'lon': -122.4, 'ts': ts} for bus, ts in keys]
+    )
+    assert rejected == 0
+    return locations
+
+
+def test_repeats_within_a_batch_keep_the_first():
+    dedup = FixDeduplicator(capacity=10)
+    kept, dropped = dedup.filter(batch(('bus-1', 1), ('bus-2', 1), ('bus-1', 1), ('bus-1', 2)))
+
+    assert dropped == 1
+    assert [(fix.device_id, fix.timestamp) for fix in kept] == [('bus-1', 1), ('bus-2', 1), ('bus-1', 2)]
+
+
+def test_redelivery_in_a_later_batch_is_dropped():
+    dedup = FixDeduplicator(capacity=10)
+    dedup.filter(batch(('bus-1', 1), ('bus-1', 2)))
+    kept, dropped = dedup.filter(batch(('bus-1', 2), ('bus-1', 3)))
+
+    assert dropped == 1
+    assert kept.ts.tolist() == [3]
+
+
+def test_lru_evicts_least_recently_seen():
+    dedup = FixDeduplicator(capacity=3)
+    dedup.filter(batch(('bus-1', 1), ('bus-1', 2), ('bus-1', 3)))
+    # Seeing ts=1 again refreshes it, so ts=2 is now the oldest
+    assert dedup.filter(batch(('bus-1', 1)))[1] == 1
+    dedup.filter(batch(('bus-1', 4)))
+
+    assert len(dedup) == 3
+    kept, dropped = dedup.filter(batch(('bus-1', 1), ('bus-1', 2), ('bus-1', 3), ('bus-1', 4)))
+    assert kept.ts.tolist() == [2]
+    assert dropped == 3
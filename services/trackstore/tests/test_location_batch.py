@@ -0,0 +1,58 @@
+"""
+Columnar batches: malformed fixes are rejected one by one, so the rest of a
+Kinesis batch still gets stored, and rows read back as the fixes that went in
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from app.location_batch import MISSING, LocationBatch
+
+
+def fix(**fields):
+    return {'busId': 'bus-1', 'lat': 37.7, 'lon': -122.4, 'ts': 1_000, **fields}
+
+
+def test_rows_read_back_as_fixes():
+    batch, rejected = LocationBatch.from_messages([
+        fix(speed=12.3, heading=90, accuracy=5.0, processed_at=1_050, region='san_francisco', quality_score='high'),
+        fix(busId='bus-2', ts=2_000),
+    ])
+
+    assert rejected == 0
+    first, second = batch
+    assert (first.device_id, first.speed, first.heading, first.accuracy) == ('bus-1', 12.3, 90, 5.0)
+    assert (first.processed_at, first.region, first.quality_score) == (1_050, 'san_francisco', 'high')
+    assert (second.device_id, second.speed, second.heading, second.processed_at) == ('bus-2', None, None, None)
+    assert batch.heading[1] == MISSING
+    assert np.isnan(batch.speed[1])
+
+
+@pytest.mark.parametrize('bad', [
+    {'lat': None},
+    {'lon': None},
+    {'lat': math.nan},
+    {'lon': math.inf},
+    {'speed': math.inf},
+    {'accuracy': -math.inf},
+    {'heading': 400},
+    {'busId': 42},
+    {'ts': None},
+])
+def test_malformed_fix_is_rejected_alone(bad):
+    batch, rejected = LocationBatch.from_messages([fix(ts=1), {**fix(ts=2), **bad}, fix(ts=3)])
+
+    assert rejected == 1
+    assert batch.ts.tolist() == [1, 3]
+    assert np.isfinite(batch.lat).all() and np.isfinite(batch.lon).all()
+
+
+def test_missing_field_is_rejected():
+    message = fix()
+    del message['lat']
+    batch, rejected = LocationBatch.from_messages([message, fix(ts=2)])
+
+    assert rejected == 1
+    assert batch.ts.tolist() == [2]
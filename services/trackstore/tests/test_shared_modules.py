@@ -0,0 +1,40 @@
+"""
+Modules copied verbatim into each component that is packaged on its own
+must stay identical, or the components drift apart (a frame one encodes
+that another cannot read, clients tuned differently)
+"""
+
+import hashlib
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+COPIES = {
+    'telemetry_codec.py': [
+        'device-sim',
+        'services/ingestion-lambda/src',
+        'services/geofence-alerts/src',
+        'services/trackstore/app',
+    ],
+    'aws_clients.py': [
+        'services/ingestion-lambda/src',
+        'services/geofence-alerts/src',
+        'services/trackstore/app',
+    ],
+    'latency_trace.py': [
+        'services/ingestion-lambda/src',
+        'services/geofence-alerts/src',
+    ],
+}
+
+
+@pytest.mark.parametrize('module', sorted(COPIES))
+def test_copies_are_identical(module):
+    digests = {}
+    for directory in COPIES[module]:
+        with open(os.path.join(ROOT, directory, module), 'rb') as f:
+            digests[directory] = hashlib.sha256(f.read()).hexdigest()
+
+    assert len(set(digests.values())) == 1, f"{module} copies differ: {digests}"
@@ -0,0 +1,66 @@
+"""
+Kalman smoother: implausible jumps are flagged and leave the track alone,
+and a bus that keeps reporting from somewhere else restarts its track there
+"""
+
+import numpy as np
+
+from app.location_batch import FLAG_OUTLIER, FLAG_SMOOTHED, LocationBatch
+from app.smoothing import KalmanSmoother
+
+METERS_PER_DEGREE = 111_320.0
+
+
+def batch(*fixes):
+    locations, rejected = LocationBatch.from_messages(
+        [{'busId': bus, 'lat': lat, 'lon': -122.4, 'ts': ts, 'accuracy': 5.0} for bus, lat, ts in fixes]
+    )
+    assert rejected == 0
+    return locations
+
+
+def north(metres):
+    return 37.7 + metres / METERS_PER_DEGREE
+
+
+def test_jump_is_flagged_and_does_not_move_the_track():
+    smoother = KalmanSmoother(max_speed_kmh=150.0)
+    # 10 m/s north, then 5 km in one second, then back on course
+    fixes = [('bus-1', north(10 * i), 1_000 * i) for i in range(5)]
+    fixes.append(('bus-1', north(5_000), 5_000))
+    fixes.append(('bus-1', north(60), 6_000))
+    smoothed, rejected = smoother.filter(batch(*fixes))
+
+    assert rejected == 1
+    assert smoothed.flags[5] & FLAG_OUTLIER
+    assert smoothed.lat[5] == north(5_000)  # passed through as reported
+    assert not smoothed.flags[6] & FLAG_OUTLIER
+    assert smoothed.flags[6] & FLAG_SMOOTHED
+    assert abs(smoothed.lat[6] - north(60)) * METERS_PER_DEGREE < 10
+
+
+def test_repeated_jumps_restart_the_track():
+    smoother = KalmanSmoother(max_speed_kmh=150.0, max_rejects=3)
+    smoother.filter(batch(('bus-1', north(0), 0), ('bus-1', north(10), 1_000)))
+
+    # The bus really is 5 km away: the first two are rejected, the third restarts the track
+    moved = batch(*[('bus-1', north(5_000 + 10 * i), 2_000 + 1_000 * i) for i in range(4)])
+    smoothed, rejected = smoother.filter(moved)
+
+    assert rejected == 2
+    assert (smoothed.flags[:2] & FLAG_OUTLIER).all()
+    assert not (smoothed.flags[2:] & FLAG_OUTLIER).any()
+    assert smoothed.lat[2] == north(5_020)
+    assert abs(smoothed.lat[3] - north(5_030)) * METERS_PER_DEGREE < 10
+
+
+def test_devices_are_filtered_independently():
+    smoother = KalmanSmoother(max_speed_kmh=150.0)
+    smoothed, rejected = smoother.filter(batch(
+        ('bus-1', north(0), 0), ('bus-2', north(0), 0),
+        ('bus-1', north(10), 1_000), ('bus-2', north(5_000), 1_000)
+    ))
+
+    assert rejected == 1
+    assert np.flatnonzero(smoothed.flags & FLAG_OUTLIER).tolist() == [3]
+    assert len(smoother) == 2
@@ -0,0 +1,23 @@
+"""
+Startup smoke test: the app's lifespan runs and its endpoints respond,
+with boto3 stubbed out so no AWS access is needed
+"""
+
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app import aws_clients, main
+
+
+def test_app_starts_and_serves_metrics():
+    with mock.patch.object(aws_clients, "client"), mock.patch.object(aws_clients, "resource"):
+        with TestClient(main.app) as client:
+            assert client.get("/").status_code == 200
+            assert client.get("/health").status_code in (200, 503)
+
+            response = client.get("/metrics")
+            assert response.status_code == 200
+            assert "trackstore_records_processed_total" in response.text
+
+            assert client.get("/latency").status_code == 200
@@ -0,0 +1,65 @@
+"""
+Binary telemetry frames: fixes survive a round trip at the codec's
+precision, and values it cannot represent are dropped rather than corrupted
+"""
+
+import json
+
+import pytest
+
+from app import telemetry_codec
+from app.decoding import decode_records
+
+
+def test_round_trip_keeps_every_field():
+    fixes = [
+        {'busId': 'bus-1', 'lat': 37.7749295, 'lon': -122.4194155, 'ts': 1_700_000_000_000,
+         'speed': 42.5, 'heading': 270, 'accuracy': 4.8, 'processed_at': 1_700_000_000_120,
+         'region': 'san_francisco', 'quality_score': 'high'},
+        {'busId': 'bus-2', 'lat': -33.8688197, 'lon': 151.2092955, 'ts': 1_700_000_000_500},
+        {'busId': 'bus-1', 'lat': 37.7750001, 'lon': -122.4193, 'ts': 1_700_000_001_000,
+         'speed': 0.0, 'heading': 0, 'region': 'other', 'quality_score': 'low'},
+    ]
+    frame = telemetry_codec.encode(fixes)
+
+    assert telemetry_codec.is_binary(frame)
+    assert telemetry_codec.decode(frame) == fixes
+
+
+def test_heading_just_below_360_stays_in_range():
+    frame = telemetry_codec.encode([{'busId': 'bus-1', 'lat': 0.0, 'lon': 0.0, 'ts': 0, 'heading': 359.9}])
+
+    assert telemetry_codec.decode(frame)[0]['heading'] == 359
+
+
+def test_unknown_region_and_quality_are_dropped():
+    frame = telemetry_codec.encode([{'busId': 'bus-1', 'lat': 0.0, 'lon': 0.0, 'ts': 0,
+                                     'region': 'waterloo', 'quality_score': 'excellent'}])
+
+    fix = telemetry_codec.decode(frame)[0]
+    assert 'region' not in fix
+    assert 'quality_score' not in fix
+
+
+def test_json_payloads_decode_to_fix_lists():
+    fix = {'busId': 'bus-1', 'lat': 1.0, 'lon': 2.0, 'ts': 3}
+
+    assert telemetry_codec.decode(json.dumps(fix).encode()) == [fix]
+    assert telemetry_codec.decode(json.dumps([fix, fix])) == [fix, fix]
+    assert telemetry_codec.decode(json.dumps({'fixes': [fix]}).encode()) == [fix]
+
+
+@pytest.mark.parametrize('frame', [b'\x01\x02', b'\x01\x01\x00\x01\x00\x05bus', b'\x02\x01\x00\x00\x00'])
+def test_malformed_frames_raise_codec_error(frame):
+    with pytest.raises(telemetry_codec.CodecError):
+        telemetry_codec.decode(frame)
+
+
+def test_consumer_decodes_binary_and_json_records_together():
+    binary = telemetry_codec.encode([{'busId': 'bus-1', 'lat': 1.0, 'lon': 2.0, 'ts': 3},
+                                     {'busId': 'bus-2', 'lat': 4.0, 'lon': 5.0, 'ts': 6}])
+    records = [{'Data': binary}, {'Data': json.dumps({'busId': 'bus-3', 'lat': 7.0, 'lon': 8.0, 'ts': 9}).encode()}]
+    batch, errors = decode_records(records)
+
+    assert errors == 0
+    assert [fix.device_id for fix in batch] == ['bus-1', 'bus-2', 'bus-3']